@@ -1,44 +1,269 @@
+from collections import Counter
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import Deck, Flashcard, StudySession, DeckComment, DeckLike
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils.functional import cached_property
+from . import duplicates, search
+from .models import Deck, Flashcard, StudySession, DeckComment, DeckLike, ImportJob, Tombstone
+
+
+def exact_count_limit():
+    return getattr(settings, 'FLASHCARDS_ADMIN_EXACT_COUNT_LIMIT', 100000)
+
+
+def estimated_count(model):
+    """
+    Rows in ``model``'s table according to the database statistics, or None
+    without statistics: ``pg_class.reltuples`` on PostgreSQL, and on SQLite
+    the ``sqlite_stat1`` table that ``ANALYZE`` writes.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            # -1 until the table is first vacuumed or analyzed
+            return int(row[0]) if row is not None and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            except DatabaseError:
+                # No ANALYZE has run yet
+                return None
+            # Each index row starts with the number of rows it covers
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that counts an unfiltered changelist from the table statistics
+    once they put the table over FLASHCARDS_ADMIN_EXACT_COUNT_LIMIT rows.
+    Filtered and searched changelists are counted exactly.
+    """
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > exact_count_limit():
+                return estimate
+        return super().count
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """
+    Foreign key filter showing the autocomplete widget, which looks related
+    rows up as the user types, rather than a link to every one of them. The
+    related model's admin needs ``search_fields``.
+    """
+    template = 'admin/flashcards/autocomplete_filter.html'
+    
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.chooser = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+    
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+    
+    def choices(self, changelist):
+        value = self.used_parameters.get(self.lookup_kwarg)
+        # Only the selected row is read, to label the widget
+        yield {
+            'selected': bool(value),
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'widget': self.chooser.widget.render(self.lookup_kwarg, value[-1] if value else None),
+        }
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist for tables that grow to millions of rows: estimated counts
+    (see EstimatedCountPaginator), no second ``COUNT(*)`` for the total
+    beside a filtered count, no facet counts, and search through indexes.
+    
+    ``search_indexes`` maps a lookup to the FTS table whose rowids it holds
+    (see search.py) and ``search_exact`` lists lookups compared with the
+    whole search term, such as unique usernames. Without FTS support the
+    plain ``search_fields`` are searched.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    search_indexes = {}
+    search_exact = []
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term or not self.search_indexes or not search.is_supported():
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q()
+        for lookup, fts in self.search_indexes.items():
+            match = search.rowids(fts, term)
+            if match is not None:
+                condition |= Q(**{f'{lookup}__in': match})
+        for lookup in self.search_exact:
+            condition |= Q(**{lookup: term})
+        if not condition:
+            return queryset.none(), False
+        return queryset.filter(condition), False
+    
+    @property
+    def media(self):
+        media = super().media
+        if any(
+            isinstance(entry, tuple) and issubclass(entry[1], AutocompleteFilter)
+            for entry in self.list_filter
+        ):
+            # The filters render the widget outside of any form
+            media += AutocompleteSelect(None, self.admin_site).media
+        return media
 
 
 @admin.register(Deck)
-class DeckAdmin(admin.ModelAdmin):
-    list_display = ['name', 'card_count', 'is_public', 'owner', 'likes_count', 'created_at']
+class DeckAdmin(LargeTableAdmin):
+    list_display = ['name', 'card_count', 'is_public', 'owner', 'likes_count', 'comments_count',
+                    'created_at']
     list_filter = ['is_public', 'created_at']
+    list_select_related = ['owner']
     search_fields = ['name', 'description']
+    search_indexes = {'pk': 'flashcards_deck_fts'}
+    autocomplete_fields = ['owner', 'forked_from']
     readonly_fields = ['created_at', 'updated_at']
     
+    # Read the denormalized counters rather than counting per row
+    def card_count(self, obj):
+        return obj.cards_total
+    card_count.short_description = 'Card count'
+    card_count.admin_order_field = 'cards_total'
+    
     def likes_count(self, obj):
-        return obj.likes.count()
+        return obj.likes_total
     likes_count.short_description = 'Likes'
+    likes_count.admin_order_field = 'likes_total'
+    
+    def comments_count(self, obj):
+        return obj.comments_total
+    comments_count.short_description = 'Comments'
+    comments_count.admin_order_field = 'comments_total'
+    
+    # Go through remove() so deletes are tombstoned for sync and taken off
+    # the owners' stats, as they are when made through the API
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        Deck.objects.filter(pk=obj.pk).remove()
+    
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        queryset.remove()
+
+
+class FlashcardForm(forms.ModelForm):
+    """Edits a card's text rather than picking its CardContent row"""
+    question = forms.CharField(widget=forms.Textarea)
+    answer = forms.CharField(widget=forms.Textarea)
+    
+    class Meta:
+        model = Flashcard
+        exclude = ['content']
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.content_id is not None:
+            self.initial.setdefault('question', self.instance.question)
+            self.initial.setdefault('answer', self.instance.answer)
+    
+    def save(self, commit=True):
+        self.instance.text = (self.cleaned_data['question'], self.cleaned_data['answer'])
+        return super().save(commit)
 
 
 @admin.register(Flashcard)
-class FlashcardAdmin(admin.ModelAdmin):
+class FlashcardAdmin(LargeTableAdmin):
+    form = FlashcardForm
     list_display = ['deck', 'question_preview', 'spaced_repetition', 'order', 'created_at']
-    list_filter = ['spaced_repetition', 'deck', 'created_at']
-    search_fields = ['question', 'answer']
+    list_filter = ['spaced_repetition', ('deck', AutocompleteFilter), 'created_at']
+    search_fields = ['content__question', 'content__answer']
+    search_indexes = {'content_id': 'flashcards_card_fts'}
+    autocomplete_fields = ['deck']
     readonly_fields = ['created_at', 'updated_at']
+    # Newest first along the primary key; the model's deck order needs a deck
+    ordering = ['-pk']
+    
+    def get_queryset(self, request):
+        # Cards come with their content, so the changelist adds no joins itself
+        return super().get_queryset(request).select_related('deck')
     
     def question_preview(self, obj):
         return obj.question[:50] + '...' if len(obj.question) > 50 else obj.question
     question_preview.short_description = 'Question'
+    
+    # Keep deck counters and content versions in step with admin edits
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        previous_deck = form.initial.get('deck') if change else None
+        super().save_model(request, obj, form, change)
+        if not change:
+            Deck.objects.filter(pk=obj.deck_id).record_activity(cards=1)
+            duplicates.index_cards([obj])
+            return
+        if previous_deck is not None and previous_deck != obj.deck_id:
+            Tombstone.objects.record_cards([(obj.pk, previous_deck)])
+            Deck.objects.filter(pk=previous_deck).record_activity(cards=-1)
+            Deck.objects.filter(pk=obj.deck_id).record_activity(cards=1)
+        else:
+            Deck.objects.filter(pk=obj.deck_id).touch()
+        duplicates.reindex_card(obj)
+    
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        Tombstone.objects.record_cards([(obj.pk, obj.deck_id)])
+        super().delete_model(request, obj)
+        Deck.objects.filter(pk=obj.deck_id).record_activity(cards=-1)
+    
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        cards = list(queryset.values_list('pk', 'deck_id'))
+        removed = Counter(deck_id for _, deck_id in cards)
+        Tombstone.objects.record_cards(cards)
+        super().delete_queryset(request, queryset)
+        for deck_id, count in removed.items():
+            Deck.objects.filter(pk=deck_id).record_activity(cards=-count)
 
 
 @admin.register(StudySession)
-class StudySessionAdmin(admin.ModelAdmin):
+class StudySessionAdmin(LargeTableAdmin):
     list_display = ['deck', 'user', 'accuracy', 'total_attempts', 'started_at', 'completed_at']
-    list_filter = ['deck', 'started_at', 'completed_at']
+    list_filter = [('deck', AutocompleteFilter), 'started_at', 'completed_at']
+    list_select_related = ['deck', 'user']
+    autocomplete_fields = ['deck', 'user']
     readonly_fields = ['started_at', 'accuracy']
 
 
 @admin.register(DeckComment)
-class DeckCommentAdmin(admin.ModelAdmin):
+class DeckCommentAdmin(LargeTableAdmin):
     list_display = ['deck', 'user', 'text_preview', 'created_at']
-    list_filter = ['created_at', 'deck']
-    search_fields = ['text', 'user__username', 'deck__name']
+    list_filter = ['created_at', ('deck', AutocompleteFilter)]
+    list_select_related = ['deck', 'user']
+    # Deck names through their FTS index, usernames whole through the unique one
+    search_fields = ['deck__name', 'user__username']
+    search_indexes = {'deck_id': 'flashcards_deck_fts'}
+    search_exact = ['user__username']
+    autocomplete_fields = ['deck', 'user']
     readonly_fields = ['created_at']
+    ordering = ['-pk']
     
     def text_preview(self, obj):
         return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
@@ -46,8 +271,22 @@ class DeckCommentAdmin(admin.ModelAdmin):
 
 
 @admin.register(DeckLike)
-class DeckLikeAdmin(admin.ModelAdmin):
+class DeckLikeAdmin(LargeTableAdmin):
     list_display = ['deck', 'user', 'created_at']
-    list_filter = ['created_at', 'deck']
-    search_fields = ['user__username', 'deck__name']
+    list_filter = ['created_at', ('deck', AutocompleteFilter)]
+    list_select_related = ['deck', 'user']
+    search_fields = ['deck__name', 'user__username']
+    search_indexes = {'deck_id': 'flashcards_deck_fts'}
+    search_exact = ['user__username']
+    autocomplete_fields = ['deck', 'user']
     readonly_fields = ['created_at']
+    ordering = ['-pk']
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'owner', 'status', 'rows_processed', 'error_count', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    list_select_related = ['owner']
+    autocomplete_fields = ['owner', 'deck']
+    readonly_fields = ['created_at', 'started_at', 'heartbeat_at', 'finished_at', 'throughput']
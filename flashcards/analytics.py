@@ -0,0 +1,260 @@
+"""
+Study analytics rolled up from completed sessions.
+
+``refresh()`` folds sessions completed since the last watermark into
+hourly and daily ``StudyBucket`` rows, so reports read a few hundred
+bucket rows instead of every session. Grouping and the report curves are
+computed on NumPy arrays rather than row by row.
+
+``refresh_analytics`` runs it, e.g. from cron. The analytics endpoint
+only refreshes itself when the rollup is more than
+``FLASHCARDS_ANALYTICS_REFRESH_SECONDS`` behind, so most reads take no
+write lock.
+
+Answers recorded after a session was completed are not picked up
+incrementally; ``refresh_analytics --rebuild`` recounts everything.
+"""
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import RollupWatermark, StudyBucket, StudySession
+
+WATERMARK = 'study_buckets'
+# Sessions completed in the last few seconds may still be committing
+LAG = timedelta(seconds=30)
+CHUNK_SIZE = 50000
+_LOOKUP_CHUNK = 500
+SECONDS = {
+    StudyBucket.HOUR: 3600,
+    StudyBucket.DAY: 86400,
+}
+MAX_DAYS = {
+    StudyBucket.HOUR: 31,
+    StudyBucket.DAY: 366,
+}
+RETENTION_DAYS = 90
+ANONYMOUS = -1
+
+
+def refresh_seconds():
+    """Staleness after which a read refreshes the rollup; None never does"""
+    return getattr(settings, 'FLASHCARDS_ANALYTICS_REFRESH_SECONDS', 60)
+
+
+def refresh_if_stale(now=None):
+    """Refresh only when the last rollup is older than ``refresh_seconds()``"""
+    seconds = refresh_seconds()
+    if seconds is None:
+        return 0
+    now = now or timezone.now()
+    position = RollupWatermark.objects.filter(name=WATERMARK).values_list(
+        'position', flat=True
+    ).first()
+    if position is not None and position >= now - LAG - timedelta(seconds=seconds):
+        return 0
+    return refresh(now)
+
+
+def refresh(now=None):
+    """Roll newly completed sessions into the buckets; returns sessions added"""
+    upper = (now or timezone.now()) - LAG
+    with transaction.atomic():
+        mark = RollupWatermark.objects.filter(name=WATERMARK).first()
+        # Claim the range before reading it so that concurrent refreshes
+        # cannot count the same sessions twice.
+        if mark is None:
+            try:
+                with transaction.atomic():
+                    RollupWatermark.objects.create(name=WATERMARK, position=upper)
+            except IntegrityError:
+                return 0
+            sessions = StudySession.objects.filter(completed_at__lte=upper)
+        else:
+            if mark.position >= upper:
+                return 0
+            claimed = RollupWatermark.objects.filter(
+                name=WATERMARK, position=mark.position
+            ).update(position=upper)
+            if not claimed:
+                return 0
+            sessions = StudySession.objects.filter(
+                completed_at__gt=mark.position, completed_at__lte=upper
+            )
+        rows = sessions.order_by().values_list(
+            'started_at', Coalesce('user', Value(ANONYMOUS)), 'deck_id',
+            'correct_count', 'total_attempts',
+        ).iterator(chunk_size=CHUNK_SIZE)
+        added = 0
+        while True:
+            chunk = list(islice(rows, CHUNK_SIZE))
+            if not chunk:
+                break
+            added += len(chunk)
+            for granularity, keys, totals in aggregate(chunk):
+                merge(granularity, keys, totals)
+    return added
+
+
+def rebuild():
+    """Drop the rollups and recount every completed session"""
+    with transaction.atomic():
+        StudyBucket.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK).delete()
+    return refresh()
+
+
+def aggregate(rows):
+    """
+    Group ``(started_at, user, deck, correct, attempts)`` rows per bucket.
+    Yields ``(granularity, keys, totals)`` where keys are
+    ``[period, user, deck]`` rows and totals ``[sessions, attempts, correct]``.
+    """
+    started = np.fromiter((row[0].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    values = np.array([row[1:] for row in rows], dtype=np.int64)
+    users, decks, correct, attempts = values.T
+    seconds = np.floor(started).astype(np.int64)
+    for granularity, size in SECONDS.items():
+        keys = np.column_stack([seconds // size, users, decks])
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        n = len(unique)
+        totals = np.column_stack([
+            np.bincount(inverse, minlength=n),
+            np.bincount(inverse, weights=attempts, minlength=n),
+            np.bincount(inverse, weights=correct, minlength=n),
+        ]).astype(np.int64)
+        yield granularity, unique, totals
+
+
+def merge(granularity, keys, totals):
+    """Add grouped totals onto existing buckets, creating missing ones"""
+    existing = {
+        (bucket.period, bucket.user_id or ANONYMOUS, bucket.deck_id): bucket
+        for bucket in existing_buckets(granularity, keys)
+    }
+    changed, created = [], []
+    for (period, user, deck), (sessions, attempts, correct) in zip(keys.tolist(), totals.tolist()):
+        bucket = existing.get((period, user, deck))
+        if bucket is None:
+            created.append(StudyBucket(
+                granularity=granularity, period=period, deck_id=deck,
+                user_id=None if user == ANONYMOUS else user,
+                sessions=sessions, attempts=attempts, correct=correct,
+            ))
+        else:
+            bucket.sessions += sessions
+            bucket.attempts += attempts
+            bucket.correct += correct
+            changed.append(bucket)
+    StudyBucket.objects.bulk_update(changed, ['sessions', 'attempts', 'correct'], batch_size=500)
+    StudyBucket.objects.bulk_create(created, batch_size=500)
+
+
+def existing_buckets(granularity, keys):
+    """Buckets that may match ``keys``, narrowed by period, deck and user in SQL"""
+    periods = keys[:, 0]
+    buckets = StudyBucket.objects.filter(
+        granularity=granularity,
+        period__gte=int(periods.min()),
+        period__lte=int(periods.max()),
+    )
+    users = np.unique(keys[:, 1]).tolist()
+    if len(users) <= _LOOKUP_CHUNK:
+        learners = Q(user_id__in=[user for user in users if user != ANONYMOUS])
+        if ANONYMOUS in users:
+            learners |= Q(user__isnull=True)
+        buckets = buckets.filter(learners)
+    decks = np.unique(keys[:, 2]).tolist()
+    for start in range(0, len(decks), _LOOKUP_CHUNK):
+        yield from buckets.filter(deck_id__in=decks[start:start + _LOOKUP_CHUNK])
+
+
+def as_array(queryset, *fields):
+    rows = list(queryset.values_list(*fields))
+    return np.array(rows, dtype=np.int64).reshape(len(rows), len(fields))
+
+
+def accuracy(correct, attempts):
+    """Percentages rounded to one decimal, None where nothing was answered"""
+    result = np.divide(
+        correct * 100.0, attempts, out=np.full(len(attempts), np.nan), where=attempts > 0
+    )
+    return [None if np.isnan(value) else round(value, 1) for value in result.tolist()]
+
+
+def report(granularity, days, now=None, **filters):
+    """
+    Volume and accuracy per bucket over the last ``days`` days, plus a
+    retention curve, for buckets matching ``filters`` (user and/or deck).
+    """
+    size = SECONDS[granularity]
+    count = days * 86400 // size
+    last = int((now or timezone.now()).timestamp()) // size
+    first = last - count + 1
+
+    buckets = StudyBucket.objects.filter(granularity=granularity, **filters)
+    rows = as_array(
+        buckets.filter(period__gte=first, period__lte=last),
+        'period', 'sessions', 'attempts', 'correct',
+    )
+    offsets = rows[:, 0] - first
+    sessions, attempts, correct = (
+        np.bincount(offsets, weights=rows[:, i], minlength=count).astype(np.int64)
+        for i in (1, 2, 3)
+    )
+    starts = (np.arange(first, last + 1, dtype=np.int64) * size).astype('datetime64[s]')
+    series = [
+        {'start': f'{start}Z', 'sessions': s, 'attempts': a, 'correct': c, 'accuracy': acc}
+        for start, s, a, c, acc in zip(
+            starts.astype(str).tolist(), sessions.tolist(), attempts.tolist(),
+            correct.tolist(), accuracy(correct, attempts),
+        )
+    ]
+    totals = np.array([sessions.sum(), attempts.sum(), correct.sum()])
+    return {
+        'granularity': granularity,
+        'series': series,
+        'totals': {
+            'sessions': int(totals[0]),
+            'attempts': int(totals[1]),
+            'correct': int(totals[2]),
+            'accuracy': accuracy(totals[2:], totals[1:2])[0],
+        },
+        'retention': retention(**filters),
+    }
+
+
+def retention(**filters):
+    """
+    Accuracy by days since each learner first studied each deck, over all
+    daily buckets matching ``filters``.
+    """
+    rows = as_array(
+        StudyBucket.objects.filter(granularity=StudyBucket.DAY, **filters),
+        Coalesce('user', Value(ANONYMOUS)), 'deck', 'period', 'attempts', 'correct',
+    )
+    if not len(rows):
+        return []
+    _, inverse = np.unique(rows[:, :2], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    first_day = np.full(inverse.max() + 1, np.iinfo(np.int64).max)
+    np.minimum.at(first_day, inverse, rows[:, 2])
+    offsets = rows[:, 2] - first_day[inverse]
+    keep = offsets < RETENTION_DAYS
+    attempts = np.bincount(offsets[keep], weights=rows[keep, 3], minlength=RETENTION_DAYS).astype(np.int64)
+    correct = np.bincount(offsets[keep], weights=rows[keep, 4], minlength=RETENTION_DAYS).astype(np.int64)
+    days = np.flatnonzero(attempts)
+    return [
+        {'day': day, 'attempts': a, 'correct': c, 'accuracy': acc}
+        for day, a, c, acc in zip(
+            days.tolist(), attempts[days].tolist(), correct[days].tolist(),
+            accuracy(correct[days], attempts[days]),
+        )
+    ]
@@ -0,0 +1,231 @@
+"""
+Write-behind buffer for the answer event log.
+
+Answers are appended to an in-process buffer once the request that
+recorded them commits, and written with ``bulk_create`` when the buffer
+reaches ``FLASHCARDS_ANSWER_BUFFER_SIZE`` events or its oldest event is
+``FLASHCARDS_ANSWER_FLUSH_SECONDS`` old. The same write folds the batch
+into ``CardStats``. The session counters stay authoritative and are
+updated synchronously; events still buffered when a process is killed
+are lost, while a normal interpreter exit flushes them. A batch that fails
+to write is retried once by the background flush, which logs and drops it
+if it fails again.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import AnswerEvent, CardStats, Flashcard, StudySession
+
+logger = logging.getLogger(__name__)
+
+STATS_CHUNK = 100
+REBUILD_BATCH = 500
+
+
+def buffer_size():
+    return getattr(settings, 'FLASHCARDS_ANSWER_BUFFER_SIZE', 500)
+
+
+def flush_interval():
+    return getattr(settings, 'FLASHCARDS_ANSWER_FLUSH_SECONDS', 2.0)
+
+
+class AnswerBuffer:
+    """Thread-safe queue of unsaved AnswerEvents"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.oldest = None
+        self.timer = None
+
+    def add(self, events):
+        with self.lock:
+            self.pending.extend(events)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            due = (
+                len(self.pending) >= buffer_size()
+                or time.monotonic() - self.oldest >= flush_interval()
+            )
+            batch = self.take() if due else None
+            if not due:
+                self.schedule()
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        """
+        Write a batch from a request's on_commit callback. The request's own
+        writes have committed, so a failure must not turn into an error
+        response: the batch goes back to the buffer and the timer retries it.
+        """
+        try:
+            write(batch)
+        except Exception:
+            logger.exception('Failed to write answer events; retrying in the background')
+            with self.lock:
+                self.pending[:0] = batch
+                if self.oldest is None:
+                    self.oldest = time.monotonic()
+                self.schedule()
+
+    def flush(self):
+        with self.lock:
+            batch = self.take()
+        if batch:
+            write(batch)
+        return len(batch)
+
+    def take(self):
+        batch, self.pending, self.oldest = self.pending, [], None
+        return batch
+
+    def schedule(self):
+        if self.timer is None or not self.timer.is_alive():
+            self.timer = threading.Timer(flush_interval(), self.flush_in_background)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to write buffered answer events')
+        finally:
+            # The timer thread has its own database connection
+            connection.close()
+
+
+buffer = AnswerBuffer()
+atexit.register(buffer.flush)
+
+
+def record(events):
+    """Log answers once the current transaction commits"""
+    if not events:
+        return
+    if buffer_size() <= 1:
+        transaction.on_commit(lambda: buffer.write(events))
+    else:
+        transaction.on_commit(lambda: buffer.add(events))
+
+
+def flush():
+    """Write everything buffered in this process now"""
+    return buffer.flush()
+
+
+def write(events):
+    """Insert a batch of events and fold it into CardStats"""
+    try:
+        with transaction.atomic():
+            AnswerEvent.objects.bulk_create(events, batch_size=500)
+            update_card_stats(events)
+    except IntegrityError:
+        # A session or card was deleted while its answers were buffered
+        events = live_events(events)
+        with transaction.atomic():
+            AnswerEvent.objects.bulk_create(events, batch_size=500)
+            update_card_stats(events)
+
+
+def live_events(events):
+    sessions = set(StudySession.objects.filter(
+        pk__in={event.session_id for event in events}
+    ).values_list('pk', flat=True))
+    cards = set(Flashcard.objects.filter(
+        pk__in={event.card_id for event in events if event.card_id is not None}
+    ).values_list('pk', flat=True))
+    kept = []
+    for event in events:
+        if event.session_id in sessions and (event.card_id is None or event.card_id in cards):
+            event.pk = None
+            kept.append(event)
+    return kept
+
+
+def update_card_stats(events):
+    """Add the batch to each card's totals with one UPDATE per chunk of cards"""
+    totals = defaultdict(lambda: {
+        'attempts': 0, 'correct': 0, 'response_ms_total': 0, 'timed_attempts': 0,
+        'last_answered_at': None,
+    })
+    for event in events:
+        if event.card_id is None:
+            continue
+        card = totals[event.card_id]
+        card['attempts'] += 1
+        card['correct'] += int(event.correct)
+        if event.response_ms is not None:
+            card['response_ms_total'] += event.response_ms
+            card['timed_attempts'] += 1
+        if card['last_answered_at'] is None or event.answered_at > card['last_answered_at']:
+            card['last_answered_at'] = event.answered_at
+    if not totals:
+        return
+    CardStats.objects.bulk_create(
+        [CardStats(card_id=card_id) for card_id in totals], ignore_conflicts=True
+    )
+
+    card_ids = list(totals)
+    for start in range(0, len(card_ids), STATS_CHUNK):
+        chunk = card_ids[start:start + STATS_CHUNK]
+
+        def per_card(field, output_field=IntegerField()):
+            return Case(
+                *[When(card_id=card_id, then=Value(totals[card_id][field])) for card_id in chunk],
+                output_field=output_field,
+            )
+
+        updates = {
+            field: F(field) + per_card(field)
+            for field in ('attempts', 'correct', 'response_ms_total', 'timed_attempts')
+        }
+        latest = per_card('last_answered_at', DateTimeField())
+        updates['last_answered_at'] = Greatest(Coalesce('last_answered_at', latest), latest)
+        CardStats.objects.filter(card_id__in=chunk).update(**updates)
+
+
+def rebuild_card_stats():
+    """
+    Recompute every CardStats row from the event log; returns cards counted.
+    Per-card totals are streamed from the database and written in batches,
+    so memory stays flat however many cards have been answered.
+    """
+    rows = AnswerEvent.objects.filter(card__isnull=False).order_by().values('card').annotate(
+        num_attempts=Count('pk'),
+        num_correct=Count('pk', filter=Q(correct=True)),
+        ms_total=Coalesce(Sum('response_ms'), 0),
+        num_timed=Count('response_ms'),
+        latest=Max('answered_at'),
+    )
+    counted = 0
+    batch = []
+    with transaction.atomic():
+        CardStats.objects.all().delete()
+        for row in rows.iterator(chunk_size=REBUILD_BATCH):
+            batch.append(CardStats(
+                card_id=row['card'],
+                attempts=row['num_attempts'],
+                correct=row['num_correct'],
+                response_ms_total=row['ms_total'],
+                timed_attempts=row['num_timed'],
+                last_answered_at=row['latest'],
+            ))
+            if len(batch) >= REBUILD_BATCH:
+                CardStats.objects.bulk_create(batch)
+                counted += len(batch)
+                batch = []
+        if batch:
+            CardStats.objects.bulk_create(batch)
+            counted += len(batch)
+    return counted
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    # Table rebuilds in later migrations drop the FTS triggers on SQLite
+    from django.db import connections
+    from . import search
+    search.install(connections[using])
 
 
 class FlashcardsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'flashcards'
+
+    def ready(self):
+        post_migrate.connect(install_search_index, sender=self)
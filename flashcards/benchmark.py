@@ -0,0 +1,375 @@
+"""
+Load benchmark for the flashcards routes.
+
+Every route in ``flashcards/urls.py`` has a scenario that is replayed a
+number of times, in process through the Django test client (which also
+counts SQL queries) or against a running server. Latency percentiles,
+queries per request and throughput are reported per scenario as JSON so a
+run can be saved as a baseline and later runs compared against it.
+
+Scenarios create, edit and delete rows, so point the benchmark at a
+disposable database, e.g. one filled by ``generate_load_data``. Targets
+such as the deck to read are looked up with the ORM, so a server given
+with ``url`` must use the same database.
+"""
+import json
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Callable, Optional, Union
+from urllib.parse import urljoin
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import sync
+from .models import Deck, Flashcard, ImportJob, ReviewState, StudySession
+
+# A p95 change smaller than this is treated as noise when comparing runs
+MIN_REGRESSION_MS = 1.0
+
+
+@dataclass
+class Scenario:
+    """
+    One route exercised with one method. ``path`` and ``data`` may be
+    callables taking the iteration number; they run before the clock
+    starts, so they can also create the rows a request consumes.
+    """
+    name: str
+    method: str
+    path: Union[str, Callable[[int], str]]
+    data: Any = None
+    headers: dict = field(default_factory=dict)
+    iterations: Optional[int] = None
+
+    def resolve(self, i):
+        path = self.path(i) if callable(self.path) else self.path
+        data = self.data(i) if callable(self.data) else self.data
+        return path, data
+
+
+@dataclass
+class Targets:
+    """Rows the scenarios read and write"""
+    user: User
+    deck: Deck
+    card: Flashcard
+    session: StudySession
+    job: ImportJob
+    review: ReviewState
+
+
+def find_targets(user=None):
+    """
+    The benchmark acts as the owner of the largest public deck unless
+    ``user`` is given, and reads that user's largest deck
+    """
+    if user is None:
+        deck = Deck.objects.filter(is_public=True, owner__isnull=False).order_by(
+            '-cards_total', 'pk'
+        ).select_related('owner').first()
+        if deck is None:
+            raise ValueError('No public deck with an owner; run generate_load_data first')
+        user = deck.owner
+    else:
+        deck = Deck.objects.filter(owner=user).order_by('-cards_total', 'pk').first()
+        if deck is None:
+            raise ValueError(f'{user.username} owns no decks')
+    card = deck.flashcards.order_by('pk').first()
+    if card is None:
+        card = Flashcard.objects.create(deck=deck, question='Benchmark question', answer='Answer')
+        Deck.objects.filter(pk=deck.pk).record_activity(cards=1)
+    session = StudySession.objects.filter(user=user, deck=deck).first()
+    if session is None:
+        session = StudySession.objects.create(user=user, deck=deck)
+    job = ImportJob.objects.filter(owner=user).first()
+    if job is None:
+        job = ImportJob.objects.create(owner=user, status=ImportJob.SUCCEEDED, deck=deck)
+    review, _ = ReviewState.objects.get_or_create(
+        user=user, card=card, defaults={'deck': deck, 'due_at': timezone.now()}
+    )
+    return Targets(user, deck, card, session, job, review)
+
+
+def upload_body(i):
+    return {
+        'deck_name': f'Benchmark upload {i}',
+        'flashcards': [
+            {'question': f'Uploaded question {i}.{n}', 'answer': f'Answer {n}'} for n in range(20)
+        ],
+    }
+
+
+def scenarios(targets, password=None):
+    """Scenarios covering every flashcards route, reads first"""
+    t = targets
+    deck = f'/api/decks/{t.deck.pk}'
+
+    def new_deck(i):
+        return Deck.objects.create(name=f'Benchmark deck {i}', owner=t.user).pk
+
+    def new_card(i):
+        card = Flashcard.objects.create(deck=t.deck, question=f'Benchmark {i}', answer='Answer')
+        Deck.objects.filter(pk=t.deck.pk).record_activity(cards=1)
+        return card.pk
+
+    def reorder(i):
+        # Rotate the first cards of the deck, as dragging one card to the end would
+        ids = list(t.deck.flashcards.order_by('order', 'pk').values_list('pk', flat=True)[:50])
+        ids = ids[1:] + ids[:1]
+        return {'deck': t.deck.pk, 'operations': [
+            {'op': 'update', 'id': pk, 'order': n} for n, pk in enumerate(ids)
+        ]}
+
+    def place(i):
+        # Alternate the card between the middle and the front of the deck
+        middle = t.deck.flashcards.exclude(pk=t.card.pk).order_by('order', 'pk').values_list(
+            'pk', flat=True
+        )[t.deck.cards_total // 2:][:1]
+        return {'after': None if i % 2 else middle.first()}
+
+    def new_session(i):
+        return StudySession.objects.create(user=t.user, deck=t.deck).pk
+
+    def deck_etag():
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(t.user)
+        return client.get(f'{deck}/')['ETag']
+
+    def refresh_token(i):
+        return {'refresh': str(RefreshToken.for_user(t.user))}
+
+    recent = sync.make_token(timezone.now() - timedelta(hours=1))
+    result = [
+        Scenario('index', 'get', '/'),
+        Scenario('metrics', 'get', '/metrics'),
+        Scenario('api-root', 'get', '/api/'),
+        Scenario('deck-list', 'get', '/api/decks/'),
+        Scenario('deck-public', 'get', '/api/decks/public/'),
+        Scenario('deck-community', 'get', '/api/decks/community/'),
+        Scenario('deck-detail', 'get', f'{deck}/'),
+        Scenario('deck-detail', 'get', f'{deck}/', headers={'If-None-Match': deck_etag()}),
+        Scenario('deck-export', 'get', f'{deck}/export/'),
+        Scenario('deck-export', 'get', f'{deck}/export/?format=csv'),
+        Scenario('deck-export-all', 'get', '/api/decks/export_all/', iterations=5),
+        Scenario('deck-comments', 'get', f'{deck}/comments/'),
+        Scenario('deck-due', 'get', f'{deck}/due/'),
+        Scenario('deck-difficulty', 'get', f'{deck}/difficulty/'),
+        Scenario('flashcard-list', 'get', f'/api/flashcards/?deck={t.deck.pk}'),
+        Scenario('flashcard-detail', 'get', f'/api/flashcards/{t.card.pk}/'),
+        Scenario('session-list', 'get', '/api/sessions/'),
+        Scenario('session-detail', 'get', f'/api/sessions/{t.session.pk}/'),
+        Scenario('job-list', 'get', '/api/jobs/'),
+        Scenario('job-detail', 'get', f'/api/jobs/{t.job.pk}/'),
+        Scenario('review-list', 'get', '/api/reviews/'),
+        Scenario('review-detail', 'get', f'/api/reviews/{t.review.pk}/'),
+        Scenario('search', 'get', '/api/search/?q=what+is+the'),
+        Scenario('analytics', 'get', '/api/analytics/'),
+        Scenario('analytics', 'get', f'/api/analytics/?granularity=hour&days=7&deck={t.deck.pk}&scope=deck'),
+        Scenario('profile', 'get', '/api/profile/'),
+        Scenario('sync', 'get', '/api/sync/'),
+        Scenario('sync', 'get', f'/api/sync/?since={recent}'),
+        Scenario('sync', 'get', f'/api/sync/?deck={t.deck.pk}&since={recent}'),
+
+        Scenario('deck-list', 'post', '/api/decks/', data=lambda i: {'name': f'Benchmark {i}'}),
+        Scenario('deck-detail', 'patch', f'{deck}/', data={'description': 'Benchmarked'}),
+        Scenario('deck-detail', 'delete', lambda i: f'/api/decks/{new_deck(i)}/'),
+        Scenario('deck-upload', 'post', '/api/decks/upload/', data=upload_body, iterations=10),
+        Scenario('deck-like', 'post', f'{deck}/like/'),
+        Scenario('deck-unlike', 'delete', f'{deck}/unlike/'),
+        Scenario('deck-fork', 'post', f'{deck}/fork/', iterations=10),
+        Scenario('deck-comments', 'post', f'{deck}/comments/', data={'text': 'Benchmark comment'}),
+        Scenario('flashcard-list', 'post', '/api/flashcards/',
+                 data=lambda i: {'deck': t.deck.pk, 'question': f'New {i}', 'answer': 'Answer'}),
+        Scenario('flashcard-detail', 'patch', f'/api/flashcards/{t.card.pk}/',
+                 data=lambda i: {'answer': f'Edited {i}'}),
+        Scenario('flashcard-detail', 'delete', lambda i: f'/api/flashcards/{new_card(i)}/'),
+        Scenario('flashcard-bulk', 'post', '/api/flashcards/bulk/', data=reorder),
+        Scenario('flashcard-place', 'post', f'/api/flashcards/{t.card.pk}/place/', data=place),
+        Scenario('flashcard-review', 'post', f'/api/flashcards/{t.card.pk}/review/', data={'grade': 4}),
+        Scenario('session-list', 'post', '/api/sessions/', data={'deck': t.deck.pk}),
+        Scenario('session-record-answer', 'post', f'/api/sessions/{t.session.pk}/record_answer/',
+                 data={'correct': True, 'card': t.card.pk, 'response_ms': 1500}),
+        Scenario('session-record-answers', 'post', f'/api/sessions/{t.session.pk}/record_answers/',
+                 data={'answers': [{'correct': n % 3 > 0, 'card': t.card.pk} for n in range(10)]}),
+        Scenario('session-complete', 'post', lambda i: f'/api/sessions/{new_session(i)}/complete/'),
+        Scenario('session-detail', 'delete', lambda i: f'/api/sessions/{new_session(i)}/'),
+        Scenario('token_refresh', 'post', '/api/token/refresh/', data=refresh_token),
+        # Password hashing dominates these two, so a few samples suffice
+        Scenario('register', 'post', '/api/register/', iterations=5, data=lambda i: {
+            'username': f'bench{time.time_ns()}', 'password': 'benchmark', 'password2': 'benchmark',
+        }),
+    ]
+    if password is not None:
+        result.append(Scenario('login', 'post', '/api/login/', iterations=5, data={
+            'username': t.user.username, 'password': password,
+        }))
+    return result
+
+
+def route_names():
+    """Names of every route in flashcards/urls.py"""
+    from . import urls
+
+    names = set()
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns)
+            elif pattern.name:
+                names.add(pattern.name)
+    walk(urls.urlpatterns)
+    return names
+
+
+def uncovered(scenario_list):
+    return sorted(route_names() - {scenario.name for scenario in scenario_list})
+
+
+class LocalClient:
+    """Runs requests in process and counts their queries"""
+    counts_queries = True
+
+    def __init__(self, user):
+        # Server errors are reported per scenario rather than raised
+        self.client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+        self.client.force_login(user)
+
+    def request(self, method, path, data, headers):
+        kwargs = {'headers': headers}
+        if data is not None:
+            kwargs.update(data=data, content_type='application/json')
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, **kwargs)
+            if response.streaming:
+                size = sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                size = len(response.content)
+            elapsed = time.perf_counter() - start
+        return response.status_code, size, elapsed, len(queries)
+
+
+class HTTPClient:
+    """Runs requests against a server with a JWT for ``username``"""
+    counts_queries = False
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        status, body = self.send('post', '/api/login/', {'username': username, 'password': password}, {})
+        if status != 200:
+            raise ValueError(f'Could not log in as {username} (HTTP {status})')
+        self.token = json.loads(body)['access']
+
+    def send(self, method, path, data, headers):
+        body = None if data is None else json.dumps(data).encode()
+        request = urllib.request.Request(
+            urljoin(self.base_url, path), data=body, method=method.upper(),
+            headers={'Content-Type': 'application/json', **headers},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read()
+
+    def request(self, method, path, data, headers):
+        headers = {'Authorization': f'Bearer {self.token}', **headers}
+        start = time.perf_counter()
+        status, body = self.send(method, path, data, headers)
+        return status, len(body), time.perf_counter() - start, None
+
+
+def label(scenario):
+    path = scenario.path if isinstance(scenario.path, str) else scenario.name
+    extra = ' (conditional)' if scenario.headers else ''
+    return f'{scenario.method.upper()} {path}{extra}'
+
+
+def run(scenario_list, client, iterations=50, warmup=3):
+    """Replay each scenario and return the report as a dict"""
+    routes = {}
+    started = time.perf_counter()
+    total = 0
+    for scenario in scenario_list:
+        count = scenario.iterations or iterations
+        samples, queries, sizes, statuses = [], [], [], Counter()
+        for i in range(warmup + count):
+            path, data = scenario.resolve(i)
+            status, size, elapsed, num_queries = client.request(
+                scenario.method, path, data, scenario.headers
+            )
+            if i < warmup:
+                continue
+            samples.append(elapsed * 1000)
+            queries.append(num_queries)
+            sizes.append(size)
+            statuses[status] += 1
+        routes[label(scenario)] = summarize(scenario, samples, queries, sizes, statuses)
+        total += count
+    wall = time.perf_counter() - started
+    return {
+        'created': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'requests': total,
+        'throughput_rps': round(total / wall, 1) if wall else None,
+        'routes': routes,
+    }
+
+
+def summarize(scenario, samples, queries, sizes, statuses):
+    times = np.array(samples)
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]).tolist()
+    counted = [q for q in queries if q is not None]
+    return {
+        'route': scenario.name,
+        'method': scenario.method.upper(),
+        'requests': len(samples),
+        'status': dict(sorted(statuses.items())),
+        'errors': sum(n for status, n in statuses.items() if status >= 500),
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'mean_ms': round(float(times.mean()), 2),
+        'max_ms': round(float(times.max()), 2),
+        'throughput_rps': round(len(samples) / (times.sum() / 1000), 1),
+        'queries': int(np.median(counted)) if counted else None,
+        'queries_max': max(counted) if counted else None,
+        'bytes': int(np.mean(sizes)),
+    }
+
+
+def compare(baseline, current, tolerance=0.25):
+    """
+    Rows of ``(label, baseline p95, current p95, relative change, baseline
+    queries, current queries, regressed)`` for routes present in both runs.
+    A route regresses when its p95 grows by more than ``tolerance`` or it
+    runs more queries per request.
+    """
+    rows = []
+    for key, now in current['routes'].items():
+        before = baseline['routes'].get(key)
+        if before is None:
+            continue
+        change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        slower = change > tolerance and now['p95_ms'] - before['p95_ms'] > MIN_REGRESSION_MS
+        more_queries = (
+            now['queries'] is not None and before['queries'] is not None
+            and now['queries'] > before['queries']
+        )
+        rows.append((
+            key, before['p95_ms'], now['p95_ms'], change, before['queries'], now['queries'],
+            slower or more_queries,
+        ))
+    return rows
@@ -0,0 +1,153 @@
+"""
+Bulk card edits.
+
+``apply()`` runs a list of create, update, delete and move operations on
+the cards of one deck in a single transaction: one ``bulk_create``, one
+``bulk_update`` and one ``DELETE ... IN`` however many cards change. The
+bookkeeping the single-card endpoints do after every save (deck counters
+and content versions, duplicate fingerprints, sync tombstones) is
+collected over the batch and done once, with one counter update per deck
+involved.
+
+Each card may appear in only one operation of a batch, so the result does
+not depend on the order of the operations.
+"""
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import duplicates as dedup, ordering
+from .models import CardFingerprint, Deck, Flashcard, ReviewState, Tombstone
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+MOVE = 'move'
+EDITABLE = ('question', 'answer', 'spaced_repetition', 'order')
+
+
+class InvalidOperations(Exception):
+    """Some operations cannot be applied; nothing has been written"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+@dataclass
+class Result:
+    created: list = field(default_factory=list)
+    updated: list = field(default_factory=list)
+    moved: list = field(default_factory=list)
+    deleted: list = field(default_factory=list)
+
+
+def check(deck, operations):
+    """
+    The cards of ``deck`` the operations refer to, by id. Raises
+    InvalidOperations with ``{'index': ..., 'error': ...}`` for every
+    operation that refers to a card or deck it cannot use.
+    """
+    cards = Flashcard.objects.filter(deck=deck).in_bulk(
+        [operation['id'] for operation in operations if 'id' in operation]
+    )
+    targets = set(Deck.objects.filter(
+        pk__in={operation['deck'] for operation in operations if operation['op'] == MOVE}
+    ).values_list('pk', flat=True))
+    errors = []
+    seen = set()
+    for index, operation in enumerate(operations):
+        card_id = operation.get('id')
+        if card_id is None:
+            continue
+        if card_id in seen:
+            errors.append({'index': index, 'error': f'Card {card_id} is in more than one operation'})
+        elif card_id not in cards:
+            errors.append({'index': index, 'error': f'Card {card_id} is not in deck {deck.pk}'})
+        elif operation['op'] == MOVE and operation['deck'] == deck.pk:
+            errors.append({'index': index, 'error': f'Card {card_id} is already in deck {deck.pk}'})
+        elif operation['op'] == MOVE and operation['deck'] not in targets:
+            errors.append({'index': index, 'error': f"Deck {operation['deck']} does not exist"})
+        seen.add(card_id)
+    if errors:
+        raise InvalidOperations(errors)
+    return cards
+
+
+@transaction.atomic
+def apply(deck, operations):
+    """Apply validated ``CardOperationSerializer`` data to ``deck``; returns a Result"""
+    cards = check(deck, operations)
+    now = timezone.now()
+    result = Result()
+    fields = set()
+    card_deltas = Counter({deck.pk: 0})
+    reindex = []
+    gone = []
+    appended = None
+    if any(operation['op'] == CREATE and 'order' not in operation for operation in operations):
+        appended = ordering.next_order(deck.pk)
+    for operation in operations:
+        values = {name: operation[name] for name in EDITABLE if name in operation}
+        if operation['op'] == CREATE:
+            if 'order' not in values:
+                # New cards without a position go to the end, in request order
+                values['order'] = appended
+                appended += ordering.GAP
+            result.created.append(Flashcard(deck=deck, **values))
+            card_deltas[deck.pk] += 1
+            continue
+        card = cards[operation['id']]
+        if operation['op'] == DELETE:
+            result.deleted.append(card.pk)
+            gone.append((card.pk, deck.pk))
+            card_deltas[deck.pk] -= 1
+            continue
+        text = {name: values[name] for name in ('question', 'answer') if name in values}
+        if any(value != getattr(card, name) for name, value in text.items()):
+            reindex.append(card)
+        for name, value in values.items():
+            setattr(card, name, value)
+        fields.update(values)
+        # bulk_update() leaves auto_now alone, and delta sync reads updated_at
+        card.updated_at = now
+        if operation['op'] == MOVE:
+            card.deck_id = operation['deck']
+            fields.add('deck')
+            gone.append((card.pk, deck.pk))
+            card_deltas[deck.pk] -= 1
+            card_deltas[card.deck_id] += 1
+            result.moved.append(card)
+        else:
+            result.updated.append(card)
+
+    # New text for created and edited cards, looked up and stored together
+    Flashcard.objects.intern(result.created + result.updated + result.moved)
+    if result.deleted:
+        Flashcard.objects.filter(pk__in=result.deleted).delete()
+    if result.created:
+        Flashcard.objects.bulk_create(result.created, batch_size=500)
+    if result.updated or result.moved:
+        Flashcard.objects.bulk_update(
+            result.updated + result.moved, sorted(fields) + ['updated_at'], batch_size=500
+        )
+    moved_to = defaultdict(list)
+    for card in result.moved:
+        moved_to[card.deck_id].append(card.pk)
+    for deck_id, card_ids in moved_to.items():
+        # Review schedules keep a copy of the card's deck for the due queue
+        ReviewState.objects.filter(card_id__in=card_ids).update(deck_id=deck_id)
+    Tombstone.objects.record_cards(gone)
+
+    for deck_id, delta in card_deltas.items():
+        decks = Deck.objects.filter(pk=deck_id)
+        if delta:
+            decks.record_activity(cards=delta)
+        else:
+            decks.touch()
+    if reindex:
+        CardFingerprint.objects.filter(card__in=reindex).delete()
+    dedup.index_cards(result.created + reindex)
+    return result
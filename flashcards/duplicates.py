@@ -0,0 +1,239 @@
+"""
+Near-duplicate detection for flashcards.
+
+A card's normalized question and answer are cut into 4-byte shingles
+and summarised by a MinHash signature. The signature uses one-permutation
+hashing with rotation densification, so a card costs one hash per shingle
+rather than one per shingle and permutation. It is split into ``BANDS``
+bands and each band is hashed into a ``CardFingerprint`` row. Cards that
+share a band hash are candidates (LSH), and a candidate only counts as a
+duplicate when the two signatures agree on at least the configured
+fraction of positions. Each band hash is looked up with its own ``LIMIT``,
+so a lookup walks a bucket's index entries only until ``BUCKET_LIMIT``
+cards in scope are found, however large the corpus or the bucket is.
+"""
+import hashlib
+import operator
+import re
+import struct
+import unicodedata
+import zlib
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import CardFingerprint, Flashcard
+
+ALLOW = 'allow'
+FLAG = 'flag'
+SKIP = 'skip'
+MODES = (ALLOW, FLAG, SKIP)
+
+SHINGLE_SIZE = 4
+NUM_HASHES = 32
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+
+_BIN_BITS = 5  # log2(NUM_HASHES)
+_VALUE_BITS = 64 - _BIN_BITS
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_MASK64 = (1 << 64) - 1
+_MIX = 0x9E3779B97F4A7C15
+_LOOKUP_CHUNK = 900
+# Candidates verified per card, most shared bands first, so that very
+# common text cannot turn a lookup into a scan of its bucket.
+MAX_CANDIDATES = 5
+# Index entries read per band hash. Text shared by many cards (a common
+# answer such as "yes") fills one bucket; the cap keeps such a bucket from
+# being read in full, with the oldest cards, usually the originals, first.
+BUCKET_LIMIT = 50
+
+
+def threshold():
+    """Minimum estimated Jaccard similarity for a near-duplicate"""
+    return getattr(settings, 'FLASHCARDS_DUPLICATE_THRESHOLD', 0.8)
+
+
+def normalize(text):
+    """Case-fold, strip accents and punctuation, collapse whitespace"""
+    text = str(text)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.findall(r'\w+', text.casefold()))
+
+
+def signature(question, answer):
+    """MinHash signature of a card as a tuple of ``NUM_HASHES`` integers"""
+    data = f'{normalize(question)}|{normalize(answer)}'.encode()
+    bins = [None] * NUM_HASHES
+    for i in range(max(1, len(data) - SHINGLE_SIZE + 1)):
+        h = (zlib.crc32(data[i:i + SHINGLE_SIZE]) * _MIX) & _MASK64
+        b = h >> _VALUE_BITS
+        v = h & _VALUE_MASK
+        if bins[b] is None or v < bins[b]:
+            bins[b] = v
+    # Empty bins borrow the next filled bin to the right, offset by the
+    # distance so that borrowed values from different bins do not collide.
+    for b in range(NUM_HASHES):
+        if bins[b] is None:
+            for distance in range(1, NUM_HASHES):
+                value = bins[(b + distance) % NUM_HASHES]
+                if value is not None and value < (1 << _VALUE_BITS):
+                    bins[b] = (1 << _VALUE_BITS) * distance + value
+                    break
+    return tuple(bins)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(map(operator.eq, a, b)) / NUM_HASHES
+
+
+def band_hashes(sig):
+    """The LSH bucket of every band, as signed 64-bit integers"""
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                struct.pack(f'>B{ROWS}Q', band, *sig[band * ROWS:(band + 1) * ROWS]),
+                digest_size=8,
+            ).digest(),
+            'big', signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+def index_cards(cards, signatures=None):
+    """Store fingerprints for saved cards; ``signatures`` may be precomputed"""
+    if signatures is None:
+        signatures = [signature(card.question, card.answer) for card in cards]
+    rows = [
+        (card.pk, h)
+        for card, sig in zip(cards, signatures)
+        for h in band_hashes(sig)
+    ]
+    if not rows:
+        return
+    # Eight rows per card: a plain executemany avoids building model
+    # instances for what is a pure index table.
+    table = connection.ops.quote_name(CardFingerprint._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (card_id, band_hash) VALUES (%s, %s)', rows
+        )
+
+
+def reindex_card(card):
+    CardFingerprint.objects.filter(card_id=card.pk).delete()
+    index_cards([card])
+
+
+def upload_scope(deck, owner=None):
+    """Cards an upload into ``deck`` is compared with"""
+    scope = Q(card__deck=deck) | Q(card__deck__is_public=True)
+    if owner is not None:
+        scope |= Q(card__deck__owner=owner)
+    return scope
+
+
+@dataclass
+class Match:
+    card: int
+    deck: int
+    similarity: float
+
+
+def bucket_entries(keys, scope):
+    """
+    ``(band_hash, card_id)`` of the first ``BUCKET_LIMIT`` cards in
+    ``scope`` of each bucket in ``keys``
+    """
+    if not keys:
+        return []
+    # Per key, a correlated subquery walks the (band_hash, card) index and
+    # stops at the limit; the outer query fetches those rows by id
+    first = CardFingerprint.objects.filter(
+        scope, band_hash=RawSQL('bucket_keys.band_hash', [])
+    ).order_by('card_id').values('pk')[:BUCKET_LIMIT]
+    subquery, params = first.query.sql_with_params()
+    table = connection.ops.quote_name(CardFingerprint._meta.db_table)
+    values = ', '.join(['(%s)'] * len(keys))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH bucket_keys (band_hash) AS (VALUES {values}) '
+            f'SELECT fingerprint.band_hash, fingerprint.card_id '
+            f'FROM bucket_keys JOIN {table} fingerprint ON fingerprint.id IN ({subquery})',
+            [*keys, *params],
+        )
+        return cursor.fetchall()
+
+
+def find_matches(signatures, scope):
+    """
+    Return the best existing match among cards in ``scope`` (a ``Q`` on
+    CardFingerprint) for each signature, or None where there is none.
+    """
+    buckets = {}
+    for i, sig in enumerate(signatures):
+        for h in band_hashes(sig):
+            buckets.setdefault(h, []).append(i)
+    keys = list(buckets)
+    shared = [{} for _ in signatures]
+    for start in range(0, len(keys), _LOOKUP_CHUNK):
+        for band_hash, card_id in bucket_entries(keys[start:start + _LOOKUP_CHUNK], scope):
+            for i in buckets[band_hash]:
+                shared[i][card_id] = shared[i].get(card_id, 0) + 1
+
+    candidates = [
+        sorted(counts, key=counts.get, reverse=True)[:MAX_CANDIDATES] for counts in shared
+    ]
+    wanted = list({card_id for ids in candidates for card_id in ids})
+    cards = {}
+    for start in range(0, len(wanted), _LOOKUP_CHUNK):
+        rows = Flashcard.objects.filter(pk__in=wanted[start:start + _LOOKUP_CHUNK])
+        for card_id, deck_id, question, answer in rows.values_list(
+            'pk', 'deck_id', 'content__question', 'content__answer'
+        ):
+            cards[card_id] = (deck_id, signature(question, answer))
+
+    limit = threshold()
+    matches = []
+    for sig, ids in zip(signatures, candidates):
+        best = None
+        for card_id in ids:
+            deck_id, candidate = cards[card_id]
+            score = similarity(sig, candidate)
+            if score >= limit and (best is None or score > best.similarity):
+                best = Match(card_id, deck_id, score)
+        matches.append(best)
+    return matches
+
+
+def find_in_batch(signatures):
+    """
+    Match signatures against earlier ones in the same list; returns the
+    index of the earlier near-duplicate (or None) and its similarity.
+    """
+    limit = threshold()
+    seen = {}
+    matches = []
+    for i, sig in enumerate(signatures):
+        best = None
+        keys = band_hashes(sig)
+        counts = {}
+        for h in keys:
+            for j in seen.get(h, ()):
+                counts[j] = counts.get(j, 0) + 1
+        for j in sorted(counts, key=counts.get, reverse=True)[:MAX_CANDIDATES]:
+            score = similarity(sig, signatures[j])
+            if score >= limit and (best is None or score > best[1]):
+                best = (j, score)
+        matches.append(best)
+        if best is None:
+            for h in keys:
+                seen.setdefault(h, []).append(i)
+    return matches
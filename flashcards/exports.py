@@ -0,0 +1,203 @@
+"""
+Streaming deck export.
+
+Cards are read with ``.iterator()`` and written out chunk by chunk through a
+``StreamingHttpResponse``, so memory per request stays flat regardless of
+deck size. The JSON format is byte-for-byte what the non-streaming export
+used to return.
+"""
+import csv
+import zipfile
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from . import fastjson
+from .models import Flashcard
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (encode(data) + '\n').encode('utf-8')
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        if not rows or not isinstance(rows[0], dict):
+            return b''
+        buffer = Echo()
+        writer = csv.writer(buffer)
+        lines = [writer.writerow(rows[0].keys())]
+        lines += [writer.writerow(row.values()) for row in rows]
+        return ''.join(lines).encode('utf-8')
+
+
+# Content negotiation for the export actions: ``?format=json|ndjson|csv``
+# or the matching Accept header. JSON stays the default.
+EXPORT_RENDERERS = [JSONRenderer, NDJSONRenderer, CSVRenderer]
+
+EXTENSIONS = {'json': 'json', 'ndjson': 'ndjson', 'csv': 'csv'}
+
+CARD_FIELDS = ['question', 'answer', 'spacedRepetition']
+CARD_COLUMNS = ['content__question', 'content__answer', 'spaced_repetition']
+CARD_ORDER = ['order', 'created_at', 'id']
+
+
+class Echo:
+    """Pseudo-buffer whose write() hands the line back to the caller"""
+
+    def write(self, value):
+        return value
+
+
+class ZipStream:
+    """Write-only, unseekable buffer that ``zipfile`` streams into"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def encode(value):
+    """Encode like DRF's JSONRenderer: compact, UTF-8, JS-safe separators"""
+    return fastjson.encode(value).decode('utf-8')
+
+
+def chunk_size():
+    return getattr(settings, 'FLASHCARDS_EXPORT_CHUNK_SIZE', 2000)
+
+
+def batched(rows):
+    size = chunk_size()
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_cards(deck):
+    """Yield lists of (question, answer, spaced_repetition) rows"""
+    rows = deck.flashcards.order_by(*CARD_ORDER).values_list(*CARD_COLUMNS)
+    return batched(rows.iterator(chunk_size=chunk_size()))
+
+
+def iter_decks(decks):
+    """
+    Yield ``(deck, batches)`` for each deck ordered by pk, reading the cards
+    of all of them with one query rather than one per deck
+    """
+    decks = decks.order_by('pk')
+    rows = Flashcard.objects.filter(deck__in=decks).order_by('deck_id', *CARD_ORDER).values_list(
+        'deck_id', *CARD_COLUMNS
+    )
+    groups = groupby(rows.iterator(chunk_size=chunk_size()), key=itemgetter(0))
+    group = next(groups, None)
+    for deck in decks:
+        # Skip cards of decks created after the deck list was read
+        while group is not None and group[0] < deck.pk:
+            group = next(groups, None)
+        if group is not None and group[0] == deck.pk:
+            yield deck, batched(row[1:] for row in group[1])
+            group = next(groups, None)
+        else:
+            yield deck, []
+
+
+def card_dict(row):
+    return dict(zip(CARD_FIELDS, row))
+
+
+def json_chunks(deck, batches):
+    yield '{"deck_name":%s,"description":%s,"flashcards":[' % (
+        encode(deck.name), encode(deck.description)
+    )
+    separator = ''
+    for batch in batches:
+        # One encoder call per batch; strip the list brackets
+        yield separator + encode([card_dict(row) for row in batch])[1:-1]
+        separator = ','
+    yield ']}'
+
+
+def ndjson_chunks(deck, batches):
+    """First line is the deck header, then one line per card"""
+    yield encode({'deck_name': deck.name, 'description': deck.description}) + '\n'
+    for batch in batches:
+        yield ''.join(encode(card_dict(row)) + '\n' for row in batch)
+
+
+def csv_chunks(deck, batches):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CARD_FIELDS)
+    for batch in batches:
+        yield ''.join(writer.writerow(row) for row in batch)
+
+
+CHUNKERS = {'json': json_chunks, 'ndjson': ndjson_chunks, 'csv': csv_chunks}
+
+
+def filename_for(deck, export_format):
+    return f'{slugify(deck.name) or "deck"}-{deck.pk}.{EXTENSIONS[export_format]}'
+
+
+def deck_response(deck, export_format, media_type):
+    response = StreamingHttpResponse(
+        CHUNKERS[export_format](deck, iter_cards(deck)),
+        content_type=f'{media_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename_for(deck, export_format)}"'
+    return response
+
+
+def archive_chunks(decks, export_format):
+    """Stream a ZIP with one ``export_format`` file per deck of ``decks``"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for deck, batches in iter_decks(decks):
+            with archive.open(filename_for(deck, export_format), 'w', force_zip64=True) as entry:
+                for chunk in CHUNKERS[export_format](deck, batches):
+                    entry.write(chunk.encode('utf-8'))
+                    data = stream.drain()
+                    if data:
+                        yield data
+            yield stream.drain()
+    yield stream.drain()
+
+
+def archive_response(decks, export_format, name):
+    response = StreamingHttpResponse(archive_chunks(decks, export_format), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{slugify(name) or "decks"}.zip"'
+    return response
@@ -0,0 +1,111 @@
+"""
+Fast read path for the hot read-only endpoints.
+
+Deck detail, the flashcard list and the community listing can skip the
+DRF serializers: their rows are read with ``values_list()`` into plain
+dicts keyed like the serializer fields, and encoded with orjson. The bytes
+are identical to what the serializers and ``JSONRenderer`` produce, as
+long as the payload holds only strings, integers, booleans, None and
+datetimes (orjson spells some floats differently, so float fields must
+stay on the serializer path).
+
+``FLASHCARDS_FAST_READS = False`` turns the fast path off, e.g. to compare
+the two with ``run_benchmark --no-fast-reads``.
+"""
+import orjson
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import renderers
+
+# Output key -> column or ``with_stats`` annotation, in serializer field order
+CARD_FIELDS = {
+    'id': 'id',
+    'question': 'content__question',
+    'answer': 'content__answer',
+    'spaced_repetition': 'spaced_repetition',
+    'order': 'order',
+    'created_at': 'created_at',
+}
+
+DECK_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+    'is_public': 'is_public',
+    'card_count': 'num_cards',
+}
+
+COMMUNITY_DECK_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'card_count': 'num_cards',
+    'owner_name': 'owner__username',
+    'likes_count': 'num_likes',
+    'comments_count': 'num_comments',
+    'is_liked': 'is_liked',
+    'created_at': 'created_at',
+}
+
+
+class Encoded(bytes):
+    """A response body already encoded by ``encode``"""
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF's JSON renderer, passing bodies from the fast path through untouched"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Encoded):
+            return bytes(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+def enabled(request):
+    """Whether this request may be answered from the fast path"""
+    if not getattr(settings, 'FLASHCARDS_FAST_READS', True):
+        return False
+    # Serializers render datetimes in the current time zone; rows hold UTC
+    if timezone.get_current_timezone_name() != 'UTC':
+        return False
+    renderer = getattr(request, 'accepted_renderer', None)
+    # The browsable API and ?indent= responses go through the serializers
+    return isinstance(renderer, JSONRenderer) and renderer.get_indent(
+        request.accepted_media_type, {}
+    ) is None
+
+
+def encode(data):
+    """Encode like DRF's JSONRenderer: compact, UTF-8, JS-safe separators"""
+    body = orjson.dumps(data, option=orjson.OPT_UTC_Z)
+    if b'\xe2\x80\xa8' in body or b'\xe2\x80\xa9' in body:
+        body = body.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return Encoded(body)
+
+
+def encoded(response):
+    """Encode the data of a DRF response built from fast-path rows"""
+    response.data = encode(response.data)
+    return response
+
+
+def subset(fields, names):
+    """The entries of ``fields`` whose keys are in ``names``"""
+    return {key: column for key, column in fields.items() if key in names}
+
+
+def rows(queryset, fields, omit_null=()):
+    """
+    ``queryset`` as a list of dicts with the keys of ``fields``. Keys in
+    ``omit_null`` are dropped when None, as DRF drops a field whose source
+    crosses a missing relation (``owner.username`` of a deck without owner).
+    """
+    keys = list(fields)
+    result = [dict(zip(keys, row)) for row in queryset.values_list(*fields.values())]
+    for row in result:
+        for key in omit_null:
+            if row[key] is None:
+                del row[key]
+    return result
@@ -0,0 +1,47 @@
+"""
+Copy-on-write deck forks.
+
+A fork is a new deck whose cards point at the same CardContent rows as the
+cards of the deck it was forked from, so no question or answer text is
+copied. The card rows themselves are copied, each with its own position
+and review history, by one ``INSERT ... SELECT`` inside the database: the
+number of statements does not grow with the deck. Editing a forked card
+gives it a content row of its own; the source and other forks keep theirs.
+
+Forked cards get no duplicate fingerprints. Uploads still find their text
+through the fingerprints of the source deck, which is public or the
+forker's own; ``backfill_fingerprints`` indexes forks when that is not
+enough.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Deck, Flashcard, UserStats
+from .ordering import CARD_ORDER
+
+
+@transaction.atomic
+def fork(source, owner):
+    """Copy ``source`` into a new private deck of ``owner`` and return it"""
+    deck = Deck.objects.create(
+        name=source.name, description=source.description, owner=owner, forked_from=source
+    )
+    qn = connection.ops.quote_name
+    table = qn(Flashcard._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        # Inserted in deck order, so the copies' ids break position ties alike
+        cursor.execute(
+            f'INSERT INTO {table} (deck_id, content_id, spaced_repetition, {qn("order")}, '
+            f'created_at, updated_at) '
+            f'SELECT %s, content_id, spaced_repetition, {qn("order")}, %s, %s '
+            f'FROM {table} WHERE deck_id = %s '
+            f'ORDER BY {", ".join(qn(name) for name in CARD_ORDER)}',
+            [deck.pk, now, now, source.pk],
+        )
+        copied = cursor.rowcount
+    UserStats.objects.of(owner).record(decks=1)
+    if copied:
+        Deck.objects.filter(pk=deck.pk).record_activity(cards=copied)
+    deck.cards_total = copied
+    return deck
@@ -0,0 +1,314 @@
+"""
+Streaming bulk import of flashcards.
+
+The uploaded document is parsed incrementally, one card at a time, so the
+size of a deck is no longer bounded by request memory. Cards are validated
+row by row and written in fixed-size ``bulk_create`` batches inside a
+single transaction; invalid rows are reported instead of aborting the
+import.
+
+Both upload formats are accepted::
+
+    {"deck_name": "...", "description": "...", "flashcards": [{...}, ...]}
+    [{"question": "...", "answer": "...", "spacedRepetition": false}, ...]
+
+Every card is fingerprinted as it is written. Near-duplicates, of another
+card in the same upload, in a public deck or in one of the uploader's
+decks, are reported or skipped according to the ``duplicates`` mode.
+"""
+import codecs
+import json
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from . import duplicates as dedup, ordering
+from .models import Deck, Flashcard, UserStats
+from .serializers import BulkUploadSerializer
+
+MAX_REPORTED_ERRORS = 100
+
+
+class InvalidUpload(Exception):
+    """The document is not a deck upload; nothing has been written"""
+
+
+class StreamingDeckParser:
+    """
+    Incremental reader for a deck upload.
+
+    ``events()`` yields ``('field', key, value)`` for top-level deck fields
+    and ``('card', value)`` for each element of the flashcard list. Only
+    one card has to be held in memory at a time.
+    """
+    whitespace = ' \t\n\r'
+
+    def __init__(self, fileobj, chunk_size=64 * 1024):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def events(self):
+        ch = self.peek()
+        if ch == '[':
+            for card in self.array():
+                yield ('card', card)
+        elif ch == '{':
+            yield from self.document()
+        else:
+            raise InvalidUpload('Expected a JSON object or a list of flashcards')
+        if self.peek() is not None:
+            raise InvalidUpload('Unexpected data after the end of the document')
+
+    def document(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise InvalidUpload('Expected a field name')
+            self.expect(':')
+            if key == 'flashcards' and self.peek() == '[':
+                for card in self.array():
+                    yield ('card', card)
+            else:
+                yield ('field', key, self.value())
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as exc:
+                if self.eof:
+                    raise InvalidUpload(f'Invalid JSON: {exc.msg}')
+                self.fill(len(self.buffer) - self.pos)
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof:
+                self.fill(len(self.buffer) - self.pos)
+                continue
+            self.pos = end
+            return value
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self.fill()
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise InvalidUpload(f"Invalid JSON: expected '{ch}'")
+        self.pos += 1
+
+    def fill(self, pending=0):
+        # Read at least as much as is already pending so that re-decoding a
+        # value spanning many chunks stays linear.
+        data = self.fileobj.read(max(self.chunk_size, pending))
+        if isinstance(data, bytes):
+            text = self.decoder.decode(data, final=not data)
+        else:
+            text = data
+        if not data:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+
+@dataclass
+class ImportResult:
+    deck: Deck = None
+    imported: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+    duplicate_count: int = 0
+    duplicates: list = field(default_factory=list)
+
+    def add_error(self, row, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def add_duplicate(self, row, card, duplicate_of, deck, score):
+        self.duplicate_count += 1
+        if len(self.duplicates) < MAX_REPORTED_ERRORS:
+            self.duplicates.append({
+                'row': row, 'card': card, 'duplicate_of': duplicate_of,
+                'deck': deck, 'similarity': round(score, 3),
+            })
+
+
+def batch_size():
+    return getattr(settings, 'FLASHCARDS_IMPORT_BATCH_SIZE', 1000)
+
+
+def clean_card(card):
+    """Return ``(values, errors)`` for one uploaded card"""
+    if not isinstance(card, dict):
+        return None, {'non_field_errors': ['Expected an object with question and answer']}
+    errors = {}
+    values = {}
+    for name in ('question', 'answer'):
+        value = card.get(name)
+        if value is None or value == '':
+            errors[name] = ['This field is required.']
+        elif isinstance(value, (dict, list, bool)):
+            errors[name] = ['Must be text.']
+        else:
+            values[name] = str(value)
+    spaced = card.get('spacedRepetition', card.get('spaced_repetition', False))
+    if not isinstance(spaced, bool):
+        errors['spacedRepetition'] = ['Must be a boolean.']
+    values['spaced_repetition'] = spaced is True
+    return values, errors
+
+
+def import_deck(fileobj, metadata=None, owner=None, progress=None, atomic=True,
+                duplicates=dedup.FLAG):
+    """
+    Create a deck from an uploaded document and return an ImportResult.
+
+    ``metadata`` supplies deck fields not present in the document (e.g. the
+    deck name typed next to a bare-list upload); fields in the document win.
+    ``progress(result)`` is called after every written batch.
+    ``duplicates`` is one of ``allow``, ``flag`` (import and report) or
+    ``skip`` (report without importing).
+
+    With ``atomic=True`` the whole import is one transaction. Otherwise each
+    batch commits on its own, so progress is visible to other connections,
+    and a failed import deletes the partially created deck.
+    Raises ``InvalidUpload`` or DRF's ``ValidationError`` when the document
+    itself is unusable.
+    """
+    fields = dict(metadata or {})
+    result = ImportResult()
+    size = batch_size()
+    pending = []
+
+    def create_deck(**fields):
+        deck = Deck.objects.create(owner=owner, **fields)
+        UserStats.objects.of(owner).record(decks=1)
+        return deck
+
+    def deck_fields(provisional=False):
+        data = dict(fields)
+        if provisional:
+            # The deck name may still follow the flashcard list; it is
+            # validated for real once the whole document has been read.
+            data.setdefault('deck_name', 'Untitled deck')
+        serializer = BulkUploadSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return {
+            'name': data['deck_name'],
+            'description': data.get('description', ''),
+            'is_public': data.get('is_public', False),
+        }
+
+    def flush():
+        rows = [row for row, _ in pending]
+        cards = [Flashcard(deck=result.deck, **values) for _, values in pending]
+        signatures = [dedup.signature(card.question, card.answer) for card in cards]
+        matches = [None] * len(cards)
+        in_batch = {}
+        if duplicates != dedup.ALLOW:
+            matches = dedup.find_matches(signatures, dedup.upload_scope(result.deck, owner))
+            unmatched = [i for i, match in enumerate(matches) if match is None]
+            earlier = dedup.find_in_batch([signatures[i] for i in unmatched])
+            for i, found in zip(unmatched, earlier):
+                if found is not None:
+                    in_batch[i] = (unmatched[found[0]], found[1])
+        keep = [
+            i for i in range(len(cards))
+            if duplicates != dedup.SKIP or (matches[i] is None and i not in in_batch)
+        ]
+        created = [cards[i] for i in keep]
+        for index, card in enumerate(created, start=result.imported):
+            card.order = ordering.position(index)
+        with transaction.atomic(savepoint=False):
+            Flashcard.objects.bulk_create(created)
+            dedup.index_cards(created, [signatures[i] for i in keep])
+            if created:
+                Deck.objects.filter(pk=result.deck.pk).record_activity(cards=len(created))
+        for i, card in enumerate(cards):
+            if matches[i] is not None:
+                match = matches[i]
+                result.add_duplicate(rows[i], card.pk, match.card, match.deck, match.similarity)
+            elif i in in_batch:
+                j, score = in_batch[i]
+                result.add_duplicate(rows[i], card.pk, cards[j].pk, result.deck.pk, score)
+        result.imported += len(created)
+        pending.clear()
+        if progress is not None:
+            progress(result)
+
+    parser = StreamingDeckParser(fileobj)
+    try:
+        with transaction.atomic() if atomic else nullcontext():
+            row = 0
+            late_fields = False
+            for event in parser.events():
+                if event[0] == 'field':
+                    fields[event[1]] = event[2]
+                    late_fields = late_fields or result.deck is not None
+                    continue
+                if result.deck is None:
+                    result.deck = create_deck(**deck_fields(provisional=True))
+                    late_fields = 'deck_name' not in fields
+                values, errors = clean_card(event[1])
+                if errors:
+                    result.add_error(row, errors)
+                else:
+                    pending.append((row, values))
+                    if len(pending) >= size:
+                        flush()
+                row += 1
+            if pending:
+                flush()
+
+            if result.deck is None:
+                result.deck = create_deck(**deck_fields())
+            elif late_fields:
+                # Deck fields that followed the flashcard list in the document
+                Deck.objects.filter(pk=result.deck.pk).update(
+                    content_version=F('content_version') + 1, updated_at=timezone.now(),
+                    **deck_fields()
+                )
+                result.deck.refresh_from_db()
+    except Exception:
+        if not atomic and result.deck is not None:
+            Deck.objects.filter(pk=result.deck.pk).remove()
+        raise
+    return result
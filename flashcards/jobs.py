@@ -0,0 +1,204 @@
+"""
+DB-backed queue for background deck imports.
+
+The upload endpoint stores the document and an ``ImportJob`` row; one or
+more ``run_import_worker`` processes claim pending jobs with a conditional
+UPDATE, so no external broker is needed and several workers can share the
+queue safely.
+
+A running job's heartbeat is refreshed by a thread every
+``FLASHCARDS_IMPORT_HEARTBEAT_SECONDS``, independently of batch progress,
+so a slow batch is not mistaken for a dead worker. Every write a worker
+makes to its job is conditional on still owning it: once a job has been
+requeued as stale, the old worker drops its partial deck and stops.
+"""
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import OperationalError, connections
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import duplicates as dedup, imports
+from .models import Deck, ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+def heartbeat_interval():
+    """Seconds between heartbeats of a running job"""
+    return getattr(settings, 'FLASHCARDS_IMPORT_HEARTBEAT_SECONDS', 30)
+
+
+class JobLost(Exception):
+    """The job was requeued while this worker was still running it"""
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_import(fileobj, metadata=None, owner=None, duplicates=dedup.FLAG):
+    """Store an uploaded document and queue it for import"""
+    job = ImportJob(owner=owner, metadata=metadata or {}, duplicate_mode=duplicates)
+    name = getattr(fileobj, 'name', None) or 'upload.json'
+    job.source.save(os.path.basename(name), File(fileobj), save=False)
+    job.save()
+    return job
+
+
+def claim_next_job(worker_id):
+    """Atomically move the oldest pending job to running, or return None"""
+    while True:
+        job_id = ImportJob.objects.filter(status=ImportJob.PENDING).order_by(
+            'created_at'
+        ).values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job_id, status=ImportJob.PENDING).update(
+            status=ImportJob.RUNNING, worker=worker_id, started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            return ImportJob.objects.get(pk=job_id)
+
+
+def owned(job):
+    """The job's row, as long as it is still running on the worker that claimed it"""
+    return ImportJob.objects.filter(pk=job.pk, status=ImportJob.RUNNING, worker=job.worker)
+
+
+@contextmanager
+def heartbeat(job):
+    """Keep the job's heartbeat fresh from a thread while the block runs"""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(heartbeat_interval()):
+                try:
+                    if not owned(job).update(heartbeat_at=timezone.now()):
+                        return
+                except OperationalError:
+                    # e.g. "database is locked" while the import writes a batch
+                    logger.warning('Heartbeat of import job %s failed', job.pk, exc_info=True)
+        finally:
+            # Database connections are per thread; close this one's
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f'import-heartbeat-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """Import a claimed job's document, recording progress as batches commit"""
+    def progress(result):
+        updated = owned(job).update(
+            deck=result.deck,
+            rows_processed=result.imported,
+            error_count=result.error_count,
+            errors=result.errors,
+            duplicate_count=result.duplicate_count,
+            duplicates=result.duplicates,
+            heartbeat_at=timezone.now(),
+        )
+        if not updated:
+            # import_deck removes the partial deck on the way out
+            raise JobLost(job.pk)
+
+    try:
+        with heartbeat(job), job.source.open('rb') as source:
+            result = imports.import_deck(
+                source, metadata=job.metadata, owner=job.owner, progress=progress,
+                atomic=False, duplicates=job.duplicate_mode,
+            )
+    except JobLost:
+        logger.warning('Import job %s was requeued while %s ran it', job.pk, job.worker)
+    except imports.InvalidUpload as exc:
+        finish(job, ImportJob.FAILED, message=str(exc))
+    except ValidationError as exc:
+        finish(job, ImportJob.FAILED, message=describe(exc.detail))
+    except Exception as exc:
+        logger.exception('Import job %s failed', job.pk)
+        finish(job, ImportJob.FAILED, message=f'{type(exc).__name__}: {exc}')
+    else:
+        finished = finish(
+            job, ImportJob.SUCCEEDED,
+            deck=result.deck,
+            rows_processed=result.imported,
+            error_count=result.error_count,
+            errors=result.errors,
+            duplicate_count=result.duplicate_count,
+            duplicates=result.duplicates,
+        )
+        if not finished:
+            # The job is queued again and will import the document anew
+            Deck.objects.filter(pk=result.deck.pk).remove()
+    job.refresh_from_db()
+    return job
+
+
+def describe(detail):
+    """Flatten a DRF error detail into one readable line"""
+    if isinstance(detail, dict):
+        return '; '.join(f'{field}: {describe(errors)}' for field, errors in detail.items())
+    if isinstance(detail, list):
+        return ' '.join(describe(error) for error in detail)
+    return str(detail)
+
+
+def finish(job, status, **fields):
+    """
+    Record the outcome of a job this worker still owns; returns False,
+    leaving the job and its document alone, when it was requeued.
+    """
+    now = timezone.now()
+    finished = owned(job).update(status=status, finished_at=now, heartbeat_at=now, **fields)
+    if not finished:
+        logger.warning('Import job %s was requeued while %s ran it', job.pk, job.worker)
+        return False
+    job.source.delete(save=False)
+    return True
+
+
+def requeue_stale_jobs(stale_after):
+    """
+    Return jobs whose worker stopped sending heartbeats to the queue,
+    dropping the partial deck they had started writing.
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = ImportJob.objects.filter(status=ImportJob.RUNNING, heartbeat_at__lt=cutoff)
+    requeued = 0
+    for job in stale:
+        if job.deck_id is not None:
+            Deck.objects.filter(pk=job.deck_id).remove()
+        requeued += ImportJob.objects.filter(pk=job.pk, status=ImportJob.RUNNING).update(
+            status=ImportJob.PENDING, deck=None, worker='', started_at=None,
+            heartbeat_at=None, rows_processed=0, error_count=0, errors=[],
+            duplicate_count=0, duplicates=[],
+        )
+    return requeued
+
+
+def run_pending_jobs(worker_id=None, limit=None):
+    """Process queued jobs until the queue is empty; returns jobs run"""
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job(worker_id)
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
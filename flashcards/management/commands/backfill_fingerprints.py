@@ -0,0 +1,43 @@
+"""
+Fingerprint existing flashcards for near-duplicate detection
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from flashcards import duplicates
+from flashcards.models import CardFingerprint, Flashcard
+
+
+class Command(BaseCommand):
+    help = 'Compute MinHash/LSH fingerprints for cards that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Number of cards fingerprinted per transaction'
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop all fingerprints first, e.g. after changing the hashing parameters'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            deleted, _ = CardFingerprint.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} fingerprints')
+
+        missing = Flashcard.objects.filter(
+            ~Exists(CardFingerprint.objects.filter(card=OuterRef('pk')))
+        ).only('pk', 'content__question', 'content__answer').order_by('pk')
+        last_pk = 0
+        total = 0
+        while True:
+            cards = list(missing.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not cards:
+                break
+            with transaction.atomic():
+                duplicates.index_cards(cards)
+            last_pk = cards[-1].pk
+            total += len(cards)
+            self.stdout.write(f'Fingerprinted {total} cards')
+        self.stdout.write(self.style.SUCCESS(f'Done: {total} cards fingerprinted'))
@@ -0,0 +1,221 @@
+"""
+Generate a large synthetic dataset for load testing and benchmarks
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from flashcards import duplicates, ordering, trending
+from flashcards.models import Deck, DeckComment, DeckLike, Flashcard, StudySession
+
+WORDS = (
+    'atom cell energy force gene history language market matrix molecule number orbit '
+    'planet protein reaction river rule science signal state system theory value vector '
+    'wave acid angle archive battle border capital climate colony current empire enzyme '
+    'equation fossil fraction friction galaxy gravity harbor island lattice lever metal '
+    'nucleus organ oxygen pattern pressure prism pulse quantum radius region resistor '
+    'sample sentence series solvent spectrum symbol tissue treaty union verb voltage'
+).split()
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let bulk_create keep the created_at/updated_at values set on the
+    instances instead of stamping every row with the current time
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create users, decks, cards, likes, comments and study sessions for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--decks', type=int, default=10000)
+        parser.add_argument(
+            '--cards-per-deck', type=float, default=50,
+            help='Mean deck size; sizes are exponentially distributed so a few decks are large'
+        )
+        parser.add_argument('--max-cards', type=int, default=20000, help='Largest deck size')
+        parser.add_argument('--likes-per-deck', type=float, default=5)
+        parser.add_argument('--comments-per-deck', type=float, default=2)
+        parser.add_argument('--sessions', type=int, default=100000)
+        parser.add_argument('--public-ratio', type=float, default=0.3)
+        parser.add_argument('--days', type=int, default=365, help='Spread timestamps over this many days')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='load', help='Username prefix of the generated users')
+        parser.add_argument('--password', default='loadtest', help='Password of every generated user')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of decks (with their cards, likes and comments) written per transaction'
+        )
+        parser.add_argument(
+            '--fingerprints', action='store_true',
+            help='Also fingerprint cards for duplicate detection (slow; see backfill_fingerprints)'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"Users named '{prefix}*' already exist; pick another --prefix")
+
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=options['days'])
+        self.options = options
+
+        with explicit_timestamps(Deck, Flashcard, DeckLike, DeckComment, StudySession):
+            user_ids = self.create_users()
+            decks = self.create_decks(user_ids)
+            sessions = self.create_sessions(user_ids, decks)
+
+        call_command('reconcile_user_stats', stdout=self.stdout)
+        call_command('refresh_analytics', stdout=self.stdout)
+        cards = sum(size for _, _, size in decks)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids)} users, {len(decks)} decks, {cards} cards '
+            f'and {sessions} sessions (seed {options["seed"]})'
+        ))
+
+    def moment(self, after=None):
+        """Random timestamp between ``after`` (or the start) and now"""
+        low = after or self.start
+        return low + (self.now - low) * self.rng.random()
+
+    def words(self, low, high):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def count(self, mean, limit):
+        if mean <= 0:
+            return 0
+        return min(limit, int(self.rng.expovariate(1 / mean)))
+
+    def create_users(self):
+        password = make_password(self.options['password'])
+        prefix = self.options['prefix']
+        total = self.options['users']
+        ids = []
+        for start in range(0, total, 5000):
+            users = User.objects.bulk_create([
+                User(username=f'{prefix}{i:07d}', email=f'{prefix}{i:07d}@example.com',
+                     password=password, date_joined=self.moment())
+                for i in range(start, min(total, start + 5000))
+            ])
+            ids += [user.pk for user in users]
+        self.stdout.write(f'Created {len(ids)} users')
+        return ids
+
+    def create_decks(self, user_ids):
+        """Returns ``(pk, created_at, card_count)`` for every deck"""
+        options = self.options
+        created = []
+        for start in range(0, options['decks'], options['batch_size']):
+            batch = range(start, min(options['decks'], start + options['batch_size']))
+            with transaction.atomic():
+                created += self.create_deck_batch(batch, user_ids)
+            self.stdout.write(f'Created {len(created)} decks')
+        return created
+
+    def create_deck_batch(self, batch, user_ids):
+        options = self.options
+        rng = self.rng
+        decks, contents = [], []
+        for i in batch:
+            created_at = self.moment()
+            cards = max(1, self.count(options['cards_per_deck'], options['max_cards']))
+            likers = rng.sample(user_ids, self.count(options['likes_per_deck'], len(user_ids)))
+            comments = [
+                (rng.choice(user_ids), self.moment(created_at))
+                for _ in range(self.count(options['comments_per_deck'], 1000))
+            ]
+            likes = [(user_id, self.moment(created_at)) for user_id in likers]
+            score = trending.ScoreAccumulator()
+            score.add(1, created_at)
+            for _, when in likes:
+                score.add(trending.LIKE_WEIGHT, when)
+            for _, when in comments:
+                score.add(trending.COMMENT_WEIGHT, when)
+            decks.append(Deck(
+                name=f'{self.words(1, 3).title()} {i}',
+                description=self.words(0, 12),
+                owner_id=rng.choice(user_ids),
+                is_public=rng.random() < options['public_ratio'],
+                created_at=created_at,
+                updated_at=created_at,
+                cards_total=cards,
+                likes_total=len(likes),
+                comments_total=len(comments),
+                hot_score=score.score,
+            ))
+            contents.append((cards, likes, comments))
+        Deck.objects.bulk_create(decks)
+
+        cards, likes, comments = [], [], []
+        for deck, (size, deck_likes, deck_comments) in zip(decks, contents):
+            for order in range(size):
+                when = self.moment(deck.created_at)
+                cards.append(Flashcard(
+                    deck=deck,
+                    question=f'What is the {self.words(1, 3)}?',
+                    answer=self.words(3, 20),
+                    spaced_repetition=rng.random() < 0.3,
+                    order=ordering.position(order),
+                    created_at=when,
+                    updated_at=when,
+                ))
+            likes += [DeckLike(deck=deck, user_id=user_id, created_at=when) for user_id, when in deck_likes]
+            comments += [
+                DeckComment(deck=deck, user_id=user_id, text=self.words(2, 25), created_at=when)
+                for user_id, when in deck_comments
+            ]
+        Flashcard.objects.bulk_create(cards, batch_size=2000)
+        DeckLike.objects.bulk_create(likes, batch_size=2000)
+        DeckComment.objects.bulk_create(comments, batch_size=2000)
+        if self.options['fingerprints']:
+            duplicates.index_cards(cards)
+        return [(deck.pk, deck.created_at, size) for deck, (size, _, _) in zip(decks, contents)]
+
+    def create_sessions(self, user_ids, decks):
+        rng = self.rng
+        total = self.options['sessions']
+        for start in range(0, total, 5000):
+            sessions = []
+            for _ in range(min(5000, total - start)):
+                deck_id, created_at, size = rng.choice(decks)
+                started_at = self.moment(created_at)
+                attempts = rng.randint(1, min(2 * size, 100))
+                completed_at = None
+                if rng.random() < 0.8:
+                    completed_at = min(self.now, started_at + timedelta(seconds=rng.randint(30, 1800)))
+                sessions.append(StudySession(
+                    deck_id=deck_id,
+                    user_id=rng.choice(user_ids),
+                    started_at=started_at,
+                    completed_at=completed_at,
+                    total_attempts=attempts,
+                    correct_count=round(attempts * rng.betavariate(5, 2)),
+                ))
+            with transaction.atomic():
+                StudySession.objects.bulk_create(sessions, batch_size=2000)
+            self.stdout.write(f'Created {start + len(sessions)} sessions')
+        return total
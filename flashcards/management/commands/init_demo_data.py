@@ -2,6 +2,7 @@
 Initial data setup for demo decks
 """
 from django.core.management.base import BaseCommand
+from flashcards import duplicates, ordering
 from flashcards.models import Deck, Flashcard
 
 
@@ -48,8 +49,10 @@ class Command(BaseCommand):
                     question=card_data['question'],
                     answer=card_data['answer'],
                     spaced_repetition=card_data['spaced_repetition'],
-                    order=idx
+                    order=ordering.position(idx)
                 )
+            Deck.objects.filter(pk=biology_deck.pk).record_activity(cards=len(biology_cards))
+            duplicates.index_cards(biology_deck.flashcards.all())
             
             self.stdout.write(self.style.SUCCESS(f'Created Biology deck with {len(biology_cards)} cards'))
 
@@ -87,8 +90,10 @@ class Command(BaseCommand):
                     question=card_data['question'],
                     answer=card_data['answer'],
                     spaced_repetition=card_data['spaced_repetition'],
-                    order=idx
+                    order=ordering.position(idx)
                 )
+            Deck.objects.filter(pk=chemistry_deck.pk).record_activity(cards=len(chemistry_cards))
+            duplicates.index_cards(chemistry_deck.flashcards.all())
             
             self.stdout.write(self.style.SUCCESS(f'Created Chemistry deck with {len(chemistry_cards)} cards'))
 
@@ -121,8 +126,10 @@ class Command(BaseCommand):
                     question=card_data['question'],
                     answer=card_data['answer'],
                     spaced_repetition=card_data['spaced_repetition'],
-                    order=idx
+                    order=ordering.position(idx)
                 )
+            Deck.objects.filter(pk=history_deck.pk).record_activity(cards=len(history_cards))
+            duplicates.index_cards(history_deck.flashcards.all())
             
             self.stdout.write(self.style.SUCCESS(f'Created History deck with {len(history_cards)} cards'))
 
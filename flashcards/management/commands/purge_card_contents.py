@@ -0,0 +1,18 @@
+"""
+Delete card texts that no card uses any more
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from flashcards.models import CardContent, Flashcard
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete CardContent rows left behind by edited and deleted cards; texts are shared '
+        'between cards, so they are never deleted with a card'
+    )
+
+    def handle(self, *args, **options):
+        used = Flashcard.objects.filter(content=OuterRef('pk'))
+        deleted, _ = CardContent.objects.filter(~Exists(used)).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} card texts'))
@@ -0,0 +1,18 @@
+"""
+Delete sync tombstones older than the retention period
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from flashcards import sync
+from flashcards.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete tombstones older than FLASHCARDS_SYNC_RETENTION_DAYS; clients with older '
+        'sync tokens get a full sync instead'
+    )
+
+    def handle(self, *args, **options):
+        deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - sync.retention()).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} tombstones'))
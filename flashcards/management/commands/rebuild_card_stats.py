@@ -0,0 +1,14 @@
+"""
+Recompute per-card difficulty stats from the answer event log
+"""
+from django.core.management.base import BaseCommand
+from flashcards import answerlog
+
+
+class Command(BaseCommand):
+    help = 'Rebuild CardStats from AnswerEvent rows'
+
+    def handle(self, *args, **options):
+        answerlog.flush()
+        count = answerlog.rebuild_card_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {count} cards'))
@@ -0,0 +1,67 @@
+"""
+Reconcile the denormalized deck counters and trending scores
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef
+from flashcards import trending
+from flashcards.models import Deck, DeckComment, DeckLike, Flashcard, subquery_count
+
+
+class Command(BaseCommand):
+    help = 'Recompute deck like/comment/card counters and hot scores from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of decks written per UPDATE batch'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=1e-6,
+            help='Hot score difference below which a deck is left untouched'
+        )
+
+    def handle(self, *args, **options):
+        counters = [
+            ('likes_total', DeckLike),
+            ('comments_total', DeckComment),
+            ('cards_total', Flashcard),
+        ]
+        for field, model in counters:
+            actual = subquery_count(model.objects.filter(deck=OuterRef('pk')))
+            drifted = Deck.objects.annotate(actual=actual).exclude(**{field: F('actual')})
+            fixed = Deck.objects.filter(pk__in=drifted.values('pk')).update(**{field: actual})
+            self.stdout.write(f'{field}: corrected {fixed} decks')
+
+        fixed = self.rebuild_scores(options['batch_size'], options['tolerance'])
+        self.stdout.write(self.style.SUCCESS(f'hot_score: corrected {fixed} decks'))
+
+    def rebuild_scores(self, batch_size, tolerance):
+        scores = {}
+        for pk, created_at in Deck.objects.values_list('pk', 'created_at').iterator():
+            scores[pk] = trending.ScoreAccumulator()
+            scores[pk].add(1, created_at)
+        events = [
+            (DeckLike, trending.LIKE_WEIGHT),
+            (DeckComment, trending.COMMENT_WEIGHT),
+        ]
+        for model, weight in events:
+            rows = model.objects.order_by().values_list('deck_id', 'created_at')
+            for deck_id, created_at in rows.iterator(chunk_size=5000):
+                if deck_id in scores:
+                    scores[deck_id].add(weight, created_at)
+
+        stale = []
+        fixed = 0
+        stored = Deck.objects.order_by().values_list('pk', 'hot_score')
+        for pk, hot_score in stored.iterator(chunk_size=5000):
+            score = scores[pk].score if pk in scores else hot_score
+            if abs(score - hot_score) > tolerance:
+                stale.append(Deck(pk=pk, hot_score=score))
+            if len(stale) >= batch_size:
+                Deck.objects.bulk_update(stale, ['hot_score'])
+                fixed += len(stale)
+                stale = []
+        if stale:
+            Deck.objects.bulk_update(stale, ['hot_score'])
+            fixed += len(stale)
+        return fixed
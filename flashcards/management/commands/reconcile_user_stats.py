@@ -0,0 +1,40 @@
+"""
+Rebuild the per-user stats rollup from the source tables
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from flashcards import stats
+from flashcards.models import UserStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute UserStats rows and correct any that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of users recomputed per batch'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        last_pk = 0
+        checked = corrected = 0
+        while True:
+            batch = list(users.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            rows = stats.compute(User.objects.filter(pk__in=batch))
+            current = {row.pk: row for row in UserStats.objects.filter(pk__in=batch)}
+            drifted = [
+                row for row in rows
+                if row.pk not in current or any(
+                    getattr(row, field) != getattr(current[row.pk], field)
+                    for field in stats.STAT_FIELDS
+                )
+            ]
+            stats.save(drifted)
+            checked += len(rows)
+            corrected += len(drifted)
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} users, corrected {corrected}'))
@@ -0,0 +1,22 @@
+"""
+Roll completed study sessions into the analytics buckets
+"""
+from django.core.management.base import BaseCommand
+from flashcards import analytics
+
+
+class Command(BaseCommand):
+    help = 'Add sessions completed since the last run to the hourly and daily study buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop all buckets and recount every completed session'
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            added = analytics.rebuild()
+        else:
+            added = analytics.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {added} sessions'))
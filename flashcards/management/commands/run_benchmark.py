@@ -0,0 +1,126 @@
+"""
+Benchmark every flashcards route and optionally compare with a baseline
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from flashcards import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay every API route and report p50/p95/p99 latency, queries per request and '
+        'throughput. Writes rows, so run it against a disposable database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per scenario')
+        parser.add_argument('--user', help='Username to act as (default: owner of the largest public deck)')
+        parser.add_argument('--password', help='Password of that user; enables the login scenario')
+        parser.add_argument(
+            '--url', help='Benchmark a running server sharing this database instead of running '
+                          'in process (requires --password; queries are not counted)'
+        )
+        parser.add_argument(
+            '--only', action='append', default=[],
+            help='Only run scenarios for this route name (repeatable)'
+        )
+        parser.add_argument(
+            '--no-fast-reads', action='store_true',
+            help='Serve read endpoints through the DRF serializers (FLASHCARDS_FAST_READS = False), '
+                 'e.g. to save a baseline the fast path is compared against'
+        )
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+        parser.add_argument('--compare', help='Baseline report to compare against')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Relative p95 increase tolerated before a route counts as regressed'
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Exit with an error if any route regressed against --compare'
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user named {options['user']}")
+        try:
+            targets = benchmark.find_targets(user)
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        scenarios = benchmark.scenarios(targets, options['password'])
+        missing = benchmark.uncovered(scenarios)
+        if missing:
+            self.stdout.write(self.style.WARNING(f'Routes without a scenario: {", ".join(missing)}'))
+        if options['only']:
+            scenarios = [s for s in scenarios if s.name in options['only']]
+            if not scenarios:
+                raise CommandError('--only matched no scenario')
+
+        if options['url']:
+            if not options['password']:
+                raise CommandError('--url requires --password')
+            if options['no_fast_reads']:
+                raise CommandError("--no-fast-reads only applies in process; set it in the server's settings")
+            try:
+                client = benchmark.HTTPClient(options['url'], targets.user.username, options['password'])
+            except ValueError as exc:
+                raise CommandError(exc)
+        else:
+            client = benchmark.LocalClient(targets.user)
+
+        self.stdout.write(
+            f'Benchmarking {len(scenarios)} scenarios as {targets.user.username} '
+            f'on deck {targets.deck.pk} ({targets.deck.cards_total} cards)'
+        )
+        with override_settings(FLASHCARDS_FAST_READS=not options['no_fast_reads']):
+            report = benchmark.run(scenarios, client, options['iterations'], options['warmup'])
+        report['user'] = targets.user.username
+        report['deck'] = {'id': targets.deck.pk, 'cards': targets.deck.cards_total}
+        self.print_report(report)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            rows = benchmark.compare(baseline, report, options['tolerance'])
+            regressed = self.print_comparison(rows)
+            if regressed and options['fail_on_regression']:
+                raise CommandError(f'{regressed} routes regressed')
+
+    def print_report(self, report):
+        self.stdout.write(f"{'scenario':<58} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>7} {'req/s':>7}")
+        for key, row in report['routes'].items():
+            queries = '-' if row['queries'] is None else row['queries']
+            line = (
+                f"{key[:58]:<58} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                f"{queries:>7} {row['throughput_rps']:>7.1f}"
+            )
+            self.stdout.write(self.style.ERROR(line) if row['errors'] else line)
+        self.stdout.write(f"{report['requests']} requests, {report['throughput_rps']} req/s overall")
+
+    def print_comparison(self, rows):
+        regressed = 0
+        self.stdout.write(f"{'scenario':<58} {'p95 before':>10} {'p95 now':>10} {'change':>8} {'queries':>9}")
+        for key, before, now, change, queries_before, queries_now, worse in rows:
+            line = (
+                f'{key[:58]:<58} {before:>10.2f} {now:>10.2f} {change:>+8.0%} '
+                f'{queries_before!s:>4}->{queries_now!s:<4}'
+            )
+            if worse:
+                regressed += 1
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+        self.stdout.write(f'{regressed} of {len(rows)} routes regressed')
+        return regressed
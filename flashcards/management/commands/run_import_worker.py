@@ -0,0 +1,47 @@
+"""
+Background worker for queued deck imports
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from flashcards import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued deck imports from the database job table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process the jobs currently queued and exit'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait between polls when the queue is empty'
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=300,
+            help='Requeue running jobs with no heartbeat for this many seconds'
+        )
+
+    def handle(self, *args, **options):
+        if options['stale_after'] < 3 * jobs.heartbeat_interval():
+            raise CommandError(
+                f'--stale-after must be at least three heartbeats '
+                f'({3 * jobs.heartbeat_interval()}s)'
+            )
+        worker_id = jobs.default_worker_id()
+        self.stdout.write(f'Import worker {worker_id} started')
+        try:
+            while True:
+                requeued = jobs.requeue_stale_jobs(options['stale_after'])
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale jobs'))
+                processed = jobs.run_pending_jobs(worker_id)
+                if processed:
+                    self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs'))
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Import worker stopped')
@@ -0,0 +1,321 @@
+"""
+Request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` counts every request and records its latency, SQL
+query count and response size, labeled by view (the DRF viewset or view
+class) and action. Each process keeps its metrics in memory and writes
+them at most every ``FLASHCARDS_METRICS_FLUSH_SECONDS`` to its own file
+in ``FLASHCARDS_METRICS_DIR``; ``/metrics`` sums the files of every
+process, so workers of a multi-process server report together without an
+external collector.
+
+A process file is named after the PID and start time of its process, so a
+reused PID never overwrites the numbers of an earlier worker. Files of
+processes that have exited are folded into one aggregate file and removed,
+so counters never go backwards and the directory does not grow with every
+worker restart. The directory must therefore be local to one host. Empty it
+when deploying to start from zero.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Totals of exited processes, and the lock serializing folds and reads
+EXITED = 'exited.json'
+LOCK = '.lock'
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'flashcards_http_requests_total': (
+        'counter', 'HTTP requests by view, action, method and status', None,
+    ),
+    'flashcards_http_request_duration_seconds': (
+        'histogram', 'Time spent producing the response', DURATION_BUCKETS,
+    ),
+    'flashcards_db_queries_per_request': (
+        'histogram', 'SQL queries run while handling a request', QUERY_BUCKETS,
+    ),
+    'flashcards_http_response_size_bytes': (
+        'histogram', 'Response body size (streamed responses are not counted)', SIZE_BUCKETS,
+    ),
+}
+
+
+def metrics_dir():
+    return str(getattr(settings, 'FLASHCARDS_METRICS_DIR', ''))
+
+
+def flush_seconds():
+    return getattr(settings, 'FLASHCARDS_METRICS_FLUSH_SECONDS', 1.0)
+
+
+class Registry:
+    """Metrics of the current process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.filename = f'{self.pid}-{time.time_ns():x}.json'
+        self.counters = defaultdict(float)
+        # key -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+        self.flushed_at = 0.0
+        self.dirty = False
+
+    def check_fork(self):
+        # A forked worker must not report its parent's numbers again
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.check_fork()
+            self.counters[name, labels] += value
+            self.dirty = True
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self.lock:
+            self.check_fork()
+            values = self.histograms.get((name, labels))
+            if values is None:
+                values = self.histograms[name, labels] = [0] * (len(buckets) + 2)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            values[index] += 1
+            values[-1] += value
+            self.dirty = True
+
+    def snapshot(self):
+        with self.lock:
+            self.check_fork()
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, dict(labels), list(values)] for (name, labels), values in self.histograms.items()
+                ],
+            }
+
+    def maybe_flush(self):
+        if self.dirty and time.monotonic() - self.flushed_at >= flush_seconds():
+            self.flush()
+
+    def flush(self):
+        directory = metrics_dir()
+        if not directory:
+            return
+        self.flushed_at = time.monotonic()
+        self.dirty = False
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        temp = f'{path}.tmp'
+        with open(temp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp, path)
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def load(directory, name):
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Removed or replaced while listing
+        return None
+
+
+def exited(name):
+    """Whether the process that wrote ``name`` is gone"""
+    pid = name.removesuffix('.json').partition('-')[0]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def fold_exited(directory):
+    """Add the files of exited processes to ``EXITED`` and remove them"""
+    names = [name for name in os.listdir(directory) if name.endswith('.json') and exited(name)]
+    if not names:
+        return
+    with open(os.path.join(directory, LOCK), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        aggregate = load(directory, EXITED) or {'counters': [], 'histograms': [], 'merged': []}
+        # Names already counted; kept until their file is gone, so a fold
+        # interrupted before removing them does not count them twice
+        merged = {
+            name for name in aggregate['merged']
+            if os.path.exists(os.path.join(directory, name))
+        }
+        snapshots = [aggregate]
+        for name in names:
+            snapshot = None if name in merged else load(directory, name)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+                merged.add(name)
+        counters, histograms = merge(snapshots)
+        path = os.path.join(directory, EXITED)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({
+                'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+                'histograms': [
+                    [name, dict(labels), values] for (name, labels), values in histograms.items()
+                ],
+                'merged': sorted(merged),
+            }, f)
+        os.replace(f'{path}.tmp', path)
+        for name in merged:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """Snapshots of every process, or just this one without a directory"""
+    directory = metrics_dir()
+    if not directory:
+        return [registry.snapshot()]
+    registry.flush()
+    fold_exited(directory)
+    with open(os.path.join(directory, LOCK), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        aggregate = load(directory, EXITED)
+        merged = set(aggregate['merged']) if aggregate else set()
+        snapshots = [aggregate] if aggregate else []
+        for name in os.listdir(directory):
+            if name.endswith('.json') and name != EXITED and name not in merged:
+                snapshot = load(directory, name)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+    return snapshots
+
+
+def merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(sorted(labels.items()))] += value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+    return counters, histograms
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    counters, histograms = merge(collect())
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}'
+                )
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(values[-1])}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def view_labels(request):
+    """``(view, action)`` of the resolved view, e.g. ``('DeckViewSet', 'upload')``"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', ''
+    func = match.func
+    cls = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if cls is None:
+        return func.__name__, request.method.lower()
+    actions = getattr(func, 'actions', None) or {}
+    return cls.__name__, actions.get(request.method.lower(), request.method.lower())
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Records every request into the process registry"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        view, action = view_labels(request)
+        labels = (('view', view), ('action', action))
+        registry.inc('flashcards_http_requests_total', labels + (
+            ('method', request.method), ('status', str(response.status_code)),
+        ))
+        registry.observe('flashcards_http_request_duration_seconds', labels, elapsed)
+        registry.observe('flashcards_db_queries_per_request', labels, queries.count)
+        if not response.streaming:
+            registry.observe('flashcards_http_response_size_bytes', labels, len(response.content))
+        registry.maybe_flush()
+        return response
@@ -0,0 +1,107 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:47
+
+import math
+from datetime import datetime, timezone
+
+import flashcards.trending
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery
+
+# Same as flashcards.trending at the time of writing
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+MIN_WEIGHT = 2 ** -50
+
+
+class ScoreAccumulator:
+    """log2 of the sum of ``weight * 2 ** hot_time(when)`` over the added events"""
+
+    def __init__(self):
+        self.half_life = getattr(settings, 'FLASHCARDS_TRENDING_HALF_LIFE_HOURS', 72) * 3600
+        self.peak = None
+        self.total = 0.0
+
+    def add(self, weight, when):
+        k = (when - EPOCH).total_seconds() / self.half_life
+        if self.peak is None:
+            self.peak = k
+        elif k > self.peak:
+            self.total *= 2.0 ** (self.peak - k)
+            self.peak = k
+        self.total += weight * 2.0 ** (k - self.peak)
+
+    @property
+    def score(self):
+        return self.peak + math.log2(max(self.total, MIN_WEIGHT))
+
+
+def populate_trending(apps, schema_editor):
+    Deck = apps.get_model('flashcards', 'Deck')
+    Flashcard = apps.get_model('flashcards', 'Flashcard')
+    DeckLike = apps.get_model('flashcards', 'DeckLike')
+    DeckComment = apps.get_model('flashcards', 'DeckComment')
+
+    def count(model):
+        return Subquery(
+            model.objects.filter(deck=OuterRef('pk')).order_by()
+            .annotate(count=Func(F('pk'), function='COUNT')).values('count'),
+            output_field=models.IntegerField(),
+        )
+
+    Deck.objects.update(
+        cards_total=count(Flashcard),
+        likes_total=count(DeckLike),
+        comments_total=count(DeckComment),
+    )
+
+    scores = {}
+    for pk, created_at in Deck.objects.values_list('pk', 'created_at').iterator():
+        scores[pk] = ScoreAccumulator()
+        scores[pk].add(1, created_at)
+    events = [
+        (DeckLike, LIKE_WEIGHT),
+        (DeckComment, COMMENT_WEIGHT),
+    ]
+    for model, weight in events:
+        for deck_id, created_at in model.objects.values_list('deck_id', 'created_at').iterator():
+            scores[deck_id].add(weight, created_at)
+    decks = [Deck(pk=pk, hot_score=acc.score) for pk, acc in scores.items()]
+    Deck.objects.bulk_update(decks, ['hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0002_deckcomment_decklike'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='cards_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='comments_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='hot_score',
+            field=models.FloatField(default=flashcards.trending.hot_time_now),
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='likes_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='deck',
+            index=models.Index(fields=['is_public', '-hot_score'], name='deck_public_hot_idx'),
+        ),
+        migrations.RunPython(populate_trending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0003_deck_trending'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='studysession',
+            options={'ordering': ['-started_at']},
+        ),
+        migrations.AddIndex(
+            model_name='deck',
+            index=models.Index(fields=['-created_at', '-id'], name='deck_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deck',
+            index=models.Index(fields=['is_public', '-created_at', '-id'], name='deck_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deckcomment',
+            index=models.Index(fields=['deck', '-created_at', '-id'], name='comment_deck_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashcard',
+            index=models.Index(fields=['deck', 'order', 'created_at', 'id'], name='card_deck_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studysession',
+            index=models.Index(fields=['-started_at', '-id'], name='session_started_idx'),
+        ),
+    ]
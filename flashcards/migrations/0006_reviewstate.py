@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0005_importjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ease', models.FloatField(default=2.5)),
+                ('interval', models.FloatField(default=0)),
+                ('repetitions', models.PositiveIntegerField(default=0)),
+                ('lapses', models.PositiveIntegerField(default=0)),
+                ('due_at', models.DateTimeField()),
+                ('last_reviewed_at', models.DateTimeField(blank=True, null=True)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_states', to='flashcards.flashcard')),
+                ('deck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flashcards.deck')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['due_at'],
+                'indexes': [models.Index(fields=['user', 'due_at', 'id'], name='review_user_due_idx'), models.Index(fields=['user', 'deck', 'due_at'], name='review_user_deck_due_idx')],
+                'unique_together': {('user', 'card')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicate_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicate_mode',
+            field=models.CharField(default='flag', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicates',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.CreateModel(
+            name='CardFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band_hash', models.BigIntegerField()),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprints', to='flashcards.flashcard')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band_hash', 'card'], name='fingerprint_band_idx')],
+            },
+        ),
+    ]
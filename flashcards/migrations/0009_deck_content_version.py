@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0008_card_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='content_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('flashcards', '0009_deck_content_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('decks_created', models.PositiveIntegerField(default=0)),
+                ('cards_owned', models.PositiveIntegerField(default=0)),
+                ('study_sessions', models.PositiveIntegerField(default=0)),
+                ('total_correct', models.PositiveIntegerField(default=0)),
+                ('total_attempts', models.PositiveIntegerField(default=0)),
+                ('streak_days', models.PositiveIntegerField(default=0)),
+                ('longest_streak', models.PositiveIntegerField(default=0)),
+                ('last_study_date', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'user stats',
+            },
+        ),
+    ]
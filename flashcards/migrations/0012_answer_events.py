@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0011_study_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardStats',
+            fields=[
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='flashcards.flashcard')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('response_ms_total', models.PositiveBigIntegerField(default=0)),
+                ('timed_attempts', models.PositiveIntegerField(default=0)),
+                ('last_answered_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'card stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='AnswerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('correct', models.BooleanField()),
+                ('response_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('answered_at', models.DateTimeField()),
+                ('card', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='flashcards.flashcard')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='flashcards.studysession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['card', 'answered_at'], name='answer_card_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:37
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0012_answer_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('deck', 'Deck'), ('flashcard', 'Flashcard')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('deck_id', models.BigIntegerField()),
+                ('owner_id', models.IntegerField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='deck',
+            index=models.Index(fields=['owner', 'updated_at'], name='deck_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flashcard',
+            index=models.Index(fields=['deck', 'updated_at'], name='card_deck_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deck_id', 'deleted_at'], name='tombstone_deck_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['owner_id', 'deleted_at'], name='tombstone_owner_idx'),
+        ),
+    ]
@@ -0,0 +1,143 @@
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+BATCH = 1000
+
+
+def digest(question, answer):
+    # Same as flashcards.models.content_digest at the time of writing
+    return hashlib.sha256(f'{len(question)}:{question}{answer}'.encode()).hexdigest()
+
+
+def drop_card_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS flashcards_card_fts_{suffix}')
+        cursor.execute('DROP TABLE IF EXISTS flashcards_card_fts')
+
+
+def install_search(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Same as flashcards.search.install at the time of writing
+    fts, table, cols = 'flashcards_card_fts', 'flashcards_cardcontent', 'question, answer'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{cols}, content='{table}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, new.question, new.answer); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) "
+            f"VALUES ('delete', old.id, old.question, old.answer); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) "
+            f"VALUES ('delete', old.id, old.question, old.answer); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, new.question, new.answer); END"
+        )
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def move_text(apps, schema_editor):
+    Flashcard = apps.get_model('flashcards', 'Flashcard')
+    CardContent = apps.get_model('flashcards', 'CardContent')
+    last = 0
+    while True:
+        batch = list(Flashcard.objects.filter(pk__gt=last).order_by('pk').values_list(
+            'pk', 'question', 'answer'
+        )[:BATCH])
+        if not batch:
+            return
+        digests = {pk: digest(question, answer) for pk, question, answer in batch}
+        texts = {digests[pk]: (question, answer) for pk, question, answer in batch}
+        existing = set(CardContent.objects.filter(digest__in=list(texts)).values_list(
+            'digest', flat=True
+        ))
+        CardContent.objects.bulk_create([
+            CardContent(digest=key, question=question, answer=answer)
+            for key, (question, answer) in texts.items() if key not in existing
+        ])
+        ids = dict(CardContent.objects.filter(digest__in=list(texts)).values_list('digest', 'pk'))
+        Flashcard.objects.bulk_update(
+            [Flashcard(pk=pk, content_id=ids[key]) for pk, key in digests.items()], ['content']
+        )
+        last = batch[-1][0]
+
+
+def restore_text(apps, schema_editor):
+    Flashcard = apps.get_model('flashcards', 'Flashcard')
+    CardContent = apps.get_model('flashcards', 'CardContent')
+    content = CardContent.objects.filter(pk=OuterRef('content_id'))
+    Flashcard.objects.update(
+        question=Subquery(content.values('question')[:1]),
+        answer=Subquery(content.values('answer')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0013_sync_tombstones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('question', models.TextField()),
+                ('answer', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='deck',
+            name='forked_from',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='forks', to='flashcards.deck'),
+        ),
+        migrations.AddField(
+            model_name='flashcard',
+            name='content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='cards', to='flashcards.cardcontent'),
+        ),
+        # The card index reads the text columns about to be removed
+        migrations.RunPython(drop_card_search, migrations.RunPython.noop),
+        migrations.RunPython(move_text, restore_text),
+        # blank=True only so that unapplying restores the columns with a default
+        migrations.AlterField(
+            model_name='flashcard',
+            name='question',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='flashcard',
+            name='answer',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RemoveField(
+            model_name='flashcard',
+            name='question',
+        ),
+        migrations.RemoveField(
+            model_name='flashcard',
+            name='answer',
+        ),
+        migrations.AlterField(
+            model_name='flashcard',
+            name='content',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='cards', to='flashcards.cardcontent'),
+        ),
+        migrations.RunPython(install_search, drop_card_search),
+    ]
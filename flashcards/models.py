@@ -1,6 +1,94 @@
 from django.db import models
+from django.db.models import Case, Count, Exists, F, Func, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
+from django.utils import timezone
+import hashlib
 import json
+import uuid
+from datetime import timedelta
+
+from . import trending
+
+
+def subquery_count(queryset):
+    """Correlated COUNT(*) over ``queryset``, usable as an annotation"""
+    return Subquery(
+        queryset.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count'),
+        output_field=models.IntegerField(),
+    )
+
+
+def etag_for(deck_id, content_version, updated_at, variant=''):
+    """Strong ETag for a deck's cards and fields, e.g. per export format"""
+    stamp = int(updated_at.timestamp() * 1_000_000)
+    suffix = f'.{variant}' if variant else ''
+    return f'"deck{deck_id}.v{content_version}.{stamp}{suffix}"'
+
+
+class DeckQuerySet(models.QuerySet):
+    def with_stats(self, user=None):
+        """
+        Annotate the counts and like flag shown in deck listings so a page
+        of decks is served by a single query.
+        """
+        if user is not None and user.is_authenticated:
+            is_liked = Exists(DeckLike.objects.filter(deck=OuterRef('pk'), user=user))
+        else:
+            is_liked = Value(False, output_field=models.BooleanField())
+        return self.select_related('owner').annotate(
+            num_cards=F('cards_total'),
+            num_likes=F('likes_total'),
+            num_comments=F('comments_total'),
+            is_liked=is_liked,
+        )
+    
+    def record_activity(self, likes=0, comments=0, cards=0, when=None):
+        """
+        Atomically adjust the denormalized counters and fold likes and
+        comments into ``hot_score``. Negative deltas undo activity that
+        happened at ``when``. Adding or removing cards also bumps
+        ``content_version``.
+        """
+        updates = {}
+        if likes:
+            updates['likes_total'] = F('likes_total') + likes
+        if comments:
+            updates['comments_total'] = F('comments_total') + comments
+        if cards:
+            updates['cards_total'] = F('cards_total') + cards
+            updates['content_version'] = F('content_version') + 1
+            UserStats.objects.filter(user__in=self.values('owner')).record(cards=cards)
+        weight = likes * trending.LIKE_WEIGHT + comments * trending.COMMENT_WEIGHT
+        if weight:
+            hot_score = trending.fold_expression(weight, when)
+            if hot_score is not None:
+                updates['hot_score'] = hot_score
+        return self.update(**updates) if updates else 0
+    
+    def touch(self):
+        """Mark the decks' cards as changed, invalidating cached copies"""
+        return self.update(content_version=F('content_version') + 1)
+    
+    def remove(self):
+        """
+        Delete the decks, taking them, their cards and the study sessions
+        deleted with them off the users' stats
+        """
+        for owner_id, cards in self.exclude(owner=None).values_list('owner_id', 'cards_total'):
+            UserStats.objects.of(owner_id).record(decks=-1, cards=-cards)
+        sessions = StudySession.objects.filter(deck__in=self, user__isnull=False).values(
+            'user'
+        ).order_by().annotate(
+            count=Count('pk'), correct=Sum('correct_count'), attempts=Sum('total_attempts')
+        )
+        for row in sessions:
+            UserStats.objects.of(row['user']).record(
+                sessions=-row['count'], correct=-row['correct'], attempts=-row['attempts']
+            )
+        Tombstone.objects.record_decks(self.values_list('pk', 'owner_id'))
+        return self.delete()
+
 
 class Deck(models.Model):
     """Model for flashcard decks"""
@@ -10,9 +98,30 @@ class Deck(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    forked_from = models.ForeignKey(
+        'self', related_name='forks', on_delete=models.SET_NULL, null=True, blank=True
+    )
+    
+    # Denormalized counters maintained by DeckQuerySet.record_activity()
+    # and reconciled by the rebuild_trending command.
+    likes_total = models.PositiveIntegerField(default=0)
+    comments_total = models.PositiveIntegerField(default=0)
+    cards_total = models.PositiveIntegerField(default=0)
+    hot_score = models.FloatField(default=trending.hot_time_now)
+    # Bumped whenever a card in the deck is created, edited or deleted;
+    # together with updated_at it validates cached deck payloads (ETag).
+    content_version = models.PositiveIntegerField(default=1)
+    
+    objects = DeckQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_public', '-hot_score'], name='deck_public_hot_idx'),
+            models.Index(fields=['-created_at', '-id'], name='deck_created_idx'),
+            models.Index(fields=['is_public', '-created_at', '-id'], name='deck_public_created_idx'),
+            models.Index(fields=['owner', 'updated_at'], name='deck_owner_updated_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -22,11 +131,94 @@ class Deck(models.Model):
         return self.flashcards.count()
 
 
-class Flashcard(models.Model):
-    """Model for individual flashcards"""
-    deck = models.ForeignKey(Deck, related_name='flashcards', on_delete=models.CASCADE)
+def content_digest(question, answer):
+    """Hex SHA-256 naming a question and answer pair"""
+    return hashlib.sha256(f'{len(question)}:{question}{answer}'.encode()).hexdigest()
+
+
+class CardContentQuerySet(models.QuerySet):
+    def intern(self, texts):
+        """
+        Content rows for ``(question, answer)`` pairs, in order, created
+        where missing. The returned instances are not read back from the
+        database; they carry the pk, digest and text.
+        """
+        if not texts:
+            return []
+        digests = [content_digest(question, answer) for question, answer in texts]
+        # Existing rows are skipped, including ones a concurrent request just
+        # wrote; no pks come back with ignore_conflicts, so they are read after
+        self.bulk_create([
+            CardContent(digest=digest, question=question, answer=answer)
+            for digest, (question, answer) in dict(zip(digests, texts)).items()
+        ], batch_size=500, ignore_conflicts=True)
+        ids = self.ids_by_digest(digests)
+        return [
+            CardContent(pk=ids[digest], digest=digest, question=question, answer=answer)
+            for digest, (question, answer) in zip(digests, texts)
+        ]
+    
+    def ids_by_digest(self, digests):
+        ids = {}
+        unique = list(dict.fromkeys(digests))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            ids.update(self.filter(digest__in=chunk).values_list('digest', 'pk'))
+        return ids
+
+
+class CardContent(models.Model):
+    """
+    Question and answer text, stored once and shared by every card with
+    the same text, such as the cards of a deck and of its forks. Rows are
+    never edited: changing a card's text points it at another row.
+    """
+    digest = models.CharField(max_length=64, unique=True)
     question = models.TextField()
     answer = models.TextField()
+    
+    objects = CardContentQuerySet.as_manager()
+    
+    def __str__(self):
+        return self.question[:50]
+
+
+class FlashcardQuerySet(models.QuerySet):
+    def intern(self, cards):
+        """Point cards whose text was set at the content rows for that text"""
+        pending = [card for card in cards if getattr(card, '_pending_text', None) is not None]
+        contents = CardContent.objects.intern([card.text for card in pending])
+        for card, content in zip(pending, contents):
+            card.content = content
+            card._pending_text = None
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        self.intern(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+    
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if {'question', 'answer'} & set(fields):
+            self.intern(objs)
+            fields = [name for name in fields if name not in ('question', 'answer')] + ['content']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
+class FlashcardManager(models.Manager.from_queryset(FlashcardQuerySet)):
+    def get_queryset(self):
+        # A card is rarely read without its text
+        return super().get_queryset().select_related('content')
+
+
+class Flashcard(models.Model):
+    """
+    Model for individual flashcards. ``question`` and ``answer`` are read
+    from and written to the shared CardContent row, e.g.
+    ``Flashcard(deck=deck, question='...', answer='...')``.
+    """
+    deck = models.ForeignKey(Deck, related_name='flashcards', on_delete=models.CASCADE)
+    content = models.ForeignKey(CardContent, related_name='cards', on_delete=models.PROTECT)
     spaced_repetition = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -34,9 +226,51 @@ class Flashcard(models.Model):
     
     class Meta:
         ordering = ['order', 'created_at']
+        indexes = [
+            models.Index(fields=['deck', 'order', 'created_at', 'id'], name='card_deck_order_idx'),
+            models.Index(fields=['deck', 'updated_at'], name='card_deck_updated_idx'),
+        ]
+    
+    objects = FlashcardManager()
     
     def __str__(self):
         return f"{self.deck.name} - {self.question[:50]}"
+    
+    @property
+    def text(self):
+        """``(question, answer)``, including changes not saved yet"""
+        return (self.question, self.answer)
+    
+    @text.setter
+    def text(self, value):
+        self._pending_text = tuple(value)
+    
+    def _text(self, index, name):
+        pending = getattr(self, '_pending_text', None)
+        if pending is not None:
+            return pending[index]
+        # Reads one column, so a card loaded with only() reads no more
+        return '' if self.content_id is None else getattr(self.content, name)
+    
+    @property
+    def question(self):
+        return self._text(0, 'question')
+    
+    @question.setter
+    def question(self, value):
+        self.text = (value, self.answer)
+    
+    @property
+    def answer(self):
+        return self._text(1, 'answer')
+    
+    @answer.setter
+    def answer(self, value):
+        self.text = (self.question, value)
+    
+    def save(self, *args, **kwargs):
+        Flashcard.objects.intern([self])
+        super().save(*args, **kwargs)
 
 
 class StudySession(models.Model):
@@ -48,6 +282,12 @@ class StudySession(models.Model):
     correct_count = models.IntegerField(default=0)
     total_attempts = models.IntegerField(default=0)
     
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['-started_at', '-id'], name='session_started_idx'),
+        ]
+    
     def __str__(self):
         return f"Session for {self.deck.name} - {self.started_at}"
     
@@ -67,6 +307,9 @@ class DeckComment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['deck', '-created_at', '-id'], name='comment_deck_created_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.user.username} on {self.deck.name}"
@@ -84,3 +327,318 @@ class DeckLike(models.Model):
     
     def __str__(self):
         return f"{self.user.username} likes {self.deck.name}"
+
+
+class ImportJob(models.Model):
+    """Deck upload queued for the background import worker"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    deck = models.ForeignKey(Deck, on_delete=models.SET_NULL, null=True, blank=True)
+    source = models.FileField(upload_to='imports/')
+    metadata = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    rows_processed = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    duplicate_mode = models.CharField(max_length=10, default='flag')
+    duplicate_count = models.PositiveIntegerField(default=0)
+    duplicates = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='importjob_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Import {self.id} ({self.status})"
+    
+    @property
+    def throughput(self):
+        """Cards imported per second while the job ran"""
+        if self.started_at is None:
+            return 0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0
+
+
+class ReviewState(models.Model):
+    """Per-user SM-2 schedule of a flashcard"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    card = models.ForeignKey(Flashcard, related_name='review_states', on_delete=models.CASCADE)
+    # Denormalized from card.deck so a deck's due queue is one index range
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE)
+    ease = models.FloatField(default=2.5)
+    interval = models.FloatField(default=0)
+    repetitions = models.PositiveIntegerField(default=0)
+    lapses = models.PositiveIntegerField(default=0)
+    due_at = models.DateTimeField()
+    last_reviewed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['user', 'card']
+        ordering = ['due_at']
+        indexes = [
+            models.Index(fields=['user', 'due_at', 'id'], name='review_user_due_idx'),
+            models.Index(fields=['user', 'deck', 'due_at'], name='review_user_deck_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - card {self.card_id} due {self.due_at}"
+
+
+class CardFingerprint(models.Model):
+    """
+    One LSH band of a card's MinHash signature; cards sharing a band hash
+    are near-duplicate candidates (see duplicates.py).
+    """
+    card = models.ForeignKey(Flashcard, related_name='fingerprints', on_delete=models.CASCADE)
+    band_hash = models.BigIntegerField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['band_hash', 'card'], name='fingerprint_band_idx'),
+        ]
+    
+    def __str__(self):
+        return f"card {self.card_id} band {self.band_hash}"
+
+
+class UserStatsQuerySet(models.QuerySet):
+    def of(self, user):
+        """The stats row of ``user`` (a User or id); empty for anonymous"""
+        if user is None:
+            return self.none()
+        return self.filter(user=user)
+    
+    def record(self, decks=0, cards=0, sessions=0, correct=0, attempts=0, studied_on=None):
+        """
+        Atomically adjust the rolled-up counters; ``studied_on`` extends or
+        restarts the daily study streak and is ignored when it is older
+        than the last study day. Users without a row are skipped, their
+        row is built from the source tables when first read.
+
+        A study day is the local date an answer was given or a session was
+        completed; ``stats.study_days`` recomputes streaks from the same dates.
+        """
+        updates = {}
+        for field, delta in [
+            ('decks_created', decks),
+            ('cards_owned', cards),
+            ('study_sessions', sessions),
+            ('total_correct', correct),
+            ('total_attempts', attempts),
+        ]:
+            if delta:
+                updates[field] = F(field) + delta
+        if studied_on is not None:
+            streak = Case(
+                When(last_study_date__gte=studied_on, then=F('streak_days')),
+                When(last_study_date=studied_on - timedelta(days=1), then=F('streak_days') + 1),
+                default=Value(1),
+            )
+            updates['streak_days'] = streak
+            updates['longest_streak'] = Greatest(F('longest_streak'), streak)
+            updates['last_study_date'] = Case(
+                When(last_study_date__gt=studied_on, then=F('last_study_date')),
+                default=Value(studied_on),
+            )
+        return self.update(**updates) if updates else 0
+
+
+class UserStats(models.Model):
+    """
+    Per-user totals shown on the profile, maintained incrementally and
+    reconciled by the reconcile_user_stats command.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    decks_created = models.PositiveIntegerField(default=0)
+    cards_owned = models.PositiveIntegerField(default=0)
+    study_sessions = models.PositiveIntegerField(default=0)
+    total_correct = models.PositiveIntegerField(default=0)
+    total_attempts = models.PositiveIntegerField(default=0)
+    # Consecutive study days ending at last_study_date
+    streak_days = models.PositiveIntegerField(default=0)
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_study_date = models.DateField(null=True, blank=True)
+    
+    objects = UserStatsQuerySet.as_manager()
+    
+    class Meta:
+        verbose_name_plural = 'user stats'
+    
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+    
+    @property
+    def current_streak(self):
+        """The streak, or 0 once a whole day has passed without studying"""
+        if self.last_study_date is None:
+            return 0
+        if self.last_study_date < timezone.localdate() - timedelta(days=1):
+            return 0
+        return self.streak_days
+
+
+class StudyBucket(models.Model):
+    """
+    Completed study sessions rolled up per hour or day, user and deck.
+    ``period`` counts whole hours or days since the Unix epoch (UTC).
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hourly'),
+        (DAY, 'Daily'),
+    ]
+    
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    period = models.IntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE)
+    sessions = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'granularity', 'period'], name='bucket_user_period_idx'),
+            models.Index(fields=['deck', 'granularity', 'period'], name='bucket_deck_period_idx'),
+            models.Index(fields=['granularity', 'period'], name='bucket_period_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.granularity} {self.period} deck {self.deck_id} user {self.user_id}"
+
+
+class RollupWatermark(models.Model):
+    """How far a rollup has consumed its source table"""
+    name = models.CharField(max_length=50, primary_key=True)
+    position = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class AnswerEvent(models.Model):
+    """
+    One answer given during a study session. Append-only; written in
+    batches by the answer log's write-behind buffer (answerlog.py).
+    """
+    session = models.ForeignKey(StudySession, related_name='answers', on_delete=models.CASCADE)
+    # Null for answers from clients that do not report the card
+    card = models.ForeignKey(Flashcard, related_name='answers', on_delete=models.CASCADE,
+                             null=True, blank=True)
+    correct = models.BooleanField()
+    response_ms = models.PositiveIntegerField(null=True, blank=True)
+    answered_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['card', 'answered_at'], name='answer_card_time_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Answer to card {self.card_id} in session {self.session_id}"
+
+
+class CardStats(models.Model):
+    """Per-card answer totals aggregated from AnswerEvent"""
+    card = models.OneToOneField(Flashcard, primary_key=True, related_name='stats',
+                                on_delete=models.CASCADE)
+    attempts = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    # Sum and count of the answers that reported a response time
+    response_ms_total = models.PositiveBigIntegerField(default=0)
+    timed_attempts = models.PositiveIntegerField(default=0)
+    last_answered_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name_plural = 'card stats'
+    
+    def __str__(self):
+        return f"Stats for card {self.card_id}"
+    
+    @property
+    def accuracy(self):
+        if self.attempts == 0:
+            return 0
+        return round((self.correct / self.attempts) * 100)
+    
+    @property
+    def avg_response_ms(self):
+        if self.timed_attempts == 0:
+            return None
+        return round(self.response_ms_total / self.timed_attempts)
+    
+    @property
+    def difficulty(self):
+        """Smoothed error rate in [0, 1]; unanswered cards sit at 0.5"""
+        return round(1 - (self.correct + 1) / (self.attempts + 2), 3)
+
+
+class TombstoneQuerySet(models.QuerySet):
+    def record_decks(self, rows):
+        """Tombstones for ``(deck_id, owner_id)`` pairs of deleted decks"""
+        return self.bulk_create([
+            Tombstone(kind=Tombstone.DECK, object_id=deck_id, deck_id=deck_id, owner_id=owner_id)
+            for deck_id, owner_id in rows
+        ], batch_size=500)
+    
+    def record_cards(self, rows):
+        """Tombstones for ``(card_id, deck_id)`` pairs of cards deleted or moved out of a deck"""
+        return self.bulk_create([
+            Tombstone(kind=Tombstone.FLASHCARD, object_id=card_id, deck_id=deck_id)
+            for card_id, deck_id in rows
+        ], batch_size=500)
+
+
+class Tombstone(models.Model):
+    """
+    Deletion log read by delta sync (sync.py), so clients holding a copy of
+    a deleted deck or card learn to drop it. Decks deleted with their owner
+    and cards deleted with their deck get no tombstones of their own.
+    Purged after FLASHCARDS_SYNC_RETENTION_DAYS by purge_tombstones.
+    """
+    DECK = 'deck'
+    FLASHCARD = 'flashcard'
+    KIND_CHOICES = [
+        (DECK, 'Deck'),
+        (FLASHCARD, 'Flashcard'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # Plain ids rather than foreign keys: the rows are gone
+    deck_id = models.BigIntegerField()
+    owner_id = models.IntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    objects = TombstoneQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['deck_id', 'deleted_at'], name='tombstone_deck_idx'),
+            models.Index(fields=['owner_id', 'deleted_at'], name='tombstone_owner_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
@@ -0,0 +1,121 @@
+"""
+Gapped card positions.
+
+``Flashcard.order`` values are spaced ``GAP`` apart instead of numbered
+0, 1, 2, ..., so a card dropped between two others takes the midpoint of
+their positions and no other card is written. Only when two neighbours
+are too close for a midpoint are the cards right after the drop point
+spread out again: the window doubles until its positions have room for
+``MIN_GAP`` spacing, or reaches the end of the deck. A move therefore
+writes one row, and the occasional rebalance as few as it can.
+
+Cards sort by ``(order, created_at, id)``, matching ``card_deck_order_idx``.
+Decks numbered densely before positions were gapped, and cards sharing a
+position, still sort consistently; they are spread out the first time a
+card is placed among them.
+"""
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Flashcard
+
+GAP = 1024
+# Spacing a rebalance must leave between the positions it assigns
+MIN_GAP = 32
+# IntegerField range on every database backend
+MIN_ORDER = -2 ** 31
+MAX_ORDER = 2 ** 31 - 1
+CARD_ORDER = ['order', 'created_at', 'id']
+
+
+def position(index):
+    """Position of the ``index``-th card of a freshly numbered deck"""
+    return index * GAP
+
+
+def next_order(deck_id):
+    """Position right after the last card of a deck, for appended cards"""
+    last = Flashcard.objects.filter(deck_id=deck_id).order_by('-order').values_list(
+        'order', flat=True
+    ).first()
+    return 0 if last is None else last + GAP
+
+
+def after(card):
+    """``Q`` for the cards sorting after ``card`` in its deck"""
+    return (
+        Q(order__gt=card.order)
+        | Q(order=card.order, created_at__gt=card.created_at)
+        | Q(order=card.order, created_at=card.created_at, pk__gt=card.pk)
+    )
+
+
+def spread(low, high, count):
+    """
+    ``count`` increasing positions strictly between ``low`` and ``high``
+    (None for no bound), or None when there is no room for them
+    """
+    if low is None and high is None:
+        return [position(i) for i in range(count)]
+    if high is None:
+        orders = [low + GAP * (i + 1) for i in range(count)]
+    elif low is None:
+        orders = [high - GAP * (count - i) for i in range(count)]
+    else:
+        step = (high - low) // (count + 1)
+        # A lone card may take any free midpoint; a rebalance must leave room
+        if step < (1 if count == 1 else MIN_GAP):
+            return None
+        orders = [low + step * (i + 1) for i in range(count)]
+    if orders[0] < MIN_ORDER or orders[-1] > MAX_ORDER:
+        return None
+    return orders
+
+
+def place(card, previous=None):
+    """
+    Move ``card`` right after ``previous``, a card of the same deck, or to
+    the front of the deck with None. Saves the new positions and returns
+    the number of cards written.
+    """
+    others = Flashcard.objects.filter(deck_id=card.deck_id).exclude(pk=card.pk).order_by(
+        *CARD_ORDER
+    )
+    following = others if previous is None else others.filter(after(previous))
+    low = None if previous is None else previous.order
+    size = 0
+    while True:
+        window = list(following.values_list('pk', 'order')[:size + 1])
+        shifted = [pk for pk, _ in window[:size]]
+        high = window[size][1] if len(window) > size else None
+        orders = spread(low, high, len(shifted) + 1)
+        if orders is not None:
+            break
+        if high is None:
+            # Out of integer range at the end of the deck: renumber it all
+            return renumber(card, previous)
+        size = max(1, size * 2)
+    return save(card, orders[0], list(zip(shifted, orders[1:])))
+
+
+def renumber(card, previous=None):
+    """Give every card of the deck a fresh ``GAP``-spaced position"""
+    pks = list(Flashcard.objects.filter(deck_id=card.deck_id).exclude(pk=card.pk).order_by(
+        *CARD_ORDER
+    ).values_list('pk', flat=True))
+    pks.insert(0 if previous is None else pks.index(previous.pk) + 1, card.pk)
+    index = pks.index(card.pk)
+    return save(card, position(index), [
+        (pk, position(i)) for i, pk in enumerate(pks) if pk != card.pk
+    ])
+
+
+def save(card, order, shifted):
+    """Write ``card`` at ``order`` and the ``(pk, order)`` pairs in ``shifted``"""
+    now = timezone.now()
+    card.order = order
+    card.updated_at = now
+    cards = [card] + [Flashcard(pk=pk, order=value, updated_at=now) for pk, value in shifted]
+    # Renumbered cards count as changed, so delta sync sends their new position
+    Flashcard.objects.bulk_update(cards, ['order', 'updated_at'], batch_size=500)
+    return len(cards)
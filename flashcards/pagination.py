@@ -0,0 +1,169 @@
+"""
+Keyset (cursor) pagination for the API collections.
+
+Pages are located by comparing against the ordering values of the last row
+seen instead of an OFFSET, so page N costs the same as page 1 as long as an
+index covers the ordering.
+"""
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on every ordering field plus the primary key.
+
+    The ordering comes from the queryset (or the model's ``Meta.ordering``)
+    and is made total by appending ``pk`` in the direction of the last
+    field, so rows sharing a timestamp or ``order`` are never skipped.
+    """
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.pk_name = queryset.model._meta.pk.attname
+        values, reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [(name, not descending) for name, descending in ordering]
+        queryset = queryset.order_by(*[
+            ('-' if descending else '') + name for name, descending in ordering
+        ])
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        fields = list(queryset.query.order_by or queryset.model._meta.ordering)
+        ordering = [(field.lstrip('-'), field.startswith('-')) for field in fields]
+        names = {name for name, _ in ordering}
+        if 'pk' not in names and 'id' not in names:
+            descending = ordering[-1][1] if ordering else False
+            ordering.append(('pk', descending))
+        return ordering
+
+    def after(self, ordering, values):
+        """
+        Rows strictly after ``values`` in ``ordering``, as a nested
+        ``a > x OR (a = x AND (b > y OR ...))`` with a leading ``a >= x``
+        bound so the database can seek on the index.
+        """
+        condition = None
+        for (name, descending), value in reversed(list(zip(ordering, values))):
+            beyond = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+            if condition is None:
+                condition = beyond
+            else:
+                condition = beyond | (Q(**{name: value}) & condition)
+        name, descending = ordering[0]
+        return Q(**{f'{name}__{"lte" if descending else "gte"}': values[0]}) & condition
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii'), altchars=b'-_'))
+            raw_values = cursor['v']
+            if len(raw_values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.field_for(model, name).to_python(raw)
+                for (name, _), raw in zip(self.ordering, raw_values)
+            ]
+            return values, bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        values = [self.cursor_value(self.row_value(row, name)) for name, _ in self.ordering]
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = b64encode(payload.encode('utf-8'), altchars=b'-_').decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def cursor_value(self, value):
+        """
+        A JSON value for an ordering value; decode_cursor turns it back
+        with the field's ``to_python``
+        """
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        # UUIDs, Decimals and the like
+        return str(value)
+
+    def row_value(self, row, name):
+        """Ordering value of a model instance or of a ``.values()`` dict"""
+        if isinstance(row, dict):
+            return row[self.pk_name if name == 'pk' else name]
+        return getattr(row, name)
+
+    def field_for(self, model, name):
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.rows:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.rows[0], reverse=True)
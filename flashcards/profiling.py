@@ -0,0 +1,259 @@
+"""
+Per-request profiling.
+
+``ProfilingMiddleware`` times a sample of requests: SQL queries (count and
+time, through a database execute wrapper), DRF serializer ``.data``,
+the view itself and response rendering. Serializers are only instrumented
+while a sampled request is in flight. The numbers are returned in a
+``Server-Timing`` header to staff users (to everyone with DEBUG on), and
+requests slower than
+``FLASHCARDS_SLOW_REQUEST_MS`` are written with their slowest statements
+to a rotating JSON-lines log. Total time is measured for every request,
+so slow requests outside the sample are still logged, without the
+breakdown.
+
+Streaming responses are timed until their headers are ready; the body is
+produced after the middleware returns.
+"""
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework import serializers
+
+logger = logging.getLogger('flashcards.slow_requests')
+
+current = ContextVar('flashcards_profile', default=None)
+
+# Sampled requests in flight, and the serializer properties they replaced
+_timed_requests = 0
+_untimed = {}
+_timing_lock = threading.Lock()
+
+
+def sample_rate():
+    return getattr(settings, 'FLASHCARDS_PROFILE_SAMPLE_RATE', 0.01)
+
+
+def slow_request_ms():
+    return getattr(settings, 'FLASHCARDS_SLOW_REQUEST_MS', 500)
+
+
+def slow_sql_count():
+    return getattr(settings, 'FLASHCARDS_SLOW_SQL_COUNT', 5)
+
+
+class Profile:
+    """Timings collected for one request, in seconds"""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.view_started = None
+        self.view = None
+        self.slowest = []
+        self.serializing = False
+        self.keep = slow_sql_count()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper"""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = perf_counter() - start
+            self.queries += 1
+            self.db += elapsed
+            entry = (elapsed, self.queries, sql)
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, entry)
+            elif self.keep:
+                heapq.heappushpop(self.slowest, entry)
+
+    def end_view(self):
+        if self.view_started is not None and self.view is None:
+            self.view = perf_counter() - self.view_started
+
+    def server_timing(self, total):
+        metrics = [
+            ('db', self.db, f'{self.queries} queries'),
+            ('view', self.view, None),
+            ('serialize', self.serialize, None),
+            ('render', self.render(total), None),
+            ('total', total, None),
+        ]
+        return ', '.join(
+            f'{name};dur={seconds * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+            for name, seconds, desc in metrics if seconds is not None
+        )
+
+    def render(self, total):
+        """Time after the view returned: rendering and response middleware"""
+        if self.view is None or self.view_started is None:
+            return None
+        return max(0.0, total - (self.view_started - self.started) - self.view)
+
+    def slowest_statements(self):
+        return [
+            {'ms': round(elapsed * 1000, 2), 'sql': sql}
+            for elapsed, _, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+def timed_data(prop):
+    """Wrap a serializer ``data`` property to add its time to the profile"""
+    def data(self):
+        profile = current.get()
+        if profile is None or profile.serializing:
+            return prop.fget(self)
+        profile.serializing = True
+        start = perf_counter()
+        try:
+            return prop.fget(self)
+        finally:
+            profile.serialize += perf_counter() - start
+            profile.serializing = False
+    data.timed = True
+    return property(data)
+
+
+@contextmanager
+def serializer_timing():
+    """
+    Time serializer ``data`` while the block runs. Concurrent sampled
+    requests share one patch, removed when the last of them ends; other
+    requests running meanwhile pass straight through it.
+    """
+    global _timed_requests
+    with _timing_lock:
+        if not _timed_requests:
+            for cls in (serializers.Serializer, serializers.ListSerializer):
+                _untimed[cls] = cls.__dict__['data']
+                cls.data = timed_data(_untimed[cls])
+        _timed_requests += 1
+    try:
+        yield
+    finally:
+        with _timing_lock:
+            _timed_requests -= 1
+            if not _timed_requests:
+                for cls, prop in _untimed.items():
+                    cls.data = prop
+                _untimed.clear()
+
+
+def request_user(request, response):
+    """The user DRF authenticated (e.g. by JWT), else Django's session user"""
+    drf_request = (getattr(response, 'renderer_context', None) or {}).get('request')
+    user = getattr(drf_request, 'user', None)
+    if user is None:
+        user = getattr(request, 'user', None)
+    return user
+
+
+def show_timing(user):
+    """Whether the Server-Timing breakdown may be sent to ``user``"""
+    if not getattr(settings, 'FLASHCARDS_SERVER_TIMING', True):
+        return False
+    return settings.DEBUG or getattr(user, 'is_staff', False)
+
+
+def slow_log():
+    """The slow-request logger, given a rotating file unless LOGGING configures it"""
+    if not logger.handlers:
+        path = getattr(settings, 'FLASHCARDS_SLOW_REQUEST_LOG', None)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=getattr(settings, 'FLASHCARDS_SLOW_REQUEST_LOG_BYTES', 10 * 1024 * 1024),
+                backupCount=getattr(settings, 'FLASHCARDS_SLOW_REQUEST_LOG_BACKUPS', 5),
+                delay=True,
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class ProfilingMiddleware:
+    """
+    Adds Server-Timing to sampled requests and logs slow ones. Put it
+    first in MIDDLEWARE so the total covers the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.log = slow_log()
+
+    def __call__(self, request):
+        started = perf_counter()
+        if random.random() >= sample_rate():
+            response = self.get_response(request)
+            total = perf_counter() - started
+            if total * 1000 >= slow_request_ms():
+                self.log_slow(request, response, total, None)
+            return response
+
+        profile = Profile()
+        token = current.set(profile)
+        try:
+            with ExitStack() as stack:
+                stack.enter_context(serializer_timing())
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                request._profile = profile
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        profile.end_view()
+        total = perf_counter() - profile.started
+        if show_timing(request_user(request, response)):
+            response['Server-Timing'] = profile.server_timing(total)
+        if total * 1000 >= slow_request_ms():
+            self.log_slow(request, response, total, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.view_started = perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook, so the view ends here
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            profile.end_view()
+        return response
+
+    def log_slow(self, request, response, total, profile):
+        entry = {
+            'time': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': getattr(request_user(request, response), 'pk', None),
+            'total_ms': round(total * 1000, 1),
+        }
+        if profile is not None:
+            entry.update({
+                'view_ms': None if profile.view is None else round(profile.view * 1000, 1),
+                'db_ms': round(profile.db * 1000, 1),
+                'queries': profile.queries,
+                'serialize_ms': round(profile.serialize * 1000, 1),
+                'slowest_sql': profile.slowest_statements(),
+            })
+        self.log.info(json.dumps(entry))
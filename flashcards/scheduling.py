@@ -0,0 +1,44 @@
+"""
+SM-2 spaced-repetition scheduling.
+
+Grades follow SuperMemo: 0-2 means the card was forgotten, 3 recalled with
+difficulty, 4 recalled, 5 perfect recall. A forgotten card restarts its
+repetitions and comes back after ``RELEARN_DELAY``.
+"""
+from datetime import timedelta
+
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+PASSING_GRADE = 3
+RELEARN_DELAY = timedelta(minutes=10)
+
+
+def sm2(ease, interval, repetitions, grade):
+    """
+    Return ``(ease, interval_days, repetitions, lapsed)`` after answering a
+    card with ``grade``.
+    """
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    if grade < PASSING_GRADE:
+        return ease, 0.0, 0, True
+    if repetitions == 0:
+        interval = 1.0
+    elif repetitions == 1:
+        interval = 6.0
+    else:
+        interval = round(interval * ease, 2)
+    return ease, interval, repetitions + 1, False
+
+
+def review(state, grade, now):
+    """Apply ``grade`` to a ReviewState in place and return the changed fields"""
+    state.ease, state.interval, state.repetitions, lapsed = sm2(
+        state.ease, state.interval, state.repetitions, grade
+    )
+    if lapsed:
+        state.lapses += 1
+        state.due_at = now + RELEARN_DELAY
+    else:
+        state.due_at = now + timedelta(days=state.interval)
+    state.last_reviewed_at = now
+    return ['ease', 'interval', 'repetitions', 'lapses', 'due_at', 'last_reviewed_at']
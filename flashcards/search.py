@@ -0,0 +1,210 @@
+"""
+Full-text search over flashcards and decks.
+
+On SQLite the text lives in two external-content FTS5 tables that index
+``CardContent.question``/``answer`` and ``Deck.name``/``description``
+without storing a second copy of it. Card text shared by several cards,
+such as a deck and its forks, is indexed once. Triggers keep them in sync row by
+row, and results are ranked with BM25 and returned with highlighted
+snippets.
+
+SQLite drops a table's triggers whenever Django rebuilds that table in a
+migration, so ``install()`` is idempotent and also runs on
+``post_migrate``. Other databases fall back to ``icontains`` matching.
+"""
+import re
+
+from django.db import connection
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.expressions import RawSQL
+
+from .models import Deck, Flashcard
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+SNIPPET_TOKENS = 12
+
+INDEXES = [
+    # (fts table, content table, indexed columns)
+    ('flashcards_card_fts', 'flashcards_cardcontent', ['question', 'answer']),
+    ('flashcards_deck_fts', 'flashcards_deck', ['name', 'description']),
+]
+
+
+def is_supported(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def install(conn=connection):
+    """Create the FTS tables and sync triggers if they are missing"""
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        for fts, table, columns in INDEXES:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts]
+            )
+            exists = cursor.fetchone() is not None
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [table]
+            )
+            if cursor.fetchone() is None:
+                # Replaying older migrations: the one creating the table installs the index
+                continue
+            cols = ', '.join(columns)
+            new_cols = ', '.join(f'new.{c}' for c in columns)
+            old_cols = ', '.join(f'old.{c}' for c in columns)
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"{cols}, content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+                f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+            )
+            if not exists:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall(conn=connection):
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        for fts, _, _ in INDEXES:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+def rebuild(conn=connection):
+    """Re-index everything from the content tables"""
+    install(conn)
+    if is_supported(conn):
+        with conn.cursor() as cursor:
+            for fts, _, _ in INDEXES:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    """
+    Turn free text into a safe FTS5 query: every word must match, the last
+    one as a prefix so results update while typing.
+    """
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    quoted = ['"%s"' % term.replace('"', '""') for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def rowids(fts, query):
+    """
+    Subquery of the rowids of content table rows matching ``query`` in the
+    FTS table ``fts``, for ``__in`` lookups; None when nothing can match
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    return RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', [expression])
+
+
+def visible_to(user):
+    """SQL condition and params for decks the user may see"""
+    if user is not None and user.is_authenticated:
+        return '(d.is_public OR d.owner_id = %s)', [user.pk]
+    return 'd.is_public', []
+
+
+def search(query, user=None, limit=20):
+    """Return ``{'cards': [...], 'decks': [...]}`` best match first"""
+    if not is_supported():
+        return fallback_search(query, user, limit)
+    expression = match_expression(query)
+    if expression is None:
+        return {'cards': [], 'decks': []}
+    visibility, params = visible_to(user)
+    snippet = f"'{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', {SNIPPET_TOKENS}"
+    with connection.cursor() as cursor:
+        # One result per matching text: its first card the user may see,
+        # so a deck and its forks do not fill the page with the same hit
+        cursor.execute(
+            f"SELECT f.id, f.deck_id, deck.name, "
+            f"snippet(flashcards_card_fts, 0, {snippet}), "
+            f"snippet(flashcards_card_fts, 1, {snippet}), "
+            f"flashcards_card_fts.rank "
+            f"FROM flashcards_card_fts "
+            f"JOIN flashcards_flashcard f ON f.id = ("
+            f"SELECT MIN(c.id) FROM flashcards_flashcard c "
+            f"JOIN flashcards_deck d ON d.id = c.deck_id "
+            f"WHERE c.content_id = flashcards_card_fts.rowid AND {visibility}) "
+            f"JOIN flashcards_deck deck ON deck.id = f.deck_id "
+            f"WHERE flashcards_card_fts MATCH %s "
+            f"ORDER BY flashcards_card_fts.rank LIMIT %s",
+            [*params, expression, limit],
+        )
+        cards = [
+            {'id': row[0], 'deck': row[1], 'deck_name': row[2],
+             'question': row[3], 'answer': row[4], 'score': -row[5]}
+            for row in cursor.fetchall()
+        ]
+        cursor.execute(
+            f"SELECT d.id, "
+            f"snippet(flashcards_deck_fts, 0, {snippet}), "
+            f"snippet(flashcards_deck_fts, 1, {snippet}), "
+            f"flashcards_deck_fts.rank "
+            f"FROM flashcards_deck_fts "
+            f"JOIN flashcards_deck d ON d.id = flashcards_deck_fts.rowid "
+            f"WHERE flashcards_deck_fts MATCH %s AND {visibility} "
+            f"ORDER BY flashcards_deck_fts.rank LIMIT %s",
+            [expression, *params, limit],
+        )
+        decks = [
+            {'id': row[0], 'name': row[1], 'description': row[2], 'score': -row[3]}
+            for row in cursor.fetchall()
+        ]
+    return {'cards': cards, 'decks': decks}
+
+
+def fallback_search(query, user, limit):
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return {'cards': [], 'decks': []}
+    visible = Q(is_public=True)
+    if user is not None and user.is_authenticated:
+        visible |= Q(owner=user)
+    visible_decks = Deck.objects.filter(visible)
+    # The first visible card of each text, as in search()
+    first = Flashcard.objects.filter(
+        content=OuterRef('content'), deck__in=visible_decks
+    ).order_by('pk').values('pk')[:1]
+    card_filter = Q(pk=Subquery(first))
+    deck_filter = visible
+    for term in terms:
+        card_filter &= (
+            Q(content__question__icontains=term) | Q(content__answer__icontains=term)
+        )
+        deck_filter &= Q(name__icontains=term) | Q(description__icontains=term)
+    cards = Flashcard.objects.filter(card_filter).select_related('deck', 'content')[:limit]
+    decks = Deck.objects.filter(deck_filter)[:limit]
+    return {
+        'cards': [
+            {'id': c.pk, 'deck': c.deck_id, 'deck_name': c.deck.name,
+             'question': c.question, 'answer': c.answer, 'score': 0}
+            for c in cards
+        ],
+        'decks': [
+            {'id': d.pk, 'name': d.name, 'description': d.description, 'score': 0}
+            for d in decks
+        ],
+    }
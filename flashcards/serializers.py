@@ -1,33 +1,101 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Deck, Flashcard, StudySession, DeckComment, DeckLike
+from django.utils import timezone
+from .models import (
+    Deck, Flashcard, StudySession, DeckComment, DeckLike, ImportJob, ReviewState, UserStats,
+    CardStats,
+)
 
 
-class FlashcardSerializer(serializers.ModelSerializer):
+def annotated(obj, annotation, fallback):
+    """
+    Return an annotation added by ``DeckQuerySet.with_stats`` and fall back
+    to computing the value from the instance when it is missing.
+    """
+    if hasattr(obj, annotation):
+        return getattr(obj, annotation)
+    return fallback(obj)
+
+
+def selected(names, fields=None, exclude=None):
+    """``names`` narrowed to ``fields`` and without ``exclude``, keeping their order"""
+    return [
+        name for name in names
+        if (fields is None or name in fields) and name not in (exclude or ())
+    ]
+
+
+class SparseFieldsMixin:
+    """
+    Model serializer taking ``fields`` and ``exclude`` to output only some
+    of its ``Meta.fields``. Unknown names are ignored. ``related_columns``
+    names the related model columns of fields that are not model fields.
+    """
+    related_columns = {}
+    
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None or exclude:
+            keep = selected(self.fields, fields, exclude)
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+    
+    @classmethod
+    def columns(cls, fields=None, exclude=None):
+        """Model columns the selected fields read, for ``QuerySet.only()``"""
+        concrete = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        return [
+            cls.related_columns.get(name, name)
+            for name in selected(cls.Meta.fields, fields, exclude)
+            if name in concrete or name in cls.related_columns
+        ]
+
+
+class FlashcardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Stored on the card's CardContent row
+    question = serializers.CharField()
+    answer = serializers.CharField()
+    related_columns = {'question': 'content__question', 'answer': 'content__answer'}
+    
     class Meta:
         model = Flashcard
         fields = ['id', 'question', 'answer', 'spaced_repetition', 'order', 'created_at']
         read_only_fields = ['id', 'created_at']
 
 
-class DeckSerializer(serializers.ModelSerializer):
+class FlashcardCreateSerializer(FlashcardSerializer):
+    """A new card names its deck; moving a card goes through the bulk endpoint"""
+    deck = serializers.PrimaryKeyRelatedField(queryset=Deck.objects.all(), write_only=True)
+    
+    class Meta(FlashcardSerializer.Meta):
+        fields = FlashcardSerializer.Meta.fields + ['deck']
+
+
+class DeckSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     flashcards = FlashcardSerializer(many=True, read_only=True)
-    card_count = serializers.ReadOnlyField()
+    card_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Deck
         fields = ['id', 'name', 'description', 'created_at', 'updated_at', 
                   'is_public', 'card_count', 'flashcards']
         read_only_fields = ['id', 'created_at', 'updated_at', 'card_count']
+    
+    def get_card_count(self, obj):
+        return annotated(obj, 'num_cards', lambda deck: deck.card_count)
 
 
-class DeckListSerializer(serializers.ModelSerializer):
+class DeckListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Lighter serializer for listing decks without all flashcards"""
-    card_count = serializers.ReadOnlyField()
+    card_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Deck
         fields = ['id', 'name', 'description', 'created_at', 'card_count', 'is_public']
+    
+    def get_card_count(self, obj):
+        return annotated(obj, 'num_cards', lambda deck: deck.card_count)
 
 
 class StudySessionSerializer(serializers.ModelSerializer):
@@ -38,26 +106,73 @@ class StudySessionSerializer(serializers.ModelSerializer):
         model = StudySession
         fields = ['id', 'deck', 'deck_name', 'started_at', 'completed_at', 
                   'correct_count', 'total_attempts', 'accuracy']
-        read_only_fields = ['id', 'started_at', 'accuracy']
+        # The counters only move through record_answer(s), which keeps
+        # UserStats in step with them
+        read_only_fields = ['id', 'started_at', 'correct_count', 'total_attempts', 'accuracy']
+
+
+class AnswerSerializer(serializers.Serializer):
+    """A single answer recorded against a study session"""
+    correct = serializers.BooleanField(default=False)
+    card = serializers.IntegerField(required=False, min_value=1)
+    response_ms = serializers.IntegerField(required=False, min_value=0, max_value=3600000)
+    answered_at = serializers.DateTimeField(required=False)
+    
+    def validate_answered_at(self, value):
+        # Offline clients send their own clock; never accept the future
+        return min(value, timezone.now())
+
+
+class AnswerBatchSerializer(serializers.Serializer):
+    """Answers flushed together by a client"""
+    answers = AnswerSerializer(many=True, allow_empty=False, max_length=1000)
+
+
+class CardOperationSerializer(serializers.Serializer):
+    """One operation of a bulk card edit (see bulk.py)"""
+    op = serializers.ChoiceField(choices=['create', 'update', 'delete', 'move'])
+    id = serializers.IntegerField(required=False, min_value=1)
+    deck = serializers.IntegerField(required=False, min_value=1)
+    question = serializers.CharField(required=False)
+    answer = serializers.CharField(required=False)
+    spaced_repetition = serializers.BooleanField(required=False)
+    order = serializers.IntegerField(required=False)
+    
+    def validate(self, attrs):
+        op = attrs['op']
+        if op == 'create':
+            missing = [name for name in ('question', 'answer') if name not in attrs]
+            if missing:
+                raise serializers.ValidationError(
+                    {name: 'This field is required.' for name in missing}
+                )
+            if 'id' in attrs:
+                raise serializers.ValidationError({'id': 'New cards get their id when created.'})
+        elif 'id' not in attrs:
+            raise serializers.ValidationError({'id': 'This field is required.'})
+        if op == 'move' and 'deck' not in attrs:
+            raise serializers.ValidationError({'deck': 'This field is required.'})
+        if op != 'move' and 'deck' in attrs:
+            raise serializers.ValidationError({'deck': 'Only move takes a deck.'})
+        if op == 'update' and not attrs.keys() & {'question', 'answer', 'spaced_repetition', 'order'}:
+            raise serializers.ValidationError('Nothing to update.')
+        return attrs
+
+
+class CardBatchSerializer(serializers.Serializer):
+    """Operations on the cards of one deck, applied together"""
+    deck = serializers.IntegerField(min_value=1)
+    operations = CardOperationSerializer(many=True, allow_empty=False, max_length=1000)
 
 
 class BulkUploadSerializer(serializers.Serializer):
-    """Serializer for bulk uploading flashcards from JSON"""
+    """
+    Serializer for the deck fields of a bulk upload. The flashcards
+    themselves are streamed and validated row by row in imports.py.
+    """
     deck_name = serializers.CharField(max_length=200)
     description = serializers.CharField(required=False, allow_blank=True)
-    flashcards = serializers.ListField(
-        child=serializers.DictField()
-    )
     is_public = serializers.BooleanField(default=False)
-    
-    def validate_flashcards(self, value):
-        """Validate flashcards structure"""
-        for card in value:
-            if 'question' not in card or 'answer' not in card:
-                raise serializers.ValidationError(
-                    "Each flashcard must have 'question' and 'answer' fields"
-                )
-        return value
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -89,28 +204,19 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
-    """Detailed user profile with stats"""
-    decks_created = serializers.SerializerMethodField()
-    total_cards = serializers.SerializerMethodField()
-    study_sessions = serializers.SerializerMethodField()
-    total_correct = serializers.SerializerMethodField()
+    """User profile with the stats rolled up in UserStats"""
+    id = serializers.IntegerField(source='user.id', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    email = serializers.EmailField(source='user.email', read_only=True)
+    total_cards = serializers.IntegerField(source='cards_owned', read_only=True)
+    current_streak = serializers.ReadOnlyField()
     
     class Meta:
-        model = User
+        model = UserStats
         fields = ['id', 'username', 'email', 'decks_created', 'total_cards', 
-                  'study_sessions', 'total_correct']
-    
-    def get_decks_created(self, obj):
-        return obj.deck_set.count()
-    
-    def get_total_cards(self, obj):
-        return Flashcard.objects.filter(deck__owner=obj).count()
-    
-    def get_study_sessions(self, obj):
-        return obj.studysession_set.count()
-    
-    def get_total_correct(self, obj):
-        return sum(s.correct_count for s in obj.studysession_set.all())
+                  'study_sessions', 'total_correct', 'total_attempts',
+                  'current_streak', 'longest_streak', 'last_study_date']
+        read_only_fields = fields
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -125,7 +231,7 @@ class CommentSerializer(serializers.ModelSerializer):
 
 class CommunityDeckSerializer(serializers.ModelSerializer):
     """Serializer for community deck listing with social features"""
-    card_count = serializers.ReadOnlyField()
+    card_count = serializers.SerializerMethodField()
     owner_name = serializers.CharField(source='owner.username', read_only=True)
     likes_count = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
@@ -136,14 +242,71 @@ class CommunityDeckSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'card_count', 'owner_name', 
                   'likes_count', 'comments_count', 'is_liked', 'created_at']
     
+    def get_card_count(self, obj):
+        return annotated(obj, 'num_cards', lambda deck: deck.card_count)
+    
     def get_likes_count(self, obj):
-        return obj.likes.count()
+        return annotated(obj, 'num_likes', lambda deck: deck.likes.count())
     
     def get_comments_count(self, obj):
-        return obj.comments.count()
+        return annotated(obj, 'num_comments', lambda deck: deck.comments.count())
     
     def get_is_liked(self, obj):
+        return annotated(obj, 'is_liked', self._is_liked)
+    
+    def _is_liked(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
         return False
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """Progress report for a background deck import"""
+    throughput = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'status', 'deck', 'rows_processed', 'throughput', 'error_count',
+                  'errors', 'duplicate_mode', 'duplicate_count', 'duplicates', 'message',
+                  'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class ReviewStateSerializer(serializers.ModelSerializer):
+    """A card with the user's review schedule; new cards have no due_at"""
+    card = FlashcardSerializer(read_only=True)
+    is_new = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ReviewState
+        fields = ['card', 'deck', 'is_new', 'due_at', 'interval', 'ease',
+                  'repetitions', 'lapses', 'last_reviewed_at']
+        read_only_fields = fields
+    
+    def get_is_new(self, obj):
+        return obj.pk is None
+
+
+class CardStatsSerializer(serializers.ModelSerializer):
+    """How hard a card has been across everyone who answered it"""
+    card = FlashcardSerializer(read_only=True)
+    accuracy = serializers.ReadOnlyField()
+    avg_response_ms = serializers.ReadOnlyField()
+    difficulty = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = CardStats
+        fields = ['card', 'attempts', 'correct', 'accuracy', 'avg_response_ms',
+                  'difficulty', 'last_answered_at']
+        read_only_fields = fields
+
+
+class PlaceSerializer(serializers.Serializer):
+    """Where to move a card in its deck: after another card, or first for null"""
+    after = serializers.IntegerField(min_value=1, allow_null=True)
+
+
+class GradeSerializer(serializers.Serializer):
+    """SM-2 grade: 0-2 forgotten, 3 hard, 4 good, 5 easy"""
+    grade = serializers.IntegerField(min_value=0, max_value=5)
@@ -0,0 +1,111 @@
+"""
+Building ``UserStats`` rows from the source tables.
+
+The counters are normally maintained incrementally by
+``UserStatsQuerySet.record``; a row is computed from scratch the first time
+a user's profile is read and whenever ``reconcile_user_stats`` runs.
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+from .models import AnswerEvent, Deck, Flashcard, StudySession, UserStats, subquery_count
+
+STAT_FIELDS = [
+    'decks_created', 'cards_owned', 'study_sessions', 'total_correct', 'total_attempts',
+    'streak_days', 'longest_streak', 'last_study_date',
+]
+
+
+def session_sum(field):
+    return Coalesce(Subquery(
+        StudySession.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(
+            total=Sum(field)
+        ).values('total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def study_days(user_id):
+    """
+    Local dates the user gave an answer or completed a session on, the
+    study days ``UserStatsQuerySet.record`` counts as they happen
+    """
+    sessions = StudySession.objects.filter(user_id=user_id).order_by()
+    answered = AnswerEvent.objects.filter(session__user_id=user_id).order_by().annotate(
+        day=TruncDate('answered_at')
+    )
+    completed = sessions.filter(completed_at__isnull=False).annotate(day=TruncDate('completed_at'))
+    # Sessions answered before the answer log existed have no events
+    unlogged = sessions.filter(total_attempts__gt=0).exclude(
+        Exists(AnswerEvent.objects.filter(session=OuterRef('pk')))
+    ).annotate(day=TruncDate('started_at'))
+    days = set()
+    for queryset in (answered, completed, unlogged):
+        days.update(queryset.values_list('day', flat=True).distinct())
+    return sorted(days)
+
+
+def streaks(days):
+    """Return ``(streak ending at the last day, longest streak, last day)``"""
+    current = longest = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous == day - timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest, previous
+
+
+def compute(users):
+    """Unsaved UserStats for a queryset of users"""
+    rows = users.annotate(
+        num_decks=subquery_count(Deck.objects.filter(owner=OuterRef('pk'))),
+        num_cards=subquery_count(Flashcard.objects.filter(deck__owner=OuterRef('pk'))),
+        num_sessions=subquery_count(StudySession.objects.filter(user=OuterRef('pk'))),
+        correct=session_sum('correct_count'),
+        attempts=session_sum('total_attempts'),
+    ).values_list('pk', 'num_decks', 'num_cards', 'num_sessions', 'correct', 'attempts')
+    result = []
+    for pk, decks, cards, sessions, correct, attempts in rows:
+        streak, longest, last_day = streaks(study_days(pk))
+        result.append(UserStats(
+            user_id=pk,
+            decks_created=decks,
+            cards_owned=cards,
+            study_sessions=sessions,
+            total_correct=correct,
+            total_attempts=attempts,
+            streak_days=streak,
+            longest_streak=longest,
+            last_study_date=last_day,
+        ))
+    return result
+
+
+def save(rows):
+    UserStats.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['user'], update_fields=STAT_FIELDS
+    )
+
+
+def for_user(user):
+    """
+    The user's stats row, built on first use. When a concurrent request
+    creates it first, that row wins: it may already hold increments this
+    computation missed.
+    """
+    stats = UserStats.objects.filter(pk=user.pk).first()
+    if stats is None:
+        computed, = compute(User.objects.filter(pk=user.pk))
+        defaults = {field: getattr(computed, field) for field in STAT_FIELDS}
+        try:
+            with transaction.atomic():
+                stats, _ = UserStats.objects.get_or_create(user_id=user.pk, defaults=defaults)
+        except IntegrityError:
+            stats = UserStats.objects.get(pk=user.pk)
+    stats.user = user
+    return stats
@@ -1,3 +1,1421 @@
-from django.test import TestCase
+import csv
+import json
+import math
+import os
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.serializers import Serializer
+from rest_framework_simplejwt.tokens import AccessToken
+from . import (
+    analytics, answerlog, duplicates, imports, jobs, metrics, ordering, scheduling, search,
+    stats, sync, trending,
+)
+from .models import (
+    Deck, Flashcard, StudySession, DeckComment, DeckLike, ImportJob, ReviewState, CardStats,
+    AnswerEvent, CardContent, CardFingerprint, RollupWatermark, StudyBucket, Tombstone,
+    UserStats,
+)
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Requests are replayed against datasets of growing size and must run
+    exactly ``budget`` queries at every size, so an N+1 shows up as a
+    failure rather than as a slow page in production.
+    """
+    SIZES = (1, 4, 12)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('owner', 'owner@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def seed(self, size):
+        """
+        ``size`` learners and ``size`` public decks of ``size`` cards, each
+        deck liked, commented on and studied by every learner
+        """
+        learners = User.objects.bulk_create([
+            User(username=f'learner{size}-{i}') for i in range(size)
+        ])
+        now = timezone.now()
+        decks = Deck.objects.bulk_create([
+            Deck(name=f'Deck {i}', owner=self.user, is_public=True,
+                 cards_total=size, likes_total=size, comments_total=size)
+            for i in range(size)
+        ])
+        cards = Flashcard.objects.bulk_create([
+            Flashcard(deck=deck, question=f'Question {deck.pk}.{i}', answer=f'Answer {i}', order=i)
+            for deck in decks for i in range(size)
+        ])
+        DeckLike.objects.bulk_create([
+            DeckLike(deck=deck, user=learner) for deck in decks for learner in learners
+        ])
+        DeckComment.objects.bulk_create([
+            DeckComment(deck=deck, user=learner, text='Useful') for deck in decks for learner in learners
+        ])
+        StudySession.objects.bulk_create([
+            StudySession(deck=deck, user=user, correct_count=1, total_attempts=2,
+                         completed_at=now - timedelta(hours=1))
+            for deck in decks for user in learners + [self.user]
+        ])
+        ReviewState.objects.bulk_create([
+            ReviewState(user=self.user, card=card, deck_id=card.deck_id, due_at=now)
+            for card in cards
+        ])
+        CardStats.objects.bulk_create([
+            CardStats(card=card, attempts=3, correct=1) for card in cards
+        ])
+        ImportJob.objects.bulk_create([
+            ImportJob(owner=self.user, status=ImportJob.SUCCEEDED) for _ in range(size)
+        ])
+        # Measure the steady state: rollups and profile stats already built
+        analytics.refresh()
+        stats.save(stats.compute(User.objects.all()))
+        self.deck = decks[0]
+        self.session = StudySession.objects.filter(deck=self.deck, user=self.user).first()
+
+    def request(self, method, url, **kwargs):
+        response = getattr(self.client, method)(url, **kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def assertQueryBudget(self, budget, method, url, data=None, **kwargs):
+        """
+        ``url`` (and ``data``, if given) are called with the test case
+        once each dataset is seeded
+        """
+        for size in self.SIZES:
+            with self.subTest(size=size), transaction.atomic():
+                self.seed(size)
+                if data is not None:
+                    kwargs['data'] = data(self)
+                path = url(self)
+                with self.assertNumQueries(budget):
+                    response = self.request(method, path, **kwargs)
+                self.assertLess(response.status_code, 400)
+                transaction.set_rollback(True)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class APIQueryBudgetTests(QueryBudgetTestCase):
+    # Session and user lookups made by authentication on every request
+    AUTH = 2
+
+    def test_deck_list(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/decks/')
+
+    def test_deck_detail(self):
+        self.assertQueryBudget(self.AUTH + 3, 'get', lambda t: f'/api/decks/{t.deck.pk}/')
+
+    def test_deck_detail_not_modified(self):
+        def url(test):
+            response = test.client.get(f'/api/decks/{test.deck.pk}/')
+            test.client.defaults['HTTP_IF_NONE_MATCH'] = response['ETag']
+            return f'/api/decks/{test.deck.pk}/'
+        try:
+            self.assertQueryBudget(self.AUTH + 1, 'get', url)
+        finally:
+            self.client.defaults.pop('HTTP_IF_NONE_MATCH', None)
+
+    def test_public_decks(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/decks/public/')
+
+    def test_community(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/decks/community/')
+
+    def test_comments(self):
+        self.assertQueryBudget(self.AUTH + 2, 'get', lambda t: f'/api/decks/{t.deck.pk}/comments/')
+
+    def test_export(self):
+        self.assertQueryBudget(self.AUTH + 3, 'get', lambda t: f'/api/decks/{t.deck.pk}/export/')
+
+    def test_export_all(self):
+        self.assertQueryBudget(self.AUTH + 2, 'get', lambda t: '/api/decks/export_all/')
+
+    def test_due(self):
+        self.assertQueryBudget(self.AUTH + 3, 'get', lambda t: f'/api/decks/{t.deck.pk}/due/')
+
+    def test_difficulty(self):
+        self.assertQueryBudget(self.AUTH + 2, 'get', lambda t: f'/api/decks/{t.deck.pk}/difficulty/')
+
+    def test_flashcards_of_deck(self):
+        self.assertQueryBudget(self.AUTH + 2, 'get', lambda t: f'/api/flashcards/?deck={t.deck.pk}')
+
+    def test_sessions(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/sessions/')
+
+    def test_reviews(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/reviews/')
+
+    def test_jobs(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/jobs/')
+
+    def test_profile(self):
+        self.assertQueryBudget(self.AUTH + 1, 'get', lambda t: '/api/profile/')
+
+    def test_search(self):
+        self.assertQueryBudget(self.AUTH + 2, 'get', lambda t: '/api/search/?q=question')
+
+    def test_analytics(self):
+        self.assertQueryBudget(self.AUTH + 3, 'get', lambda t: '/api/analytics/')
+
+    def test_sync(self):
+        self.assertQueryBudget(self.AUTH + 2, 'get', lambda t: '/api/sync/')
+        since = sync.make_token(timezone.now() - timedelta(hours=1))
+        self.assertQueryBudget(self.AUTH + 4, 'get', lambda t: f'/api/sync/?since={since}')
+
+    def test_bulk_cards(self):
+        def operations(test):
+            return {'deck': test.deck.pk, 'operations': [
+                {'op': 'update', 'id': card.pk, 'question': f'Edited {card.pk}', 'order': -card.order}
+                for card in test.deck.flashcards.all()
+            ] + [{'op': 'create', 'question': 'New', 'answer': 'Card'}]}
+        self.assertQueryBudget(
+            self.AUTH + 13, 'post', lambda t: '/api/flashcards/bulk/',
+            data=operations, content_type='application/json',
+        )
+
+    def test_record_answers(self):
+        def answers(test):
+            return {'answers': [
+                {'correct': True, 'card': card.pk, 'response_ms': 900}
+                for card in test.deck.flashcards.all()
+            ]}
+        self.assertQueryBudget(
+            self.AUTH + 6, 'post', lambda t: f'/api/sessions/{t.session.pk}/record_answers/',
+            data=answers, content_type='application/json',
+        )
+
+
+class AdminQueryBudgetTests(QueryBudgetTestCase):
+    def assertChangelistBudget(self, budget, model):
+        url = reverse(f'admin:flashcards_{model._meta.model_name}_changelist')
+        self.assertQueryBudget(budget, 'get', lambda t: url)
+
+    def test_decks(self):
+        self.assertChangelistBudget(5, Deck)
+
+    def test_flashcards(self):
+        self.assertChangelistBudget(5, Flashcard)
+
+    def test_flashcards_of_deck(self):
+        url = reverse('admin:flashcards_flashcard_changelist')
+        self.assertQueryBudget(
+            5, 'get', lambda t: f'{url}?deck__id__exact={t.deck.pk}&q=question'
+        )
+
+    def test_sessions(self):
+        self.assertChangelistBudget(5, StudySession)
+
+    def test_comments(self):
+        self.assertChangelistBudget(5, DeckComment)
+
+    def test_likes(self):
+        self.assertChangelistBudget(5, DeckLike)
+
+    def test_jobs(self):
+        self.assertChangelistBudget(5, ImportJob)
+
+
+class AdminScaleTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.learner = User.objects.create_user('learner')
+        self.client.force_login(self.admin)
+        self.decks = [Deck.objects.create(name=name) for name in ('Biology', 'Chemistry')]
+        for deck in self.decks:
+            DeckComment.objects.create(deck=deck, user=self.admin, text='Nice')
+        DeckComment.objects.create(deck=self.decks[0], user=self.learner, text='Thanks')
+
+    def changelist(self, model, query=''):
+        url = reverse(f'admin:flashcards_{model._meta.model_name}_changelist')
+        return self.client.get(url + query)
+
+    @override_settings(FLASHCARDS_ADMIN_EXACT_COUNT_LIMIT=0)
+    def test_large_tables_are_counted_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Deck.objects.create(name='Added after ANALYZE')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.changelist(Deck)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+        # Filtered changelists are counted exactly
+        response = self.changelist(Deck, '?q=added')
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_deck_filter_uses_autocomplete(self):
+        response = self.changelist(DeckComment, f'?deck__id__exact={self.decks[0].pk}')
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertContains(
+            response, f'<option value="{self.decks[0].pk}" selected>Biology</option>'
+        )
+        self.assertNotContains(response, 'Chemistry</a>')
+
+    def test_deleting_decks_updates_stats_and_sync(self):
+        owned = [Deck.objects.create(name=f'Owned {i}', owner=self.learner) for i in range(3)]
+        UserStats.objects.create(user=self.learner, decks_created=3)
+        url = reverse('admin:flashcards_deck_delete', args=[owned[0].pk])
+        self.client.post(url, {'post': 'yes'})
+        self.client.post(reverse('admin:flashcards_deck_changelist'), {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': [owned[1].pk, owned[2].pk],
+        })
+        self.assertFalse(Deck.objects.filter(owner=self.learner).exists())
+        self.assertEqual(UserStats.objects.get(user=self.learner).decks_created, 0)
+        self.assertEqual(
+            sorted(Tombstone.objects.filter(kind=Tombstone.DECK).values_list('object_id', flat=True)),
+            [deck.pk for deck in owned],
+        )
+
+    def test_search_uses_indexes(self):
+        self.assertEqual(self.changelist(DeckComment, '?q=chem').context['cl'].result_count, 1)
+        self.assertEqual(self.changelist(DeckComment, '?q=learner').context['cl'].result_count, 1)
+        # Usernames match whole, comment text is not searched
+        self.assertEqual(self.changelist(DeckComment, '?q=learn').context['cl'].result_count, 0)
+        self.assertEqual(self.changelist(DeckComment, '?q=thanks').context['cl'].result_count, 0)
+
+
+class AnalyticsTests(TestCase):
+    def test_completing_twice_counts_once(self):
+        user = User.objects.create_user('learner', password='password')
+        deck = Deck.objects.create(name='Studied', owner=user)
+        session = StudySession.objects.create(deck=deck, user=user, correct_count=3,
+                                              total_attempts=4)
+        self.client.force_login(user)
+        url = f'/api/sessions/{session.pk}/complete/'
+        self.client.post(url)
+        # Completed a while ago and already rolled up
+        completed_at = timezone.now() - timedelta(minutes=10)
+        StudySession.objects.filter(pk=session.pk).update(completed_at=completed_at)
+        analytics.refresh()
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        session.refresh_from_db()
+        self.assertEqual(session.completed_at, completed_at)
+        analytics.refresh(now=timezone.now() + timedelta(minutes=1))
+
+        bucket = StudyBucket.objects.get(granularity=StudyBucket.DAY, deck=deck)
+        self.assertEqual((bucket.sessions, bucket.attempts, bucket.correct), (1, 4, 3))
+
+    def test_reads_refresh_only_a_stale_rollup(self):
+        user = User.objects.create_user('learner', password='password')
+        deck = Deck.objects.create(name='Studied', owner=user)
+        self.client.force_login(user)
+        analytics.refresh()
+        StudySession.objects.create(deck=deck, user=user, correct_count=1, total_attempts=2,
+                                    completed_at=timezone.now() - timedelta(minutes=5))
+        with CaptureQueriesContext(connection) as queries:
+            totals = self.client.get('/api/analytics/').json()['totals']
+        self.assertEqual(totals['sessions'], 0)
+        self.assertFalse([q for q in queries if q['sql'].startswith(('UPDATE', 'INSERT'))])
+
+        RollupWatermark.objects.update(position=timezone.now() - timedelta(minutes=10))
+        totals = self.client.get('/api/analytics/').json()['totals']
+        self.assertEqual(totals['sessions'], 1)
+
+    def test_merge_reads_only_matching_buckets(self):
+        users = [User.objects.create_user(f'learner{i}') for i in range(2)]
+        deck = Deck.objects.create(name='Shared')
+        for user in users:
+            StudyBucket.objects.create(granularity=StudyBucket.DAY, period=1, user=user,
+                                       deck=deck, sessions=1)
+        keys = np.array([[1, users[0].pk, deck.pk]])
+        found = list(analytics.existing_buckets(StudyBucket.DAY, keys))
+        self.assertEqual([bucket.user_id for bucket in found], [users[0].pk])
+
+
+class UserStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('learner', password='password')
+        self.deck = Deck.objects.create(name='Studied', owner=self.user)
+        stats.for_user(self.user)
+        self.client.force_login(self.user)
+
+    def assertReconciled(self):
+        kept = UserStats.objects.get(user=self.user)
+        rebuilt, = stats.compute(User.objects.filter(pk=self.user.pk))
+        for field in stats.STAT_FIELDS:
+            self.assertEqual(getattr(kept, field), getattr(rebuilt, field), field)
+
+    @override_settings(FLASHCARDS_ANSWER_BUFFER_SIZE=1)
+    def test_session_across_midnight(self):
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        session = StudySession.objects.get(
+            pk=self.client.post('/api/sessions/', {'deck': self.deck.pk}).json()['id']
+        )
+        StudySession.objects.filter(pk=session.pk).update(
+            started_at=yesterday.replace(hour=23, minute=59)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/sessions/{session.pk}/record_answers/', {'answers': [
+                {'correct': True, 'answered_at': yesterday.replace(hour=23, minute=59).isoformat()},
+                {'correct': True, 'answered_at': today.isoformat()},
+            ]}, content_type='application/json')
+            self.client.post(f'/api/sessions/{session.pk}/complete/')
+        kept = UserStats.objects.get(user=self.user)
+        self.assertEqual((kept.streak_days, kept.last_study_date), (2, timezone.localdate()))
+        self.assertReconciled()
+
+    def test_first_read_keeps_a_concurrently_created_row(self):
+        other = User.objects.create_user('racer')
+        compute = stats.compute
+
+        def racing_compute(users):
+            # Another request builds the row and counts a deck meanwhile
+            UserStats.objects.create(user=other, decks_created=1)
+            return compute(users)
+
+        with mock.patch.object(stats, 'compute', racing_compute):
+            row = stats.for_user(other)
+        self.assertEqual(row.decks_created, 1)
+        self.assertEqual(UserStats.objects.get(user=other).decks_created, 1)
+
+    def test_session_counters_are_read_only(self):
+        session = self.client.post('/api/sessions/', {
+            'deck': self.deck.pk, 'correct_count': 5, 'total_attempts': 9,
+        }).json()
+        self.assertEqual((session['correct_count'], session['total_attempts']), (0, 0))
+        response = self.client.patch(f'/api/sessions/{session["id"]}/', {
+            'correct_count': 7, 'total_attempts': 7,
+        }, content_type='application/json')
+        self.assertEqual(response.json()['total_attempts'], 0)
+        self.assertReconciled()
+
+    @override_settings(FLASHCARDS_ANSWER_BUFFER_SIZE=1)
+    def test_late_offline_answers_keep_the_streak(self):
+        session = StudySession.objects.create(deck=self.deck, user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/sessions/{session.pk}/record_answer/', {'correct': True},
+                             content_type='application/json')
+            earlier = timezone.now() - timedelta(days=1)
+            self.client.post(f'/api/sessions/{session.pk}/record_answers/', {'answers': [
+                {'correct': False, 'answered_at': earlier.isoformat()},
+            ]}, content_type='application/json')
+        self.assertEqual(UserStats.objects.get(user=self.user).last_study_date,
+                         timezone.localdate())
+
+
+class AnswerLogTests(TestCase):
+    @override_settings(FLASHCARDS_ANSWER_BUFFER_SIZE=2, FLASHCARDS_ANSWER_FLUSH_SECONDS=60)
+    def test_failed_batch_is_kept_for_retry(self):
+        session = StudySession.objects.create(deck=Deck.objects.create(name='Answered'))
+        buffer = answerlog.AnswerBuffer()
+        events = [
+            AnswerEvent(session=session, correct=True, answered_at=timezone.now()) for _ in range(2)
+        ]
+        with mock.patch.object(answerlog, 'update_card_stats',
+                               side_effect=OperationalError('database is locked')):
+            with self.assertLogs('flashcards.answerlog', 'ERROR'):
+                buffer.add(events)
+        buffer.timer.cancel()
+        self.assertEqual(AnswerEvent.objects.count(), 0)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(AnswerEvent.objects.count(), 2)
+
+    def test_rebuild_card_stats_matches_incremental_totals(self):
+        deck = Deck.objects.create(name='Answered')
+        cards = Flashcard.objects.bulk_create([
+            Flashcard(deck=deck, question=f'q{i}', answer='a') for i in range(5)
+        ])
+        session = StudySession.objects.create(deck=deck)
+        now = timezone.now()
+        answerlog.write([
+            AnswerEvent(session=session, card=cards[i % 4], correct=i % 3 == 0,
+                        response_ms=None if i % 5 == 0 else 100 * i,
+                        answered_at=now - timedelta(minutes=i))
+            for i in range(17)
+        ] + [AnswerEvent(session=session, correct=True, answered_at=now)])
+        fields = ['card', 'attempts', 'correct', 'response_ms_total', 'timed_attempts',
+                  'last_answered_at']
+        incremental = list(CardStats.objects.order_by('card').values_list(*fields))
+        CardStats.objects.create(card=cards[4], attempts=3)  # no events behind it
+
+        with mock.patch.object(answerlog, 'REBUILD_BATCH', 3):
+            self.assertEqual(answerlog.rebuild_card_stats(), 4)
+        self.assertEqual(list(CardStats.objects.order_by('card').values_list(*fields)), incremental)
+
+    def test_unknown_session_is_not_found(self):
+        self.client.force_login(User.objects.create_user('learner', password='password'))
+        for pk in ('abc', '999'):
+            response = self.client.post(f'/api/sessions/{pk}/record_answer/', {'correct': True},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 404)
+
+
+@override_settings(FLASHCARDS_PROFILE_SAMPLE_RATE=1)
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.deck = Deck.objects.create(name='Profiled', is_public=True)
+        self.user = User.objects.create_user('profiled', password='password')
+
+    def test_server_timing(self):
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        response = self.client.get(f'/api/decks/{self.deck.pk}/')
+        timing = response['Server-Timing']
+        for metric in ('db;', 'view;', 'serialize;', 'render;', 'total;'):
+            self.assertIn(metric, timing)
+        # Session and user lookups, then the deck's three
+        self.assertIn('desc="5 queries"', timing)
+        # The serializers are only patched while a sampled request runs
+        self.assertFalse(getattr(Serializer.data.fget, 'timed', False))
+
+    def test_server_timing_is_for_staff(self):
+        self.client.force_login(self.user)
+        response = self.client.get(f'/api/decks/{self.deck.pk}/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(FLASHCARDS_PROFILE_SAMPLE_RATE=0)
+    def test_unsampled_requests_have_no_breakdown(self):
+        response = self.client.get(f'/api/decks/{self.deck.pk}/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(FLASHCARDS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('flashcards.slow_requests') as logs:
+            self.client.get(f'/api/decks/{self.deck.pk}/')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], f'/api/decks/{self.deck.pk}/')
+        self.assertEqual(entry['queries'], 3)
+        self.assertEqual(len(entry['slowest_sql']), 3)
+
+    @override_settings(FLASHCARDS_SLOW_REQUEST_MS=0)
+    def test_slow_log_names_the_token_user(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertLogs('flashcards.slow_requests') as logs:
+            self.client.get('/api/decks/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(json.loads(logs.records[0].getMessage())['user'], self.user.pk)
+
+
+@override_settings(FLASHCARDS_METRICS_DIR='')
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.deck = Deck.objects.create(name='Measured', is_public=True)
+        self.staff = User.objects.create_user('ops', password='password', is_staff=True)
+
+    def test_requests_are_labeled_by_viewset_action(self):
+        self.client.get(f'/api/decks/{self.deck.pk}/')
+        self.client.post('/api/decks/upload/', {}, content_type='application/json')
+        self.client.force_login(self.staff)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'flashcards_http_requests_total{action="retrieve",method="GET",status="200",'
+            'view="DeckViewSet"} 1', body
+        )
+        self.assertIn('action="upload",method="POST",status="400",view="DeckViewSet"', body)
+        self.assertIn(
+            'flashcards_db_queries_per_request_sum{action="retrieve",view="DeckViewSet"} 3', body
+        )
+        self.assertIn(
+            'flashcards_http_request_duration_seconds_bucket'
+            '{action="retrieve",view="DeckViewSet",le="+Inf"} 1', body
+        )
+
+    def test_processes_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(FLASHCARDS_METRICS_DIR=directory):
+            labels = (('view', 'DeckViewSet'), ('action', 'list'))
+            metrics.registry.observe('flashcards_db_queries_per_request', labels, 2)
+            metrics.registry.flush()
+            with open(f'{directory}/1.json', 'w') as f:
+                json.dump(metrics.registry.snapshot(), f)
+            body = metrics.render()
+        self.assertIn(
+            'flashcards_db_queries_per_request_count{action="list",view="DeckViewSet"} 2', body
+        )
+        self.assertIn(
+            'flashcards_db_queries_per_request_bucket{action="list",view="DeckViewSet",le="1"} 0', body
+        )
+
+    def test_exited_processes_are_folded(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(FLASHCARDS_METRICS_DIR=directory):
+            labels = (('view', 'DeckViewSet'), ('action', 'list'))
+            metrics.registry.inc('flashcards_http_requests_total', labels)
+            # A worker that has exited (no such PID) and the same PID reused
+            with open(f'{directory}/999999999-1.json', 'w') as f:
+                json.dump(metrics.registry.snapshot(), f)
+            with open(f'{directory}/999999999-2.json', 'w') as f:
+                json.dump(metrics.registry.snapshot(), f)
+            line = 'flashcards_http_requests_total{action="list",view="DeckViewSet"} 3'
+            self.assertIn(line, metrics.render())
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                sorted(['.lock', 'exited.json', metrics.registry.filename])
+            )
+            self.assertIn(line, metrics.render())
+
+    @override_settings(FLASHCARDS_METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_staff_only(self):
+        user = User.objects.create_user('student', password='password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        with override_settings(FLASHCARDS_METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class FastReadTests(TestCase):
+    """The fast read path must return exactly the serializers' bytes"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='password')
+        self.deck = Deck.objects.create(name='Fast   "deck"', is_public=True, owner=owner)
+        Deck.objects.create(name='Orphan', is_public=True, cards_total=1)
+        for order, question in enumerate(['plain', 'é 😀 </script> \\ \x01', 'tab\there']):
+            Flashcard.objects.create(deck=self.deck, question=question, answer='a', order=order)
+        Deck.objects.filter(pk=self.deck.pk).update(cards_total=3)
+
+    def assertSameBody(self, url):
+        with override_settings(FLASHCARDS_FAST_READS=False):
+            expected = self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_matches_serializers(self):
+        for url in (
+            f'/api/decks/{self.deck.pk}/', '/api/decks/0/', '/api/decks/community/',
+            f'/api/flashcards/?deck={self.deck.pk}',
+            f'/api/decks/{self.deck.pk}/?include_cards=false&exclude=description',
+            f'/api/decks/{self.deck.pk}/?fields=name,flashcards',
+            f'/api/flashcards/?deck={self.deck.pk}&fields=question',
+        ):
+            with self.subTest(url=url):
+                self.assertSameBody(url)
+        self.client.force_login(User.objects.get(username='owner'))
+        self.assertSameBody('/api/decks/community/')
+
+    def test_paginated_cursors(self):
+        for url in (
+            f'/api/flashcards/?deck={self.deck.pk}&page_size=1',
+            f'/api/flashcards/?deck={self.deck.pk}&page_size=1&fields=answer',
+        ):
+            while url:
+                url = self.assertSameBody(url).json()['next']
+
+
+class KeysetPaginationTests(TestCase):
+    def test_uuid_keys(self):
+        user = User.objects.create_user('uploader', password='password')
+        created = timezone.now()
+        queued = ImportJob.objects.bulk_create([ImportJob(owner=user) for _ in range(5)])
+        # Equal timestamps leave the order to the UUID tiebreaker
+        ImportJob.objects.update(created_at=created)
+        self.client.force_login(user)
+        url, seen = '/api/jobs/?page_size=2', []
+        while url:
+            page = self.client.get(url)
+            self.assertEqual(page.status_code, 200)
+            seen += [job['id'] for job in page.json()['results']]
+            url, back = page.json()['next'], page.json()['previous']
+        self.assertEqual(sorted(seen), sorted(str(job.pk) for job in queued))
+        self.assertEqual(len(self.client.get(back).json()['results']), 2)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.deck = Deck.objects.create(name='Sparse', description='Long text', cards_total=1)
+        self.card = Flashcard.objects.create(deck=self.deck, question='q', answer='a')
+        self.url = f'/api/decks/{self.deck.pk}/'
+
+    def test_deck_without_cards(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'{self.url}?include_cards=false')
+        self.assertNotIn('flashcards', response.json())
+        self.assertEqual(response.json()['card_count'], 1)
+        self.assertNotEqual(response['ETag'], self.client.get(self.url)['ETag'])
+
+    def test_unrequested_columns_are_not_read(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(FLASHCARDS_FAST_READS=fast), \
+                    CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    f'/api/flashcards/?deck={self.deck.pk}&fields=id,question'
+                )
+            self.assertEqual(response.json()['results'], [{'id': self.card.pk, 'question': 'q'}])
+            self.assertNotIn('"answer"', queries.captured_queries[-1]['sql'])
+
+            with self.subTest(fast=fast), override_settings(FLASHCARDS_FAST_READS=fast), \
+                    CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'{self.url}?fields=name')
+            self.assertEqual(response.json(), {'name': 'Sparse'})
+            self.assertNotIn('"description"', queries.captured_queries[-1]['sql'])
+
+    def test_writes_ignore_fields(self):
+        response = self.client.patch(
+            f'{self.url}?fields=name', {'description': 'Short'}, content_type='application/json'
+        )
+        self.assertEqual(response.json()['description'], 'Short')
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('syncer', password='password')
+        self.client.force_login(self.user)
+        self.deck = Deck.objects.create(name='Offline', owner=self.user, cards_total=3)
+        self.other = Deck.objects.create(name='Other', owner=self.user)
+        self.cards = [
+            Flashcard.objects.create(deck=self.deck, question=f'q{i}', answer='a', order=i)
+            for i in range(3)
+        ]
+
+    def sync(self, **params):
+        response = self.client.get('/api/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def past(self, **kwargs):
+        """Move every existing row out of the next sync's overlap window"""
+        moment = timezone.now() - timedelta(hours=1)
+        Deck.objects.update(updated_at=moment)
+        Flashcard.objects.update(updated_at=moment)
+        return sync.make_token(moment + timedelta(minutes=30))
+
+    def test_full_then_delta(self):
+        full = self.sync()
+        self.assertTrue(full['full'])
+        self.assertEqual([deck['id'] for deck in full['decks']], [self.deck.pk, self.other.pk])
+        self.assertEqual(len(full['flashcards']), 3)
+
+        token = self.past()
+        self.assertEqual(self.sync(since=token)['decks'], [])
+        edited = self.client.patch(f'/api/flashcards/{self.cards[0].pk}/', {'answer': 'b'},
+                                   content_type='application/json')
+        self.assertEqual(edited.status_code, 200)
+        self.client.delete(f'/api/flashcards/{self.cards[1].pk}/')
+        delta = self.sync(since=token)
+        self.assertFalse(delta['full'])
+        self.assertEqual([card['id'] for card in delta['flashcards']], [self.cards[0].pk])
+        self.assertEqual(delta['deleted'], {'decks': [], 'flashcards': [self.cards[1].pk]})
+        self.assertEqual([deck['card_count'] for deck in delta['decks']], [2])
+
+    def test_deleted_decks(self):
+        token = self.past()
+        self.client.delete(f'/api/decks/{self.other.pk}/')
+        self.assertEqual(self.sync(since=token)['deleted']['decks'], [self.other.pk])
+        one = self.sync(deck=self.other.pk, since=token)
+        self.assertEqual(one['deleted']['decks'], [self.other.pk])
+        self.assertEqual(Tombstone.objects.filter(kind=Tombstone.DECK).count(), 1)
+
+    def test_one_deck_and_bad_input(self):
+        self.client.logout()
+        payload = self.sync(deck=self.deck.pk)
+        self.assertEqual([deck['id'] for deck in payload['decks']], [self.deck.pk])
+        self.assertEqual(self.client.get('/api/sync/').status_code, 401)
+        self.assertEqual(self.client.get('/api/sync/?since=yesterday&deck=1').status_code, 400)
+
+    @override_settings(FLASHCARDS_SYNC_RETENTION_DAYS=1)
+    def test_expired_token_gets_a_full_sync(self):
+        token = sync.make_token(timezone.now() - timedelta(days=2))
+        self.assertTrue(self.sync(since=token)['full'])
+
+
+class BulkCardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('editor', password='password')
+        self.deck = Deck.objects.create(name='Source', owner=self.user, cards_total=4)
+        self.target = Deck.objects.create(name='Target', owner=self.user)
+        self.cards = [
+            Flashcard.objects.create(deck=self.deck, question=f'q{i}', answer='a', order=i)
+            for i in range(4)
+        ]
+        ReviewState.objects.create(user=self.user, card=self.cards[3], deck=self.deck,
+                                   due_at=timezone.now())
+
+    def bulk(self, operations, deck=None):
+        return self.client.post('/api/flashcards/bulk/', {
+            'deck': (deck or self.deck).pk, 'operations': operations,
+        }, content_type='application/json')
+
+    def test_applies_every_operation(self):
+        response = self.bulk([
+            {'op': 'create', 'question': 'new', 'answer': 'card', 'order': 9},
+            {'op': 'update', 'id': self.cards[0].pk, 'order': 5},
+            {'op': 'update', 'id': self.cards[1].pk, 'question': 'edited'},
+            {'op': 'delete', 'id': self.cards[2].pk},
+            {'op': 'move', 'id': self.cards[3].pk, 'deck': self.target.pk, 'order': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['created'][0]['question'], 'new')
+        self.assertEqual([payload[key] for key in ('updated', 'moved', 'deleted')], [2, 1, 1])
+
+        self.assertEqual(
+            list(self.deck.flashcards.values_list('content__question', flat=True)),
+            ['edited', 'q0', 'new'],
+        )
+        self.assertEqual(list(self.target.flashcards.values_list('pk', flat=True)), [self.cards[3].pk])
+        self.assertEqual(ReviewState.objects.get().deck_id, self.target.pk)
+        counts = dict(Deck.objects.values_list('pk', 'cards_total'))
+        self.assertEqual(counts, {self.deck.pk: 3, self.target.pk: 1})
+        self.assertEqual(
+            sorted(Tombstone.objects.values_list('object_id', 'deck_id')),
+            [(self.cards[2].pk, self.deck.pk), (self.cards[3].pk, self.deck.pk)],
+        )
+        self.assertEqual(
+            set(CardFingerprint.objects.values_list('card_id', flat=True)),
+            {self.cards[1].pk, payload['created'][0]['id']},
+        )
+
+    def test_invalid_operations_write_nothing(self):
+        response = self.bulk([
+            {'op': 'delete', 'id': self.cards[0].pk},
+            {'op': 'update', 'id': self.cards[0].pk, 'order': 1},
+            {'op': 'move', 'id': self.cards[1].pk, 'deck': self.deck.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['operations']], [1, 2])
+        moved_away = self.bulk([{'op': 'delete', 'id': self.cards[0].pk}], self.target)
+        self.assertEqual(moved_away.status_code, 400)
+        self.assertEqual(self.bulk([{'op': 'update', 'id': self.cards[0].pk}]).status_code, 400)
+        self.assertEqual(Flashcard.objects.count(), 4)
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_create_one_card(self):
+        response = self.client.post('/api/flashcards/', {
+            'deck': self.target.pk, 'question': 'single', 'answer': 'card',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('deck', response.json())
+        self.assertEqual(Deck.objects.get(pk=self.target.pk).cards_total, 1)
+        missing = self.client.post('/api/flashcards/', {'question': 'q', 'answer': 'a'},
+                                   content_type='application/json')
+        self.assertEqual(missing.status_code, 400)
+
+
+class StreamingImportTests(TestCase):
+    DOCUMENT = {
+        'deck_name': 'Chunked',
+        'flashcards': [
+            {'question': 'café ☕', 'answer': '😀 ' * 20, 'spacedRepetition': True},
+            {'question': 'pi', 'answer': 3.14159265},
+            {'question': 'list', 'answer': [1, 2]},
+            {'question': '', 'answer': 'missing'},
+            'not a card',
+            {'question': 'last', 'answer': '12345678901234567890'},
+        ],
+        'description': 'after the cards',
+    }
+
+    def events(self, document, chunk_size):
+        data = json.dumps(document, ensure_ascii=False, indent=1).encode()
+        return list(imports.StreamingDeckParser(BytesIO(data), chunk_size).events())
+
+    def test_values_split_across_chunks(self):
+        expected = self.events(self.DOCUMENT, 1 << 20)
+        self.assertEqual(expected[0], ('field', 'deck_name', 'Chunked'))
+        self.assertEqual([event[1] for event in expected[1:-1]], self.DOCUMENT['flashcards'])
+        self.assertEqual(expected[-1], ('field', 'description', 'after the cards'))
+        # Chunks of a few bytes split multi-byte characters, strings and numbers
+        for chunk_size in (1, 2, 3, 5, 7, 64):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.events(self.DOCUMENT, chunk_size), expected)
+
+    def test_bare_list(self):
+        cards = self.DOCUMENT['flashcards']
+        self.assertEqual(self.events(cards, 3), [('card', card) for card in cards])
+        self.assertEqual(self.events([], 3), [])
+
+    def test_other_lists_are_fields(self):
+        self.assertEqual(self.events({'cards': [{'question': 'q'}]}, 4),
+                         [('field', 'cards', [{'question': 'q'}])])
+
+    def test_invalid_documents(self):
+        for data in (b'"text"', b'[{"question": "q"}', b'{"flashcards": []} []', b'{1: 2}'):
+            with self.subTest(data=data), self.assertRaises(imports.InvalidUpload):
+                list(imports.StreamingDeckParser(BytesIO(data), 2).events())
+
+    @override_settings(FLASHCARDS_IMPORT_BATCH_SIZE=2)
+    def test_rows_and_batches(self):
+        data = json.dumps(self.DOCUMENT).encode()
+        written = []
+        result = imports.import_deck(
+            BytesIO(data), progress=lambda result: written.append(result.imported),
+            duplicates=duplicates.ALLOW,
+        )
+        self.assertEqual(result.deck.name, 'Chunked')
+        self.assertEqual(result.deck.description, 'after the cards')
+        self.assertEqual(result.imported, 3)
+        # Rows count every element of the list, valid or not
+        self.assertEqual([error['row'] for error in result.errors], [2, 3, 4])
+        self.assertEqual(result.errors[0]['errors'], {'answer': ['Must be text.']})
+        self.assertEqual(written, [2, 3])
+        self.assertEqual(
+            list(result.deck.flashcards.values_list('content__question', flat=True)),
+            ['café ☕', 'pi', 'last'],
+        )
+        self.assertEqual(result.deck.flashcards.get(content__question='pi').answer, '3.14159265')
+
+    @override_settings(FLASHCARDS_IMPORT_BATCH_SIZE=3)
+    def test_exact_batch_multiple(self):
+        cards = [{'question': f'q{i}', 'answer': 'a'} for i in range(6)]
+        written = []
+        result = imports.import_deck(
+            BytesIO(json.dumps(cards).encode()), metadata={'deck_name': 'Even'},
+            progress=lambda result: written.append(result.imported), duplicates=duplicates.ALLOW,
+        )
+        self.assertEqual((result.imported, written), (6, [3, 6]))
+        result.deck.refresh_from_db()
+        self.assertEqual(result.deck.cards_total, 6)
+
+
+class ExportTests(TestCase):
+    CARDS = [
+        ('plain', 'answer', False),
+        ('comma, and "quotes"', 'line one\nline two', True),
+        ('unicode ☕', '</script> & <b>', False),
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('exporter', password='password')
+        self.deck = Deck.objects.create(name='Exported Deck', description='all "sorts"',
+                                        owner=self.user)
+        Flashcard.objects.bulk_create([
+            Flashcard(deck=self.deck, question=question, answer=answer,
+                      spaced_repetition=spaced, order=ordering.position(i))
+            for i, (question, answer, spaced) in enumerate(self.CARDS)
+        ])
+        self.client.force_login(self.user)
+
+    def export(self, url, export_format):
+        response = self.client.get(url, {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def expected_cards(self):
+        return [
+            {'question': question, 'answer': answer, 'spacedRepetition': spaced}
+            for question, answer, spaced in self.CARDS
+        ]
+
+    @override_settings(FLASHCARDS_EXPORT_CHUNK_SIZE=2)
+    def test_json(self):
+        response, body = self.export(f'/api/decks/{self.deck.pk}/export/', 'json')
+        self.assertTrue(response['Content-Type'].startswith('application/json'))
+        self.assertIn(f'exported-deck-{self.deck.pk}.json', response['Content-Disposition'])
+        self.assertEqual(json.loads(body), {
+            'deck_name': 'Exported Deck', 'description': 'all "sorts"',
+            'flashcards': self.expected_cards(),
+        })
+
+    def test_json_empty_deck(self):
+        empty = Deck.objects.create(name='Empty', owner=self.user)
+        _, body = self.export(f'/api/decks/{empty.pk}/export/', 'json')
+        self.assertEqual(json.loads(body), {'deck_name': 'Empty', 'description': '', 'flashcards': []})
+
+    @override_settings(FLASHCARDS_EXPORT_CHUNK_SIZE=2)
+    def test_ndjson(self):
+        response, body = self.export(f'/api/decks/{self.deck.pk}/export/', 'ndjson')
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        lines = body.decode('utf-8').split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([json.loads(line) for line in lines[:-1]], [
+            {'deck_name': 'Exported Deck', 'description': 'all "sorts"'},
+            *self.expected_cards(),
+        ])
+
+    @override_settings(FLASHCARDS_EXPORT_CHUNK_SIZE=2)
+    def test_csv_quoting(self):
+        response, body = self.export(f'/api/decks/{self.deck.pk}/export/', 'csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        text = body.decode('utf-8')
+        self.assertIn('"comma, and ""quotes"""', text)
+        self.assertIn('"line one\nline two"', text)
+        rows = list(csv.reader(StringIO(text, newline='')))
+        self.assertEqual(rows, [
+            ['question', 'answer', 'spacedRepetition'],
+            *[[question, answer, str(spaced)] for question, answer, spaced in self.CARDS],
+        ])
+
+    def test_export_all_zip(self):
+        other = Deck.objects.create(name='Second', owner=self.user)
+        Flashcard.objects.create(deck=other, question='q', answer='a')
+        Deck.objects.create(name='Empty', owner=self.user)
+        Deck.objects.create(name='Not mine', owner=User.objects.create_user('other'))
+        for export_format in ('json', 'csv'):
+            with self.subTest(export_format=export_format):
+                response, body = self.export('/api/decks/export_all/', export_format)
+                self.assertEqual(response['Content-Type'], 'application/zip')
+                self.assertIn('exporter-decks.zip', response['Content-Disposition'])
+                with zipfile.ZipFile(BytesIO(body)) as archive:
+                    self.assertIsNone(archive.testzip())
+                    names = archive.namelist()
+                    self.assertEqual(len(names), 3)
+                    self.assertEqual(names[0], f'exported-deck-{self.deck.pk}.{export_format}')
+                    first = archive.read(names[0]).decode('utf-8')
+                    second = archive.read(names[1]).decode('utf-8')
+                if export_format == 'json':
+                    self.assertEqual(json.loads(first)['flashcards'], self.expected_cards())
+                    self.assertEqual(json.loads(second)['deck_name'], 'Second')
+                else:
+                    rows = list(csv.reader(StringIO(first, newline='')))
+                    self.assertEqual(rows[2][:2], ['comma, and "quotes"', 'line one\nline two'])
+                    self.assertEqual(second.splitlines()[1], 'q,a,False')
+
+
+class ETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('editor', password='password')
+        self.deck = Deck.objects.create(name='Tagged', owner=self.user)
+        self.card = Flashcard.objects.create(deck=self.deck, question='q', answer='a')
+        self.client.force_login(self.user)
+
+    def assertRevalidates(self, url, params):
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assertIn('no-cache', first['Cache-Control'])
+
+        cached = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertEqual(cached.content, b'')
+
+        edited = self.client.patch(f'/api/flashcards/{self.card.pk}/', {'answer': 'changed'},
+                                   content_type='application/json')
+        self.assertEqual(edited.status_code, 200)
+        fresh = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], etag)
+        return fresh
+
+    def test_export(self):
+        response = self.assertRevalidates(f'/api/decks/{self.deck.pk}/export/', {'format': 'json'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['flashcards'][0]['answer'],
+                         'changed')
+
+    def test_cards_list(self):
+        response = self.assertRevalidates('/api/flashcards/', {'deck': self.deck.pk})
+        self.assertEqual(response.json()['results'][0]['answer'], 'changed')
+
+    def test_variants_have_their_own_tags(self):
+        url = f'/api/decks/{self.deck.pk}/export/'
+        json_tag = self.client.get(url, {'format': 'json'})['ETag']
+        csv_response = self.client.get(url, {'format': 'csv'}, HTTP_IF_NONE_MATCH=json_tag)
+        self.assertEqual(csv_response.status_code, 200)
+        self.assertNotEqual(csv_response['ETag'], json_tag)
+        listing = self.client.get('/api/flashcards/', {'deck': self.deck.pk},
+                                  HTTP_IF_NONE_MATCH=json_tag)
+        self.assertEqual(listing.status_code, 200)
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f'fan{i}', password='password') for i in range(3)]
+        self.deck = Deck.objects.create(name='Popular', is_public=True)
+
+    def like(self, user, deck=None, method='post', action='like'):
+        self.client.force_login(user)
+        response = getattr(self.client, method)(f'/api/decks/{(deck or self.deck).pk}/{action}/')
+        self.assertEqual(response.status_code, 200)
+
+    def score(self, deck=None):
+        return Deck.objects.values_list('hot_score', flat=True).get(pk=(deck or self.deck).pk)
+
+    def expected_score(self, deck=None):
+        deck = Deck.objects.get(pk=(deck or self.deck).pk)
+        total = trending.ScoreAccumulator()
+        total.add(1, deck.created_at)
+        for created_at in DeckLike.objects.filter(deck=deck).values_list('created_at', flat=True):
+            total.add(trending.LIKE_WEIGHT, created_at)
+        for created_at in DeckComment.objects.filter(deck=deck).values_list('created_at', flat=True):
+            total.add(trending.COMMENT_WEIGHT, created_at)
+        return total.score
+
+    def make_deck(self, name, age, likes):
+        """A public deck created ``age`` ago and liked ``likes`` times at that time"""
+        when = timezone.now() - age
+        deck = Deck.objects.create(name=name, is_public=True, hot_score=trending.hot_time(when))
+        Deck.objects.filter(pk=deck.pk).update(created_at=when)
+        fans = User.objects.bulk_create([User(username=f'{name}-fan{i}') for i in range(likes)])
+        for fan in fans:
+            DeckLike.objects.create(deck=deck, user=fan)
+            Deck.objects.filter(pk=deck.pk).record_activity(likes=1, when=when)
+        DeckLike.objects.filter(deck=deck).update(created_at=when)
+        return deck
+
+    def test_likes_fold_into_score(self):
+        created = self.score()
+        self.like(self.users[0])
+        # A like now weighs as much as the deck's own creation: one half-life's worth
+        self.assertAlmostEqual(self.score(), created + 1, places=3)
+        self.like(self.users[1])
+        self.like(self.users[1])  # liking twice counts once
+        self.assertAlmostEqual(self.score(), self.expected_score(), places=9)
+        self.assertAlmostEqual(self.score(), created + math.log2(3), places=3)
+
+        self.like(self.users[0], method='delete', action='unlike')
+        self.like(self.users[1], method='delete', action='unlike')
+        self.assertAlmostEqual(self.score(), created, places=9)
+        self.assertEqual(Deck.objects.get(pk=self.deck.pk).likes_total, 0)
+
+    def test_old_likes_decay(self):
+        half_life = timedelta(hours=72)
+        recent = self.make_deck('Recent', timedelta(0), 1)
+        stale = self.make_deck('Stale', half_life * 10, 50)
+        fading = self.make_deck('Fading', half_life, 2)
+        Deck.objects.create(name='Private', hot_score=self.score(recent) + 10)
+        response = self.client.get('/api/decks/community/')
+        names = [deck['name'] for deck in response.json()]
+        # 50 likes ten half-lives ago are worth ~0.05 of a like now
+        self.assertEqual(names, ['Recent', 'Fading', 'Popular', 'Stale'])
+        self.assertAlmostEqual(self.score(stale), self.expected_score(stale), places=9)
+        self.assertAlmostEqual(self.score(fading), self.expected_score(fading), places=9)
+
+    def test_rebuild_matches_incremental_score(self):
+        self.like(self.users[0])
+        self.like(self.users[1])
+        self.client.post(f'/api/decks/{self.deck.pk}/comments/', {'text': 'nice'},
+                         content_type='application/json')
+        self.like(self.users[0], method='delete', action='unlike')
+        other = self.make_deck('Older', timedelta(days=5), 3)
+        incremental = {deck.pk: self.score(deck) for deck in (self.deck, other)}
+
+        out = StringIO()
+        call_command('rebuild_trending', stdout=out)
+        self.assertIn('hot_score: corrected 0 decks', out.getvalue())
+        for deck in (self.deck, other):
+            self.assertAlmostEqual(self.score(deck), incremental[deck.pk], places=9)
+
+        Deck.objects.update(hot_score=0, likes_total=7)
+        out = StringIO()
+        call_command('rebuild_trending', stdout=out)
+        self.assertIn('hot_score: corrected 2 decks', out.getvalue())
+        self.assertIn('likes_total: corrected 2 decks', out.getvalue())
+        for deck in (self.deck, other):
+            self.assertAlmostEqual(self.score(deck), incremental[deck.pk], places=6)
+
+
+class SchedulingTests(TestCase):
+    def test_passing_grades_grow_the_interval(self):
+        ease, interval, repetitions = scheduling.DEFAULT_EASE, 0.0, 0
+        intervals = []
+        for _ in range(4):
+            ease, interval, repetitions, lapsed = scheduling.sm2(ease, interval, repetitions, 4)
+            self.assertFalse(lapsed)
+            intervals.append(interval)
+        self.assertEqual(intervals, [1.0, 6.0, 15.0, 37.5])
+        self.assertEqual((ease, repetitions), (2.5, 4))
+
+    def test_grade_changes_ease(self):
+        self.assertAlmostEqual(scheduling.sm2(2.5, 6.0, 2, 5)[0], 2.6)
+        self.assertAlmostEqual(scheduling.sm2(2.5, 6.0, 2, 3)[0], 2.36)
+        self.assertEqual(scheduling.sm2(2.5, 6.0, 2, 3)[1], 14.16)
+
+    def test_failing_grade_resets_repetitions(self):
+        for grade in (0, 1, 2):
+            with self.subTest(grade=grade):
+                ease, interval, repetitions, lapsed = scheduling.sm2(2.5, 37.5, 4, grade)
+                self.assertEqual((interval, repetitions, lapsed), (0.0, 0, True))
+                self.assertLess(ease, 2.5)
+
+    def test_ease_floor(self):
+        ease = scheduling.DEFAULT_EASE
+        for _ in range(10):
+            ease = scheduling.sm2(ease, 0.0, 0, 0)[0]
+        self.assertEqual(ease, scheduling.MIN_EASE)
+        self.assertEqual(scheduling.sm2(scheduling.MIN_EASE, 1.0, 1, 3)[0], scheduling.MIN_EASE)
+
+
+class ReviewAPITests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('learner', password='password')
+        self.deck = Deck.objects.create(name='Reviewed', is_public=True)
+        self.cards = Flashcard.objects.bulk_create([
+            Flashcard(deck=self.deck, question=f'q{i}', answer='a', order=ordering.position(i))
+            for i in range(4)
+        ])
+        self.client.force_login(self.user)
+
+    def review(self, card, grade):
+        return self.client.post(f'/api/flashcards/{card.pk}/review/', {'grade': grade},
+                                content_type='application/json')
+
+    def due(self, **params):
+        response = self.client.get(f'/api/decks/{self.deck.pk}/due/', params)
+        return [(row['card']['id'], row['is_new']) for row in response.json()]
+
+    def test_review_schedules_and_lapses(self):
+        first = self.review(self.cards[0], 4).json()
+        self.assertEqual((first['repetitions'], first['interval']), (1, 1.0))
+        second = self.review(self.cards[0], 4).json()
+        self.assertEqual((second['repetitions'], second['interval']), (2, 6.0))
+        lapsed = self.review(self.cards[0], 1).json()
+        self.assertEqual((lapsed['repetitions'], lapsed['lapses']), (0, 1))
+        state = ReviewState.objects.get(user=self.user, card=self.cards[0])
+        self.assertAlmostEqual(
+            (state.due_at - state.last_reviewed_at).total_seconds(),
+            scheduling.RELEARN_DELAY.total_seconds(),
+        )
+        self.assertEqual(self.review(self.cards[0], 6).status_code, 400)
+
+    def test_due_queue_order(self):
+        now = timezone.now()
+        for card, hours_ago in ((self.cards[2], 1), (self.cards[3], 5)):
+            self.review(card, 4)
+            ReviewState.objects.filter(card=card).update(due_at=now - timedelta(hours=hours_ago))
+        self.review(self.cards[1], 5)  # due tomorrow
+        # Most overdue first, then never-reviewed cards in deck order
+        self.assertEqual(self.due(), [
+            (self.cards[3].pk, False), (self.cards[2].pk, False), (self.cards[0].pk, True),
+        ])
+        self.assertEqual(self.due(limit=1), [(self.cards[3].pk, False)])
+
+    def test_concurrent_first_review(self):
+        card = self.cards[0]
+        review = scheduling.review
+
+        def racing_review(state, grade, now):
+            if state.pk is None:
+                # Another request inserts this card's state before this one saves
+                ReviewState.objects.bulk_create([ReviewState(
+                    user=self.user, card=card, deck=self.deck, repetitions=1, interval=1.0,
+                    due_at=now,
+                )])
+            return review(state, grade, now)
+
+        with mock.patch.object(scheduling, 'review', racing_review):
+            response = self.review(card, 4)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['repetitions'], response.json()['interval']), (2, 6.0))
+        self.assertEqual(ReviewState.objects.filter(card=card).count(), 1)
+
+
+class DuplicateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='password')
+        self.deck = Deck.objects.create(name='Common', owner=self.user, is_public=True)
+        self.cards = Flashcard.objects.bulk_create([
+            Flashcard(deck=self.deck, question='Is water wet?', answer='yes',
+                      order=ordering.position(i))
+            for i in range(6)
+        ])
+        duplicates.index_cards(self.cards)
+
+    def test_bucket_reads_are_capped(self):
+        sig = duplicates.signature('Is water wet?', 'yes')
+        scope = duplicates.upload_scope(self.deck)
+        keys = duplicates.band_hashes(sig)
+        with mock.patch.object(duplicates, 'BUCKET_LIMIT', 2):
+            entries = duplicates.bucket_entries(keys, scope)
+            match, = duplicates.find_matches([sig], scope)
+        # Every band lands in the same oversized bucket; two cards of each are read
+        self.assertEqual(len(entries), 2 * duplicates.BANDS)
+        self.assertEqual({card for _, card in entries}, {self.cards[0].pk, self.cards[1].pk})
+        self.assertEqual((match.card, match.similarity), (self.cards[0].pk, 1.0))
+
+    def test_bucket_reads_skip_cards_out_of_scope(self):
+        private = Deck.objects.create(name='Private')
+        Flashcard.objects.filter(pk=self.cards[0].pk).update(deck=private)
+        with mock.patch.object(duplicates, 'BUCKET_LIMIT', 2):
+            entries = duplicates.bucket_entries(
+                duplicates.band_hashes(duplicates.signature('Is water wet?', 'yes')),
+                duplicates.upload_scope(self.deck),
+            )
+        self.assertEqual({card for _, card in entries}, {self.cards[1].pk, self.cards[2].pk})
+
+
+@override_settings(FLASHCARDS_IMPORT_BATCH_SIZE=1)
+class ImportJobTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user('uploader', password='password')
+        document = json.dumps({
+            'deck_name': 'Queued',
+            'flashcards': [{'question': f'q{i}', 'answer': 'a'} for i in range(3)],
+        }).encode()
+        self.job = jobs.enqueue_import(BytesIO(document), owner=self.user)
+
+    def test_job_runs_once(self):
+        job = jobs.run_job(jobs.claim_next_job('w1'))
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual(job.deck.flashcards.count(), 3)
+
+    def test_job_list_pages(self):
+        ImportJob.objects.bulk_create([
+            ImportJob(owner=self.user, status=ImportJob.SUCCEEDED) for _ in range(60)
+        ])
+        self.client.force_login(self.user)
+        url, seen = '/api/jobs/', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [job['id'] for job in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(len(seen), 61)
+        self.assertEqual(len(set(seen)), 61)
+
+    @override_settings(FLASHCARDS_IMPORT_HEARTBEAT_SECONDS=0.01)
+    def test_heartbeat_survives_locked_database(self):
+        job = jobs.claim_next_job('w1')
+        beats = []
+
+        class Owned:
+            def update(self, **fields):
+                beats.append(fields['heartbeat_at'])
+                if len(beats) == 1:
+                    raise OperationalError('database is locked')
+                return 1 if len(beats) < 3 else 0
+
+        with mock.patch.object(jobs, 'owned', return_value=Owned()), \
+                self.assertLogs('flashcards.jobs', 'WARNING') as logs:
+            with jobs.heartbeat(job):
+                for _ in range(500):
+                    if len(beats) >= 3:
+                        break
+                    time.sleep(0.01)
+        self.assertEqual(len(beats), 3)
+        self.assertIn('database is locked', logs.output[0])
+
+    def test_requeued_job_is_left_to_its_new_worker(self):
+        job = jobs.claim_next_job('w1')
+        # Requeued as stale and claimed again before the first batch
+        ImportJob.objects.filter(pk=job.pk).update(worker='w2')
+        with self.assertLogs('flashcards.jobs', 'WARNING'):
+            job = jobs.run_job(job)
+        self.assertEqual((job.status, job.worker), (ImportJob.RUNNING, 'w2'))
+        self.assertFalse(Deck.objects.exists())
+        self.assertTrue(job.source.storage.exists(job.source.name))
+
+
+class OrderingTests(TestCase):
+    def setUp(self):
+        self.deck = Deck.objects.create(name='Ordered', cards_total=5)
+        self.cards = Flashcard.objects.bulk_create([
+            Flashcard(deck=self.deck, question=f'q{i}', answer='a', order=ordering.position(i))
+            for i in range(5)
+        ])
+
+    def questions(self):
+        return list(self.deck.flashcards.values_list('content__question', flat=True))
+
+    def place(self, card, after):
+        return self.client.post(f'/api/flashcards/{card.pk}/place/', {
+            'after': after and after.pk,
+        }, content_type='application/json')
+
+    def test_move_writes_one_card(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.place(self.cards[4], self.cards[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.questions(), ['q0', 'q4', 'q1', 'q2', 'q3'])
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "flashcards_flashcard"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.place(self.cards[1], None).status_code, 200)
+        self.assertEqual(self.questions(), ['q1', 'q0', 'q4', 'q2', 'q3'])
+        self.assertEqual(self.place(self.cards[2], self.cards[2]).status_code, 400)
+
+    def test_rebalances_when_gaps_run_out(self):
+        Flashcard.objects.filter(deck=self.deck).update(order=0)
+        expected = self.questions()
+        for _ in range(20):
+            card = self.deck.flashcards.last()
+            self.assertEqual(self.place(card, self.cards[0]).status_code, 200)
+            expected.insert(1, expected.pop())
+            self.assertEqual(self.questions(), expected)
+
+    def test_new_cards_go_last(self):
+        self.client.post('/api/flashcards/', {'deck': self.deck.pk, 'question': 'q5', 'answer': 'a'},
+                         content_type='application/json')
+        self.client.post('/api/flashcards/bulk/', {'deck': self.deck.pk, 'operations': [
+            {'op': 'create', 'question': 'q6', 'answer': 'a'},
+            {'op': 'create', 'question': 'q7', 'answer': 'a'},
+        ]}, content_type='application/json')
+        self.assertEqual(self.questions(), [f'q{i}' for i in range(8)])
+        self.assertEqual(self.deck.flashcards.last().order, ordering.position(7))
+
+
+class ForkTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='password')
+        self.user = User.objects.create_user('forker', password='password')
+        self.source = Deck.objects.create(name='Popular', owner=self.author, is_public=True,
+                                          cards_total=3)
+        Flashcard.objects.bulk_create([
+            Flashcard(deck=self.source, question=f'q{i}', answer='a', order=ordering.position(i))
+            for i in range(3)
+        ])
+        self.client.force_login(self.user)
+
+    def fork(self, deck):
+        return self.client.post(f'/api/decks/{deck.pk}/fork/')
+
+    def test_fork_shares_card_text(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.fork(self.source)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['card_count'], 3)
+        inserts = [
+            q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "flashcards_flashcard"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        fork = Deck.objects.get(pk=response.json()['id'])
+        self.assertEqual(fork.owner, self.user)
+        self.assertEqual(fork.forked_from, self.source)
+        self.assertFalse(fork.is_public)
+        self.assertEqual(
+            list(fork.flashcards.values_list('content__question', flat=True)), ['q0', 'q1', 'q2']
+        )
+        self.assertEqual(CardContent.objects.count(), 3)
+
+    def test_editing_a_fork_leaves_the_source(self):
+        fork = Deck.objects.get(pk=self.fork(self.source).json()['id'])
+        card = fork.flashcards.first()
+        response = self.client.patch(f'/api/flashcards/{card.pk}/', {'answer': 'mine'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.source.flashcards.first().answer, 'a')
+        self.assertEqual(fork.flashcards.first().text, ('q0', 'mine'))
+        self.assertEqual(CardContent.objects.count(), 4)
+
+    def test_search_shows_shared_text_once(self):
+        for i in range(3):
+            self.fork(self.source)
+        Deck.objects.filter(forked_from=self.source).update(is_public=True)
+        original = self.source.flashcards.get(content__question='q1')
+        cards = search.search('q1', limit=2)['cards']
+        self.assertEqual([card['id'] for card in cards], [original.pk])
+        fallback = search.fallback_search('q1', None, 2)['cards']
+        self.assertEqual([card['id'] for card in fallback], [original.pk])
+
+    def test_search_finds_forks_of_private_decks(self):
+        fork = Deck.objects.get(pk=self.fork(self.source).json()['id'])
+        self.source.is_public = False
+        self.source.save()
+        cards = search.search('q1', user=self.user)['cards']
+        self.assertEqual([card['deck'] for card in cards], [fork.pk])
+
+    def test_private_decks_of_others_cannot_be_forked(self):
+        self.source.is_public = False
+        self.source.save()
+        self.assertEqual(self.fork(self.source).status_code, 404)
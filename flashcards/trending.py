@@ -0,0 +1,81 @@
+"""
+Time-decayed hotness score for the community feed.
+
+Every like, comment and the deck's own creation adds weight to a deck,
+and that weight halves every ``FLASHCARDS_TRENDING_HALF_LIFE_HOURS``.
+Comparing decayed sums at any moment gives the same order as comparing
+them relative to a fixed epoch, so the score is stored as
+``log2(sum(weight * 2 ** hot_time(event)))``. It never has to be
+recomputed as time passes, and each event folds into it with a single
+atomic UPDATE.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest, Log, Power
+from django.utils import timezone
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+
+# Contributions older than this many half-lives are below float precision
+# of any live score, so undoing them is skipped.
+NEGLIGIBLE_AGE = 50
+
+# Floor used when undoing activity so rounding can't take log2 of <= 0.
+MIN_WEIGHT = 2 ** -NEGLIGIBLE_AGE
+
+
+def half_life_seconds():
+    return getattr(settings, 'FLASHCARDS_TRENDING_HALF_LIFE_HOURS', 72) * 3600
+
+
+def hot_time(when):
+    """Number of half-lives between the epoch and ``when``"""
+    return (when - EPOCH).total_seconds() / half_life_seconds()
+
+
+def hot_time_now():
+    """Score of a deck created now with no other activity"""
+    return hot_time(timezone.now())
+
+
+def fold_expression(weight, when=None):
+    """
+    Expression adding ``weight`` at ``when`` to the stored ``hot_score``.
+    Returns None when undoing activity too old to matter.
+    """
+    now = timezone.now()
+    when = when or now
+    if weight < 0 and hot_time(now) - hot_time(when) > NEGLIGIBLE_AGE:
+        return None
+    k = hot_time(when)
+    total = Power(Value(2.0), F('hot_score') - Value(k)) + Value(float(weight))
+    if weight < 0:
+        total = Greatest(total, Value(MIN_WEIGHT))
+    return Value(k) + Log(Value(2.0), total, output_field=FloatField())
+
+
+class ScoreAccumulator:
+    """Log-sum-exp accumulator used to rebuild a score from raw events"""
+
+    def __init__(self):
+        self.peak = None
+        self.total = 0.0
+
+    def add(self, weight, when):
+        k = hot_time(when)
+        if self.peak is None:
+            self.peak = k
+        elif k > self.peak:
+            self.total *= 2.0 ** (self.peak - k)
+            self.peak = k
+        self.total += weight * 2.0 ** (k - self.peak)
+
+    @property
+    def score(self):
+        return self.peak + math.log2(max(self.total, MIN_WEIGHT))
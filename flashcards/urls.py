@@ -7,14 +7,20 @@ router = DefaultRouter()
 router.register(r'decks', views.DeckViewSet, basename='deck')
 router.register(r'flashcards', views.FlashcardViewSet, basename='flashcard')
 router.register(r'sessions', views.StudySessionViewSet, basename='session')
+router.register(r'jobs', views.ImportJobViewSet, basename='job')
+router.register(r'reviews', views.ReviewStateViewSet, basename='review')
 
 app_name = 'flashcards'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('api/', include(router.urls)),
     path('api/login/', TokenObtainPairView.as_view(), name='login'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/analytics/', views.AnalyticsView.as_view(), name='analytics'),
+    path('api/search/', views.SearchView.as_view(), name='search'),
+    path('api/sync/', views.SyncView.as_view(), name='sync'),
     path('api/register/', views.RegisterView.as_view(), name='register'),
     path('api/profile/', views.UserProfileView.as_view(), name='profile'),
 ]
@@ -1,18 +1,36 @@
+import hmac
+
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
+from rest_framework.reverse import reverse
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Exists, F, OuterRef, Q
 from django.shortcuts import render
-from django.http import JsonResponse
-from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.db import transaction
 from django.contrib.auth.models import User
-from .models import Deck, Flashcard, StudySession, DeckComment, DeckLike
+from . import (
+    analytics, answerlog, bulk, duplicates as dedup, exports, fastjson, forks, imports, jobs,
+    metrics, ordering, scheduling, search, stats, sync,
+)
+from .models import (
+    Deck, Flashcard, StudySession, DeckComment, DeckLike, ImportJob, ReviewState, StudyBucket,
+    UserStats, AnswerEvent, CardStats, Tombstone, etag_for,
+)
 from .serializers import (
-    DeckSerializer, DeckListSerializer, FlashcardSerializer, 
-    StudySessionSerializer, BulkUploadSerializer, UserRegisterSerializer,
-    UserProfileSerializer, CommentSerializer, CommunityDeckSerializer
+    DeckSerializer, DeckListSerializer, FlashcardSerializer, FlashcardCreateSerializer,
+    StudySessionSerializer, UserRegisterSerializer,
+    UserProfileSerializer, CommentSerializer, CommunityDeckSerializer,
+    ImportJobSerializer, AnswerSerializer, AnswerBatchSerializer,
+    ReviewStateSerializer, GradeSerializer, CardStatsSerializer, CardBatchSerializer,
+    PlaceSerializer, selected
 )
 
 
@@ -21,76 +39,323 @@ def index(request):
     return render(request, 'flashcards/index.html')
 
 
-class DeckViewSet(viewsets.ModelViewSet):
+def metrics_view(request):
+    """
+    Request metrics of all worker processes in the Prometheus text format
+    GET /metrics
+    
+    Open to staff users and to "Authorization: Bearer <FLASHCARDS_METRICS_TOKEN>"
+    when that setting is set, or to anyone with FLASHCARDS_METRICS_PUBLIC.
+    """
+    token = getattr(settings, 'FLASHCARDS_METRICS_TOKEN', None)
+    allowed = (
+        getattr(settings, 'FLASHCARDS_METRICS_PUBLIC', False)
+        or request.user.is_staff
+        or bool(token) and hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {token}'
+        )
+    )
+    if not allowed:
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def bounded_int(request, name, default, maximum):
+    """Read a positive integer query parameter, clamped to ``maximum``"""
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+    return max(1, min(value, maximum))
+
+
+def field_list(request, name):
+    """Names from a comma-separated query parameter, or None when it is absent"""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    ``?fields=a,b`` keeps only those serializer fields on reads and
+    ``?exclude=c`` leaves some out. Columns that no remaining field reads
+    are deferred with ``only()`` rather than fetched and dropped.
+    """
+    
+    def sparse_fields(self):
+        """``(fields, exclude)`` requested for this read, both None if none"""
+        if self.request.method not in SAFE_METHODS:
+            return None, None
+        return field_list(self.request, 'fields'), field_list(self.request, 'exclude')
+    
+    def is_sparse(self):
+        fields, exclude = self.sparse_fields()
+        return fields is not None or bool(exclude)
+    
+    def selected_fields(self):
+        return selected(self.get_serializer_class().Meta.fields, *self.sparse_fields())
+    
+    def fields_variant(self):
+        """ETag suffix naming the selected fields when some are left out"""
+        return f".{','.join(self.selected_fields())}" if self.is_sparse() else ''
+    
+    def sparse_queryset(self, queryset, *always):
+        """``queryset`` reading only the selected fields' columns and ``always``"""
+        if not self.is_sparse():
+            return queryset
+        columns = [*self.get_serializer_class().columns(*self.sparse_fields()), *always]
+        # Join only the relations a remaining column is read from
+        related = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns)
+    
+    def get_serializer(self, *args, **kwargs):
+        if self.is_sparse():
+            fields, exclude = self.sparse_fields()
+            kwargs.update(fields=fields, exclude=exclude)
+        return super().get_serializer(*args, **kwargs)
+
+
+def deck_etag(deck_id, variant=''):
+    """ETag of a deck's content read from the deck row alone, or None"""
+    try:
+        row = Deck.objects.filter(pk=deck_id).values_list('content_version', 'updated_at').first()
+    except (TypeError, ValueError):
+        return None
+    if row is None:
+        return None
+    return etag_for(deck_id, *row, variant=variant)
+
+
+def not_modified(request, etag):
+    """A 304 response when the client's If-None-Match already holds ``etag``"""
+    if etag is None:
+        return None
+    return get_conditional_response(request, etag=etag)
+
+
+def with_etag(response, etag):
+    """Stamp ``etag`` and make caches revalidate before reusing the body"""
+    if etag is not None and response.status_code in (200, 304):
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+class DeckViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for Deck CRUD operations
     """
     queryset = Deck.objects.all()
     
+    def get_queryset(self):
+        queryset = Deck.objects.all()
+        if self.action in ('list', 'retrieve', 'public', 'community'):
+            queryset = queryset.with_stats(self.request.user)
+        if self.action in ('list', 'retrieve'):
+            # Neither serializer shows the owner, so the join can go too
+            queryset = self.sparse_queryset(queryset.select_related(None))
+        return queryset
+    
+    def sparse_fields(self):
+        fields, exclude = super().sparse_fields()
+        include_cards = self.request.query_params.get('include_cards', '').lower()
+        if self.action == 'retrieve' and include_cards in ('0', 'false', 'no'):
+            exclude = (exclude or []) + ['flashcards']
+        return fields, exclude
+    
     def get_serializer_class(self):
         if self.action == 'list':
             return DeckListSerializer
         return DeckSerializer
     
+    @transaction.atomic
+    def perform_create(self, serializer):
+        owner = self.request.user if self.request.user.is_authenticated else None
+        deck = serializer.save(owner=owner)
+        UserStats.objects.of(deck.owner_id).record(decks=1)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        Deck.objects.filter(pk=instance.pk).remove()
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Get a deck with all its flashcards
+        GET /api/decks/{id}/
+        
+        Answers If-None-Match with 304 from the deck's content version,
+        without reading the flashcards. ?include_cards=false leaves the
+        cards out; page through them with GET /api/flashcards/?deck={id}.
+        ?fields= and ?exclude= select the deck fields returned.
+        """
+        etag = deck_etag(kwargs['pk'], request.accepted_renderer.format + self.fields_variant())
+        response = not_modified(request, etag)
+        if response is None and fastjson.enabled(request):
+            response = self._fast_retrieve(kwargs['pk'])
+        elif response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return with_etag(response, etag)
+    
+    def _fast_retrieve(self, pk):
+        """The DeckSerializer body built from values_list() rows"""
+        names = self.selected_fields()
+        columns = fastjson.subset(fastjson.DECK_FIELDS, names)
+        row = generics.get_object_or_404(
+            self.get_queryset().values_list('id', *columns.values()), pk=pk
+        )
+        deck = dict(zip(columns, row[1:]))
+        if 'flashcards' in names:
+            deck['flashcards'] = fastjson.rows(
+                Flashcard.objects.filter(deck_id=row[0]), fastjson.CARD_FIELDS
+            )
+        return Response(fastjson.encode(deck))
+    
     @action(detail=False, methods=['post'], parser_classes=[JSONParser, MultiPartParser, FormParser])
     def upload(self, request):
         """
-        Upload flashcards from JSON file or data
+        Upload flashcards from a JSON body or an uploaded JSON file
         POST /api/decks/upload/
+        
+        The document is streamed and imported in batches. Deck fields may
+        also be given as query parameters (JSON body) or form fields (file).
+        Large uploads are queued as an ImportJob and answered with 202.
+        ?duplicates=flag (default) reports near-duplicate cards, skip leaves
+        them out and allow turns the check off.
         """
-        serializer = BulkUploadSerializer(data=request.data)
-        if serializer.is_valid():
-            data = serializer.validated_data
-            
-            # Create deck
-            deck = Deck.objects.create(
-                name=data['deck_name'],
-                description=data.get('description', ''),
-                is_public=data.get('is_public', False),
-                owner=request.user if request.user.is_authenticated else None
+        source, metadata = self._upload_source(request)
+        if source is None:
+            return Response(
+                {'error': "Send a JSON body or a JSON file in the 'file' field"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            # Create flashcards
-            flashcards = []
-            for idx, card_data in enumerate(data['flashcards']):
-                flashcard = Flashcard(
-                    deck=deck,
-                    question=card_data['question'],
-                    answer=card_data['answer'],
-                    spaced_repetition=card_data.get('spacedRepetition', False),
-                    order=idx
-                )
-                flashcards.append(flashcard)
-            
-            Flashcard.objects.bulk_create(flashcards)
-            
-            # Return created deck with flashcards
-            deck_serializer = DeckSerializer(deck)
-            return Response(deck_serializer.data, status=status.HTTP_201_CREATED)
+        duplicates = request.query_params.get('duplicates', dedup.FLAG)
+        if duplicates not in dedup.MODES:
+            return Response(
+                {'error': f"duplicates must be one of: {', '.join(dedup.MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        owner = request.user if request.user.is_authenticated else None
+        
+        if self._run_in_background(request):
+            job = jobs.enqueue_import(source, metadata=metadata, owner=owner, duplicates=duplicates)
+            return Response({
+                'job_id': job.pk,
+                'status': job.status,
+                'url': reverse('flashcards:job-detail', args=[job.pk], request=request),
+            }, status=status.HTTP_202_ACCEPTED)
         
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = imports.import_deck(
+                source, metadata=metadata, owner=owner, duplicates=duplicates
+            )
+        except imports.InvalidUpload as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        data = DeckListSerializer(result.deck).data
+        data.update({
+            'imported': result.imported,
+            'error_count': result.error_count,
+            'errors': result.errors,
+            'duplicate_count': result.duplicate_count,
+            'duplicates': result.duplicates,
+        })
+        return Response(data, status=status.HTTP_201_CREATED)
     
-    @action(detail=True, methods=['get'])
+    def _run_in_background(self, request):
+        """Large uploads, or ones sent with ?background=true, go to the job queue"""
+        if request.query_params.get('background', '').lower() in ('1', 'true', 'yes'):
+            return True
+        try:
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return False
+        return size > settings.FLASHCARDS_IMPORT_BACKGROUND_THRESHOLD
+    
+    def _upload_source(self, request):
+        """Return the file-like upload and the deck fields sent alongside it"""
+        fields = ('deck_name', 'description', 'is_public')
+        if request.content_type.startswith('application/json'):
+            params = request.query_params
+            return request.stream, {k: params[k] for k in fields if k in params}
+        upload = request.FILES.get('file')
+        params = request.data
+        return upload, {k: params[k] for k in fields if k in params}
+    
+    @action(detail=True, methods=['get'], renderer_classes=exports.EXPORT_RENDERERS)
     def export(self, request, pk=None):
         """
-        Export deck as JSON
-        GET /api/decks/{id}/export/
+        Stream a deck as JSON, NDJSON or CSV
+        GET /api/decks/{id}/export/?format=json|ndjson|csv
+        """
+        etag = deck_etag(pk, request.accepted_renderer.format)
+        response = not_modified(request, etag)
+        if response is None:
+            deck = self.get_object()
+            response = exports.deck_response(
+                deck, request.accepted_renderer.format, request.accepted_renderer.media_type
+            )
+        return with_etag(response, etag)
+    
+    @action(detail=False, methods=['get'], renderer_classes=exports.EXPORT_RENDERERS,
+            permission_classes=[IsAuthenticated])
+    def export_all(self, request):
+        """
+        Stream all of the user's decks as one ZIP archive
+        GET /api/decks/export_all/?format=json|ndjson|csv
+        """
+        decks = Deck.objects.filter(owner=request.user)
+        return exports.archive_response(
+            decks, request.accepted_renderer.format, f'{request.user.username}-decks'
+        )
+    
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def due(self, request, pk=None):
+        """
+        Next cards for the user to review in this deck: overdue cards by due
+        date, then cards never reviewed in deck order
+        GET /api/decks/{id}/due/?limit=N
         """
         deck = self.get_object()
-        flashcards_data = [
-            {
-                'question': card.question,
-                'answer': card.answer,
-                'spacedRepetition': card.spaced_repetition
-            }
-            for card in deck.flashcards.all()
-        ]
+        limit = bounded_int(request, 'limit', 20, 500)
         
-        return Response({
-            'deck_name': deck.name,
-            'description': deck.description,
-            'flashcards': flashcards_data
-        })
+        states = list(
+            ReviewState.objects.filter(
+                user=request.user, deck=deck, due_at__lte=timezone.now()
+            ).select_related('card__content').order_by('due_at')[:limit]
+        )
+        if len(states) < limit:
+            reviewed = ReviewState.objects.filter(user=request.user, card=OuterRef('pk'))
+            new_cards = deck.flashcards.filter(~Exists(reviewed)).order_by(
+                'order', 'created_at', 'id'
+            )[:limit - len(states)]
+            states += [ReviewState(card=card, deck=deck) for card in new_cards]
+        
+        serializer = ReviewStateSerializer(states, many=True)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def difficulty(self, request, pk=None):
+        """
+        Cards of this deck that learners get wrong most often, from the
+        answer log. Cards nobody has answered are left out.
+        GET /api/decks/{id}/difficulty/?limit=N
+        """
+        deck = self.get_object()
+        limit = bounded_int(request, 'limit', 50, 500)
+        
+        # Same smoothing as CardStats.difficulty, so few answers rank mid-table
+        ease = (F('correct') + 1.0) / (F('attempts') + 2.0)
+        rows = CardStats.objects.filter(card__deck=deck, attempts__gt=0).select_related(
+            'card__content'
+        ).alias(ease=ease).order_by('ease', '-attempts', 'card_id')[:limit]
+        
+        serializer = CardStatsSerializer(rows, many=True)
+        return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def public(self, request):
@@ -98,19 +363,24 @@ class DeckViewSet(viewsets.ModelViewSet):
         Get all public decks
         GET /api/decks/public/
         """
-        public_decks = Deck.objects.filter(is_public=True)
-        serializer = DeckListSerializer(public_decks, many=True)
-        return Response(serializer.data)
+        public_decks = self.get_queryset().filter(is_public=True)
+        page = self.paginate_queryset(public_decks)
+        serializer = DeckListSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def community(self, request):
         """
-        Get community/trending decks sorted by popularity
+        Get community/trending decks sorted by time-decayed popularity
         GET /api/decks/community/
         """
-        public_decks = Deck.objects.filter(is_public=True).annotate(
-            likes_count=Count('likes')
-        ).order_by('-likes_count', '-created_at')[:20]
+        public_decks = self.get_queryset().filter(
+            is_public=True
+        ).order_by('-hot_score')[:20]
+        if fastjson.enabled(request):
+            return Response(fastjson.encode(
+                fastjson.rows(public_decks, fastjson.COMMUNITY_DECK_FIELDS, omit_null=['owner_name'])
+            ))
         
         serializer = CommunityDeckSerializer(
             public_decks, 
@@ -126,9 +396,13 @@ class DeckViewSet(viewsets.ModelViewSet):
         POST /api/decks/{id}/like/
         """
         deck = self.get_object()
-        DeckLike.objects.get_or_create(deck=deck, user=request.user)
+        with transaction.atomic():
+            like, created = DeckLike.objects.get_or_create(deck=deck, user=request.user)
+            if created:
+                Deck.objects.filter(pk=deck.pk).record_activity(likes=1, when=like.created_at)
+        deck.refresh_from_db(fields=['likes_total'])
         return Response({
-            'likes': deck.likes.count(),
+            'likes': deck.likes_total,
             'message': 'Deck liked successfully'
         })
     
@@ -139,12 +413,34 @@ class DeckViewSet(viewsets.ModelViewSet):
         DELETE /api/decks/{id}/unlike/
         """
         deck = self.get_object()
-        DeckLike.objects.filter(deck=deck, user=request.user).delete()
+        with transaction.atomic():
+            like = DeckLike.objects.filter(deck=deck, user=request.user).first()
+            if like is not None:
+                deleted, _ = DeckLike.objects.filter(pk=like.pk).delete()
+                if deleted:
+                    Deck.objects.filter(pk=deck.pk).record_activity(likes=-1, when=like.created_at)
+        deck.refresh_from_db(fields=['likes_total'])
         return Response({
-            'likes': deck.likes.count(),
+            'likes': deck.likes_total,
             'message': 'Like removed'
         })
     
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def fork(self, request, pk=None):
+        """
+        Copy a public deck, or one of the user's own, into a new private
+        deck of the user. The copies share the source cards' text until
+        they are edited (see forks.py).
+        POST /api/decks/{id}/fork/
+        """
+        source = self.get_object()
+        if not source.is_public and source.owner_id != request.user.pk:
+            raise Http404
+        deck = forks.fork(source, request.user)
+        deck = Deck.objects.with_stats(request.user).get(pk=deck.pk)
+        serializer = DeckSerializer(deck, exclude=['flashcards'])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get', 'post'])
     def comments(self, request, pk=None):
         """
@@ -163,17 +459,22 @@ class DeckViewSet(viewsets.ModelViewSet):
             
             serializer = CommentSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save(deck=deck, user=request.user)
+                with transaction.atomic():
+                    comment = serializer.save(deck=deck, user=request.user)
+                    Deck.objects.filter(pk=deck.pk).record_activity(
+                        comments=1, when=comment.created_at
+                    )
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         # GET method
-        comments = deck.comments.all()[:50]  # Limit to 50 most recent
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        comments = deck.comments.select_related('user')
+        page = self.paginate_queryset(comments)
+        serializer = CommentSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
-class FlashcardViewSet(viewsets.ModelViewSet):
+class FlashcardViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for Flashcard CRUD operations
     """
@@ -185,6 +486,169 @@ class FlashcardViewSet(viewsets.ModelViewSet):
         deck_id = self.request.query_params.get('deck', None)
         if deck_id:
             queryset = queryset.filter(deck_id=deck_id)
+        # The paginator reads the ordering columns of each page's edge rows
+        return self.sparse_queryset(queryset, *self.ordering_columns(queryset))
+    
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return FlashcardCreateSerializer
+        return FlashcardSerializer
+    
+    def ordering_columns(self, queryset):
+        return ['id' if name == 'pk' else name for name, _ in self.paginator.get_ordering(queryset)]
+    
+    def list(self, request, *args, **kwargs):
+        """
+        List flashcards, optionally for one deck
+        GET /api/flashcards/?deck={id}&fields=id,question
+        
+        Listings of a single deck carry the deck's ETag.
+        """
+        etag = None
+        deck_id = request.query_params.get('deck')
+        if deck_id:
+            etag = deck_etag(
+                deck_id, f'cards.{request.accepted_renderer.format}{self.fields_variant()}'
+            )
+        response = not_modified(request, etag)
+        if response is None and fastjson.enabled(request):
+            response = self._fast_list()
+        elif response is None:
+            response = super().list(request, *args, **kwargs)
+        return with_etag(response, etag)
+    
+    def _fast_list(self):
+        """The paginated FlashcardSerializer body built from values() rows"""
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = fastjson.subset(fastjson.CARD_FIELDS, self.selected_fields())
+        extra = [name for name in self.ordering_columns(queryset) if name not in columns.values()]
+        page = self.paginate_queryset(queryset.values(*columns.values(), *extra))
+        page = [{key: row[column] for key, column in columns.items()} for row in page]
+        return fastjson.encoded(self.get_paginated_response(page))
+    
+    @transaction.atomic
+    def perform_create(self, serializer):
+        if 'order' in serializer.validated_data:
+            card = serializer.save()
+        else:
+            card = serializer.save(order=ordering.next_order(serializer.validated_data['deck'].pk))
+        Deck.objects.filter(pk=card.deck_id).record_activity(cards=1)
+        dedup.index_cards([card])
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        card = serializer.save()
+        Deck.objects.filter(pk=card.deck_id).touch()
+        dedup.reindex_card(card)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        deck_id = instance.deck_id
+        Tombstone.objects.record_cards([(instance.pk, deck_id)])
+        instance.delete()
+        Deck.objects.filter(pk=deck_id).record_activity(cards=-1)
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create, edit, reorder, move and delete cards of one deck in one
+        request; either every operation is applied or none is
+        POST /api/flashcards/bulk/
+        Body: {"deck": 1, "operations": [
+            {"op": "create", "question": "...", "answer": "...", "order": 3},
+            {"op": "update", "id": 7, "order": 0},
+            {"op": "move", "id": 8, "deck": 2},
+            {"op": "delete", "id": 9}
+        ]}
+        """
+        batch = CardBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        deck = Deck.objects.filter(pk=batch.validated_data['deck']).first()
+        if deck is None:
+            raise Http404
+        try:
+            result = bulk.apply(deck, batch.validated_data['operations'])
+        except bulk.InvalidOperations as e:
+            return Response({'error': 'Some operations cannot be applied', 'operations': e.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'created': FlashcardSerializer(result.created, many=True).data,
+            'updated': len(result.updated),
+            'moved': len(result.moved),
+            'deleted': len(result.deleted),
+        })
+    
+    @action(detail=True, methods=['post'])
+    def place(self, request, pk=None):
+        """
+        Move a card within its deck without renumbering the cards after it
+        POST /api/flashcards/{id}/place/
+        Body: {"after": <card id>}, or {"after": null} to put it first
+        """
+        place = PlaceSerializer(data=request.data)
+        place.is_valid(raise_exception=True)
+        card = self.get_object()
+        previous = None
+        if place.validated_data['after'] is not None:
+            previous = Flashcard.objects.filter(
+                deck_id=card.deck_id, pk=place.validated_data['after']
+            ).exclude(pk=card.pk).first()
+            if previous is None:
+                return Response({'error': 'after must be another card of the same deck'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            ordering.place(card, previous)
+            Deck.objects.filter(pk=card.deck_id).touch()
+        
+        serializer = FlashcardSerializer(card)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def review(self, request, pk=None):
+        """
+        Grade a card and reschedule it with SM-2
+        POST /api/flashcards/{id}/review/
+        Body: {"grade": 0-5}
+        """
+        grade = GradeSerializer(data=request.data)
+        grade.is_valid(raise_exception=True)
+        now = timezone.now()
+        
+        state = ReviewState.objects.filter(user=request.user, card_id=pk).first()
+        if state is not None:
+            fields = scheduling.review(state, grade.validated_data['grade'], now)
+            state.save(update_fields=fields)
+        else:
+            deck_id = self.get_queryset().filter(pk=pk).values_list('deck_id', flat=True).first()
+            if deck_id is None:
+                raise Http404
+            state = ReviewState(user=request.user, card_id=pk, deck_id=deck_id)
+            scheduling.review(state, grade.validated_data['grade'], now)
+            try:
+                with transaction.atomic():
+                    state.save(force_insert=True)
+            except IntegrityError:
+                # Graded concurrently from another request; retry as an update
+                return self.review(request, pk)
+        
+        serializer = ReviewStateSerializer(state)
+        return Response(serializer.data)
+
+
+class ReviewStateViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The user's review schedule across all decks, soonest first
+    GET /api/reviews/?due=true
+    """
+    serializer_class = ReviewStateSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = ReviewState.objects.filter(user=self.request.user).select_related(
+            'card__content'
+        )
+        if self.request.query_params.get('due', '').lower() in ('1', 'true', 'yes'):
+            queryset = queryset.filter(due_at__lte=timezone.now())
         return queryset
 
 
@@ -195,6 +659,22 @@ class StudySessionViewSet(viewsets.ModelViewSet):
     queryset = StudySession.objects.all()
     serializer_class = StudySessionSerializer
     
+    def get_queryset(self):
+        return StudySession.objects.select_related('deck')
+    
+    @transaction.atomic
+    def perform_create(self, serializer):
+        user = self.request.user if self.request.user.is_authenticated else None
+        session = serializer.save(user=user)
+        UserStats.objects.of(session.user_id).record(sessions=1)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        UserStats.objects.of(instance.user_id).record(
+            sessions=-1, correct=-instance.correct_count, attempts=-instance.total_attempts
+        )
+    
     @action(detail=True, methods=['post'])
     def record_answer(self, request, pk=None):
         """
@@ -202,32 +682,215 @@ class StudySessionViewSet(viewsets.ModelViewSet):
         POST /api/sessions/{id}/record_answer/
         Body: {"correct": true/false}
         """
-        session = self.get_object()
-        is_correct = request.data.get('correct', False)
+        answer = AnswerSerializer(data=request.data)
+        answer.is_valid(raise_exception=True)
+        session = self._record_answers(pk, [answer.validated_data])
         
-        session.total_attempts += 1
-        if is_correct:
-            session.correct_count += 1
-        session.save()
+        serializer = self.get_serializer(session)
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'])
+    def record_answers(self, request, pk=None):
+        """
+        Record a batch of answers in one request, e.g. flushed by an
+        offline client
+        POST /api/sessions/{id}/record_answers/
+        Body: {"answers": [{"correct": true}, {"correct": false}, ...]}
+        """
+        batch = AnswerBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        session = self._record_answers(pk, batch.validated_data['answers'])
         
         serializer = self.get_serializer(session)
         return Response(serializer.data)
     
+    def _record_answers(self, pk, answers):
+        """
+        Add the answers with a single atomic UPDATE of the two counters, so
+        concurrent requests can't lose increments, and hand the individual
+        answers to the answer log once the transaction commits
+        """
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise Http404
+        correct = sum(1 for answer in answers if answer['correct'])
+        now = timezone.now()
+        # Study days are the dates the answers were given, as in stats.study_days
+        days = sorted({timezone.localdate(answer.get('answered_at', now)) for answer in answers})
+        with transaction.atomic():
+            updated = self.get_queryset().filter(pk=pk).update(
+                total_attempts=F('total_attempts') + len(answers),
+                correct_count=F('correct_count') + correct,
+            )
+            if not updated:
+                raise Http404
+            session = self.get_queryset().get(pk=pk)
+            user_stats = UserStats.objects.of(session.user_id)
+            user_stats.record(correct=correct, attempts=len(answers), studied_on=days[0])
+            for day in days[1:]:
+                user_stats.record(studied_on=day)
+            answerlog.record(self._answer_events(session, answers, now))
+        return session
+    
+    def _answer_events(self, session, answers, now):
+        """Unsaved AnswerEvents; cards outside the session's deck are dropped"""
+        card_ids = {answer['card'] for answer in answers if 'card' in answer}
+        if card_ids:
+            card_ids = set(session.deck.flashcards.filter(pk__in=card_ids).values_list(
+                'pk', flat=True
+            ))
+        return [
+            AnswerEvent(
+                session_id=session.pk,
+                card_id=answer.get('card') if answer.get('card') in card_ids else None,
+                correct=answer['correct'],
+                response_ms=answer.get('response_ms'),
+                answered_at=answer.get('answered_at', now),
+            )
+            for answer in answers
+        ]
+    
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
         """
         Mark session as completed
         POST /api/sessions/{id}/complete/
         """
-        from django.utils import timezone
         session = self.get_object()
-        session.completed_at = timezone.now()
-        session.save()
+        now = timezone.now()
+        with transaction.atomic():
+            # Only the first call counts: analytics picks sessions up by
+            # completed_at, so moving it would roll the session in again
+            completed = StudySession.objects.filter(
+                pk=session.pk, completed_at__isnull=True
+            ).update(completed_at=now)
+            if completed:
+                UserStats.objects.of(session.user_id).record(studied_on=timezone.localdate(now))
+        session.refresh_from_db(fields=['completed_at'])
         
         serializer = self.get_serializer(session)
         return Response(serializer.data)
 
 
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Progress of background deck imports
+    GET /api/jobs/{id}/
+    """
+    serializer_class = ImportJobSerializer
+    
+    def get_queryset(self):
+        user = self.request.user
+        if self.action == 'list':
+            if not user.is_authenticated:
+                return ImportJob.objects.none()
+            return ImportJob.objects.filter(owner=user)
+        # Job ids are random UUIDs, so anonymous uploads can poll their own job
+        if user.is_authenticated:
+            return ImportJob.objects.filter(Q(owner=user) | Q(owner__isnull=True))
+        return ImportJob.objects.filter(owner__isnull=True)
+
+
+class SearchView(APIView):
+    """
+    Full-text search over cards and decks
+    GET /api/search/?q=<text>&limit=20
+    
+    Matches are ranked by BM25 and limited to public decks and the user's
+    own. Snippets wrap matches in <mark> tags but are otherwise raw card
+    text, so clients must escape them before inserting HTML.
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': "Query parameter 'q' is required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        limit = bounded_int(request, 'limit', 20, 100)
+        return Response(search.search(query, request.user, limit))
+
+
+class SyncView(APIView):
+    """
+    Decks and cards changed since the previous sync, and the ids of the
+    ones deleted since then
+    GET /api/sync/?since=<token>             the user's own decks
+    GET /api/sync/?deck={id}&since=<token>   one deck
+    
+    Leave since out for a full copy, then send the returned token next
+    time. "full": true means the client should replace its copy.
+    """
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        try:
+            since = sync.parse_token(request.query_params.get('since'))
+        except sync.InvalidToken:
+            return Response({'error': 'Invalid sync token'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        deck_id = request.query_params.get('deck')
+        if deck_id:
+            try:
+                decks = Deck.objects.filter(pk=int(deck_id))
+            except ValueError:
+                return Response({'error': 'deck must be a deck id'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            payload = sync.changes(decks, since)
+            if not payload['decks'] and not decks.exists():
+                payload['deleted']['decks'] = [int(deck_id)]
+        elif request.user.is_authenticated:
+            payload = sync.changes(
+                Deck.objects.filter(owner=request.user), since,
+                deleted_decks=Tombstone.objects.filter(kind=Tombstone.DECK, owner_id=request.user.pk),
+            )
+        else:
+            return Response({'error': 'Authentication required'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+        return Response(fastjson.encode(payload) if fastjson.enabled(request) else payload)
+
+
+class AnalyticsView(APIView):
+    """
+    Study volume, accuracy and retention curves
+    GET /api/analytics/?granularity=day|hour&days=30&deck={id}&scope=mine|deck
+    
+    Covers the user's own sessions, optionally for one deck. The owner of
+    a deck can pass scope=deck to see every learner's sessions on it.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        granularity = request.query_params.get('granularity', StudyBucket.DAY)
+        if granularity not in analytics.SECONDS:
+            return Response({'error': 'granularity must be hour or day'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        days = bounded_int(request, 'days', 30, analytics.MAX_DAYS[granularity])
+        scope = request.query_params.get('scope', 'mine')
+        filters = {'user': request.user}
+        deck_id = request.query_params.get('deck')
+        if deck_id:
+            try:
+                deck = Deck.objects.filter(pk=deck_id).first()
+            except (TypeError, ValueError):
+                deck = None
+            if deck is None:
+                raise Http404
+            filters['deck'] = deck
+            if scope == 'deck':
+                if deck.owner_id != request.user.pk:
+                    return Response({'error': 'Only the deck owner can see all learners'},
+                                    status=status.HTTP_403_FORBIDDEN)
+                del filters['user']
+        elif scope == 'deck':
+            return Response({'error': 'scope=deck requires a deck'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        analytics.refresh_if_stale()
+        return Response(analytics.report(granularity, days, **filters))
+
+
 class RegisterView(generics.CreateAPIView):
     """User registration endpoint"""
     queryset = User.objects.all()
@@ -240,5 +903,5 @@ class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        serializer = UserProfileSerializer(request.user)
+        serializer = UserProfileSerializer(stats.for_user(request.user))
         return Response(serializer.data)
@@ -24,6 +24,10 @@ REM Initialize demo data if needed
 echo Initializing demo data...
 python manage.py init_demo_data
 
+REM Start the background import worker in its own window
+echo Starting import worker...
+start "StudyHub import worker" cmd /k python manage.py run_import_worker
+
 REM Start server
 echo.
 echo ========================================
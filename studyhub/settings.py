@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flashcards.profiling.ProfilingMiddleware',
+    'flashcards.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -121,6 +123,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (queued deck imports)
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -135,11 +140,17 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'flashcards.fastjson.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.MultiPartParser',
         'rest_framework.parsers.FormParser',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'flashcards.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 # JWT Settings
@@ -157,6 +168,84 @@ CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 
 # File upload settings
+# Deck uploads are streamed (see flashcards/imports.py), so these limits do
+# not cap deck size: larger files spill to a temporary file on disk.
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 
+
+# Community feed: likes and comments lose half their trending weight
+# every this many hours. Run `manage.py rebuild_trending` after changing it.
+FLASHCARDS_TRENDING_HALF_LIFE_HOURS = 72
+
+# Number of cards fetched per round trip when streaming deck exports.
+FLASHCARDS_EXPORT_CHUNK_SIZE = 2000
+
+# Cards written per bulk INSERT during deck uploads.
+FLASHCARDS_IMPORT_BATCH_SIZE = 1000
+
+# Uploads larger than this many bytes are queued for the background import
+# worker (`manage.py run_import_worker`) and answered with 202 Accepted.
+FLASHCARDS_IMPORT_BACKGROUND_THRESHOLD = 1048576  # 1MB
+
+# Seconds between heartbeats of a running background import. Workers requeue
+# jobs whose heartbeat is older than --stale-after (300s by default), which
+# must be several heartbeats long.
+FLASHCARDS_IMPORT_HEARTBEAT_SECONDS = 30
+
+# Estimated Jaccard similarity of two cards' question+answer text above which
+# an uploaded card is reported (or skipped) as a near-duplicate.
+FLASHCARDS_DUPLICATE_THRESHOLD = 0.8
+
+# Answer events are buffered in-process and written in batches once this many
+# are waiting or the oldest has waited this many seconds. A size of 1 writes
+# every answer as soon as its request commits.
+FLASHCARDS_ANSWER_BUFFER_SIZE = 500
+FLASHCARDS_ANSWER_FLUSH_SECONDS = 2.0
+
+# /api/analytics reads the StudyBucket rollups kept by `manage.py
+# refresh_analytics`. A read rolls up pending sessions itself only when the
+# last rollup is older than this many seconds; None leaves it to the command.
+FLASHCARDS_ANALYTICS_REFRESH_SECONDS = 60
+
+# Request profiling (flashcards.profiling.ProfilingMiddleware). This fraction
+# of requests is timed in detail: SQL, serializer, view and render times. Staff
+# users (everyone with DEBUG on) get them in a Server-Timing header; turn
+# FLASHCARDS_SERVER_TIMING off to never send it.
+FLASHCARDS_PROFILE_SAMPLE_RATE = 0.01
+FLASHCARDS_SERVER_TIMING = True
+# Requests slower than this are logged with their slowest SQL statements
+# to a rotating JSON-lines file (unless LOGGING configures the
+# 'flashcards.slow_requests' logger itself).
+FLASHCARDS_SLOW_REQUEST_MS = 500
+FLASHCARDS_SLOW_SQL_COUNT = 5
+FLASHCARDS_SLOW_REQUEST_LOG = BASE_DIR / 'logs' / 'slow_requests.log'
+FLASHCARDS_SLOW_REQUEST_LOG_BYTES = 10 * 1024 * 1024
+FLASHCARDS_SLOW_REQUEST_LOG_BACKUPS = 5
+
+# Request metrics served at /metrics (flashcards.metrics). Each worker process
+# writes its numbers to this directory at most every FLASHCARDS_METRICS_FLUSH_SECONDS
+# and /metrics adds up all of them. /metrics is served to staff users and,
+# when a token is set, to scrapers sending "Authorization: Bearer <token>".
+# FLASHCARDS_METRICS_PUBLIC serves it to anyone.
+FLASHCARDS_METRICS_DIR = BASE_DIR / 'metrics'
+FLASHCARDS_METRICS_FLUSH_SECONDS = 1.0
+FLASHCARDS_METRICS_TOKEN = None
+FLASHCARDS_METRICS_PUBLIC = False
+
+# Deck detail, the flashcard list and the community listing skip the DRF
+# serializers and encode values_list() rows with orjson (flashcards.fastjson).
+# The output is byte-identical; turn this off to compare the two paths.
+FLASHCARDS_FAST_READS = True
+
+# Delta sync (/api/sync/). Each sync re-sends rows changed this many seconds
+# before the client's token, covering transactions that committed late.
+# Tombstones of deleted decks and cards are kept for the retention period
+# (purge_tombstones deletes older ones); older tokens get a full sync.
+FLASHCARDS_SYNC_OVERLAP_SECONDS = 60
+FLASHCARDS_SYNC_RETENTION_DAYS = 90
+
+# Admin changelists of tables over this many rows show the row count from
+# the database statistics (pg_class, or sqlite_stat1 once ANALYZE has run)
+# instead of running COUNT(*). Filtered and searched lists count exactly.
+FLASHCARDS_ADMIN_EXACT_COUNT_LIMIT = 100000